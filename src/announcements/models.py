@@ -84,6 +84,9 @@ class Announcement(models.Model):
         return reverse('announcements:list', kwargs={'ann_id': self.id})
 
     def get_comments(self):
+        # lists set the comments of a whole page at once, see CommentManager.prefetch_threads()
+        if hasattr(self, 'prefetched_comments'):
+            return self.prefetched_comments
         return Comment.objects.all_with_target_object(self)
 
     def not_yet_released(self):
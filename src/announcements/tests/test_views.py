@@ -1,7 +1,9 @@
 from datetime import timedelta
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.forms.models import model_to_dict
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
@@ -11,6 +13,7 @@ from model_bakery import baker
 
 from announcements.forms import AnnouncementForm
 from announcements.models import Announcement
+from comments.models import Comment, Document
 from hackerspace_online.tests.utils import ViewTestUtilsMixin
 from siteconfig.models import SiteConfig
 
@@ -311,6 +314,27 @@ class AnnouncementViewTests(ViewTestUtilsMixin, TenantTestCase):
         # assert the custom label (and the success message) are displayed
         self.assertContains(response, "CustomAnnouncement commented on")
 
+    def test_list__comments_prefetched(self):
+        """ The comments of all the announcements on the page are fetched together with their users, profiles and
+        documents, so the number of queries for them doesn't grow with the number of announcements that have comments """
+        self.client.force_login(self.test_student1)
+        tables = ('"comments_comment"', '"comments_document"', '"auth_user"', '"profile_manager_profile"')
+
+        def num_comment_queries():
+            # other queries grow too, e.g. the student is notified of each new announcement
+            with CaptureQueriesContext(connection) as context:
+                self.assert200('announcements:list')
+            return len([query for query in context.captured_queries if query['sql'].partition(' FROM ')[2].startswith(tables)])
+
+        Comment.objects.create_comment(user=self.test_student2, text="first!", path="/", target=self.test_announcement)
+        expected_num_queries = num_comment_queries()
+
+        for announcement in baker.make(Announcement, draft=False, _quantity=3):
+            comment = Comment.objects.create_comment(user=baker.make(User), text="comment", path="/", target=announcement)
+            baker.make(Document, comment=comment, docfile='documents/file.txt')
+
+        self.assertEqual(num_comment_queries(), expected_num_queries)
+
 
 class AnnouncementArchivedViewTests(ViewTestUtilsMixin, TenantTestCase):
     """ Tests for archived announcements view and other archived processes
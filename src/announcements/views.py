@@ -123,6 +123,9 @@ def list(request, ann_id=None, template='announcements/list.html'):
         # If page is out of range (e.g. 9999), deliver last page of results.
         object_list = paginator.page(paginator.num_pages)
 
+    # the comments of every announcement on the page, instead of a query (or more) per announcement
+    Comment.objects.prefetch_threads(object_list)
+
     comment_form = CommentForm(request.POST or None, label="")
 
     context = {
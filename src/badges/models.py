@@ -1,21 +1,24 @@
 import uuid
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, models
 from django.db.models import Max, Sum, Count, Q
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.functional import cached_property
 
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 
 from siteconfig.models import SiteConfig
 from notifications.signals import notify
 
 from prerequisites.models import Prereq, IsAPrereqMixin, HasPrereqsMixin
-from tags.models import TagsModelMixin
+from tags.models import TagsModelMixin, invalidate_tag_xp
 from notifications.models import notify_rank_up
 
 
@@ -120,18 +123,64 @@ class BadgeQuerySet(models.query.QuerySet):
         return self.filter(published=True)
 
 
+BadgeStats = namedtuple('BadgeStats', ['num_assertions', 'num_earners', 'fraction', 'rarity'])
+
+
 class BadgeManager(models.Manager):
     def get_queryset(self):
         return BadgeQuerySet(self.model, using=self._db).order_by('sort_order')
 
+    STATS_TIMEOUT = 60 * 60
+
+    @staticmethod
+    def stats_cache_key():
+        return f'{connection.schema_name}-badge-stats'
+
+    def calculate_stats(self):
+        """
+        Count the assertions and earners of every badge with one grouped query, and assign each badge its rarity.
+
+        :return: {badge_id: BadgeStats}, and the stats of badges that haven't been granted under the key None
+        """
+        num_active_users = User.objects.filter(is_active=True).count() or 1
+        rarities = list(BadgeRarity.objects.all())
+
+        def get_rarity(fraction):
+            # same as BadgeRarity.objects.get_rarity(), without a query per badge
+            percentile = min(fraction * 100, 100)
+            return next((rarity for rarity in rarities if rarity.percentile >= percentile), None)
+
+        granted = BadgeAssertion.objects.order_by().values('badge_id').annotate(
+            num_assertions=Count('id'),
+            num_earners=Count('user_id', distinct=True),
+        )
+        stats = {None: BadgeStats(0, 0, 0.0, get_rarity(0.0))}
+        for row in granted:
+            fraction = row['num_assertions'] / num_active_users
+            stats[row['badge_id']] = BadgeStats(row['num_assertions'], row['num_earners'], fraction, get_rarity(fraction))
+        return stats
+
+    def all_stats(self):
+        """The stats of every badge, cached until an assertion or rarity changes, and refreshed at least every
+        STATS_TIMEOUT seconds so they follow the number of active users.
+        """
+        stats = cache.get(self.stats_cache_key())
+        if stats is None:
+            stats = self.calculate_stats()
+            cache.set(self.stats_cache_key(), stats, self.STATS_TIMEOUT)
+        return stats
+
+    def get_stats(self, badge):
+        stats = self.all_stats()
+        return stats.get(badge.id, stats[None])
+
+    def invalidate_stats(self):
+        cache.delete(self.stats_cache_key())
+
     # this should be generic and placed in the prerequisites app
     # extend models.Model (e.g. PrereqModel) and prereq users should subclass it
     def get_conditions_met(self, user):
-        pk_met_list = [
-            obj.pk for obj in self.get_queryset().get_published()
-            if Prereq.objects.all_conditions_met(obj, user, False)
-            # if not obj.badge_type.manual_only and Prereq.objects.all_conditions_met(obj, user)
-        ]
+        pk_met_list = Prereq.objects.all_conditions_met_ids(self.get_queryset().get_published(), user, no_prereq_means=False)
         return self.filter(pk__in=pk_met_list)
 
     def all_manually_granted(self):
@@ -192,17 +241,18 @@ class Badge(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, models.Model):
         else:
             return SiteConfig.get().get_default_icon_url()
 
-    # @cached_property
+    @cached_property
+    def stats(self):
+        return Badge.objects.get_stats(self)
+
     def fraction_of_active_users_granted_this(self):
-        num_assertions = BadgeAssertion.objects.filter(badge=self).count()
-        return num_assertions / User.objects.filter(is_active=True).count()
+        return self.stats.fraction
 
     def percent_of_active_users_granted_this(self):
         return self.fraction_of_active_users_granted_this() * 100
 
     def get_rarity_icon(self):
-        percentile = self.percent_of_active_users_granted_this()
-        badge_rarity = BadgeRarity.objects.get_rarity(percentile)
+        badge_rarity = self.stats.rarity
         if badge_rarity:
             return badge_rarity.get_icon_html()
         else:
@@ -216,6 +266,20 @@ class Badge(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, models.Model):
         # print("num_approved: " + str(num_approved) + "/" + str(num_required))
         return num_approved >= num_required
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        badge_ids = set(cls.objects.filter(id__in={object_id for object_id, _ in requirements}).values_list('id', flat=True))
+        num_approved = dict(
+            BadgeAssertion.objects.get_queryset().get_user(user).filter(badge_id__in=badge_ids)
+            .order_by().values_list('badge_id').annotate(Count('id'))
+        )
+        return {
+            (object_id, num_required): num_approved.get(object_id, 0) >= num_required
+            for object_id, num_required in requirements if object_id in badge_ids
+        }
+
 
 class BadgeAssertionQuerySet(models.query.QuerySet):
     def get_user(self, user):
@@ -314,18 +378,126 @@ class BadgeAssertionManager(models.Manager):
         )
         new_assertion.full_clean()
         new_assertion.save()
-        user.profile.xp_invalidate_cache()  # recalculate user's XP
         return new_assertion
 
+    def bulk_create_assertions(self, users, badge, issued_by=None, transfer=False, active_semester=None):
+        """
+        Grant `badge` to each of `users` at once.  The ordinals are computed with one query, the assertions are
+        inserted with bulk_create, and the students are notified with one notification fan-out.  The XP, rank-up and
+        available quest refresh for the students is scheduled as one task, badges.tasks.refresh_users_granted_badge
+
+        :return: a list of the new BadgeAssertions
+        """
+        from badges.tasks import refresh_users_granted_badge
+
+        users = list(users)
+        if not users:
+            return []
+
+        config = SiteConfig.get()
+        if issued_by is None:
+            issued_by = config.deck_ai
+
+        if not active_semester:
+            active_semester = config.active_semester.id
+
+        num_assertions = dict(
+            self.get_queryset().get_badge(badge).filter(user__in=users)
+            .order_by().values_list('user_id').annotate(Max('ordinal'))
+        )
+        new_assertions = self.bulk_create([
+            BadgeAssertion(
+                badge=badge,
+                user=user,
+                ordinal=(num_assertions.get(user.id) or 0) + 1,
+                issued_by=issued_by,
+                do_not_grant_xp=transfer,
+                semester_id=active_semester,
+            ) for user in users
+        ])
+
+        # bulk_create doesn't send post_save, so do what the receivers would have done, once for all the students
+        Badge.objects.invalidate_stats()
+        invalidate_tag_xp([user.id for user in users])
+        notify_badge_granted(badge, issued_by, users)
+        refresh_users_granted_badge.apply_async(args=[badge.id, [user.id for user in users]], queue='default')
+        return new_assertions
+
     def check_for_new_assertions(self, user, transfer=False):
-        badges = Badge.objects.get_conditions_met(user)
-        for badge in badges:
-            # if the badge doesn't already exist
-            if not self.all_for_user_badge(user, badge, False):
-                self.create_assertion(user, badge, None, transfer)
-                # if a new badge has been granted, then check again recursively.
-                # maybe this should be celeried?
-                self.check_for_new_assertions(user, transfer)
+        """
+        Grant every published badge whose prerequisites the user has met and that they haven't earned yet.
+
+        All the badges are evaluated once, then after each round of grants only the badges that rely on the newly
+        granted badges (or on any Rank, when their XP changed the user's XP) are evaluated again, until nothing new is
+        granted.  Each round's assertions are inserted in bulk and their XP is added to the user's ledger, and the
+        notifications and available quests are updated once at the end.
+
+        :return: a list of the new BadgeAssertions
+        """
+        from courses.models import Rank
+        from prerequisites.signals import get_changed_prereq_keys
+        from prerequisites.tasks import update_quest_conditions_for_user
+        from profile_manager.models import XPLedgerEntry
+
+        badge_ct = ContentType.objects.get_for_model(Badge)
+        rank_ct = ContentType.objects.get_for_model(Rank)
+        earned_ids = set(self.get_queryset().get_user(user).values_list('badge_id', flat=True))
+        candidates = Badge.objects.get_queryset().get_published().exclude(pk__in=earned_ids)
+
+        config = SiteConfig.get()
+        old_xp = user.profile.xp_cached
+        new_assertions = []
+        while True:
+            met_ids = [pk for pk in Prereq.objects.all_conditions_met_ids(candidates, user, no_prereq_means=False)
+                       if pk not in earned_ids]
+            if not met_ids:
+                break
+
+            # these badges are new to the user, so each is their first assertion of it
+            new_assertions += self.bulk_create([
+                BadgeAssertion(
+                    badge_id=badge_id,
+                    user=user,
+                    ordinal=1,
+                    issued_by=config.deck_ai,
+                    do_not_grant_xp=transfer,
+                    semester_id=config.active_semester.id,
+                ) for badge_id in met_ids
+            ])
+            earned_ids.update(met_ids)
+
+            # Rank prerequisites are checked against the user's cached XP, so add this round's XP before the next one
+            xp = user.profile.xp_cached
+            XPLedgerEntry.objects.reconcile_badge_xp(user=user)
+            changed_keys = {(badge_ct.id, badge_id) for badge_id in met_ids}
+            if user.profile.xp_cached != xp:
+                changed_keys.add((rank_ct.id, None))
+
+            reliant_keys = Prereq.objects.all_reliant_parents(changed_keys)
+            candidates = Badge.objects.get_queryset().get_published().filter(
+                pk__in={object_id for content_type_id, object_id in reliant_keys if content_type_id == badge_ct.id}
+            ).exclude(pk__in=earned_ids)
+
+        if not new_assertions:
+            return new_assertions
+
+        # bulk_create doesn't send post_save, so do what the receivers would have done, once for the whole pass
+        Badge.objects.invalidate_stats()
+        invalidate_tag_xp([user.id])
+
+        badges = Badge.objects.select_related('badge_type').in_bulk([assertion.badge_id for assertion in new_assertions])
+        for assertion in new_assertions:
+            assertion.badge = badges[assertion.badge_id]
+            notify_badge_granted(assertion.badge, assertion.issued_by, [user])
+        if not transfer:
+            notify_rank_up(user, old_xp, user.profile.xp_cached)
+
+        # the same keys the post_save receiver would have sent for each assertion, including any Rank for the new XP
+        changed_prereq_keys = {
+            tuple(key): key for assertion in new_assertions for key in get_changed_prereq_keys(assertion)
+        }
+        update_quest_conditions_for_user.apply_async(args=[user.id, list(changed_prereq_keys.values())], queue='default')
+        return new_assertions
 
     def get_by_type_for_user(self, user):
         self.check_for_new_assertions(user)
@@ -400,33 +572,44 @@ class BadgeAssertion(models.Model):
         return BadgeAssertion.objects.all_for_user_badge(self.user, self.badge, False)
 
 
+def notify_badge_granted(badge, issued_by, users):
+    """ Notify each of `users` that they were granted `badge` """
+    # need an issuing object, fix this better, should be generic something "Hackerspace or "Automatic".
+    sender = issued_by
+    if sender is None:
+        sender = User.objects.filter(is_staff=True).first()
+
+    fa_icon = badge.badge_type.fa_icon
+
+    if not fa_icon:
+        fa_icon = "fa-certificate"
+
+    icon = "<i class='text-warning fa fa-lg fa-fw "
+    icon += fa_icon
+    icon += "'></i>"
+
+    notify.send(
+        sender,
+        # action= action,
+        target=badge,
+        recipient=users[0],
+        affected_users=users,
+        icon=icon,
+        verb="granted you a")
+
+
+@receiver([post_save, post_delete], sender=BadgeAssertion, dispatch_uid="badges.models.invalidate_badge_stats")
+@receiver([post_save, post_delete], sender=BadgeRarity, dispatch_uid="badges.models.invalidate_badge_stats_rarity")
+def invalidate_badge_stats(sender, **kwargs):
+    Badge.objects.invalidate_stats()
+
+
 # only receive signals from BadgeAssertion model
 @receiver(post_save, sender=BadgeAssertion)
 def post_save_receiver(sender, **kwargs):
     assertion = kwargs["instance"]
     if kwargs["created"]:
-        # need an issuing object, fix this better, should be generic something "Hackerspace or "Automatic".
-        sender = assertion.issued_by
-        if sender is None:
-            sender = User.objects.filter(is_staff=True).first()
-
-        fa_icon = assertion.badge.badge_type.fa_icon
-
-        if not fa_icon:
-            fa_icon = "fa-certificate"
-
-        icon = "<i class='text-warning fa fa-lg fa-fw "
-        icon += fa_icon
-        icon += "'></i>"
-
-        notify.send(
-            sender,
-            # action= action,
-            target=assertion.badge,
-            recipient=assertion.user,
-            affected_users=[assertion.user, ],
-            icon=icon,
-            verb="granted you a")
+        notify_badge_granted(assertion.badge, assertion.issued_by, [assertion.user])
 
         # if user ranked up notify them
         if not assertion.do_not_grant_xp:
@@ -434,6 +617,6 @@ def post_save_receiver(sender, **kwargs):
                 assertion.user,
                 assertion.user.profile.xp_cached,
 
-                # since post-save signal. this is before user.profile.xp_invalidate_cache()
+                # this receiver runs before the XP ledger records the assertion and updates xp_cached
                 assertion.user.profile.xp_cached + assertion.badge.xp,
             )
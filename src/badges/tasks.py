@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+
+from hackerspace_online.celery import app
+
+from notifications.models import notify_rank_up
+from prerequisites.signals import get_changed_prereq_keys
+from prerequisites.tasks import TransactionAwareTask, update_quest_conditions_for_user
+from profile_manager.models import Profile, XPLedgerEntry
+
+from .models import BadgeAssertion
+
+User = get_user_model()
+
+
+@app.task(base=TransactionAwareTask, name='badges.tasks.refresh_users_granted_badge')
+def refresh_users_granted_badge(badge_id, user_ids):
+    """
+    After a badge was granted to many students at once, record the XP of their new assertions in one pass,
+    notify the students that ranked up, and update the students' caches of available quests.
+    """
+    old_xp = dict(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'xp_cached'))
+    XPLedgerEntry.objects.reconcile_badge_xp(badge=badge_id)
+    new_xp = dict(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'xp_cached'))
+
+    xp_changed_ids = [user_id for user_id, xp in new_xp.items() if xp != old_xp.get(user_id)]
+    for user in User.objects.filter(id__in=xp_changed_ids):
+        notify_rank_up(user, old_xp[user.id], new_xp[user.id])
+
+    # the same keys the post_save receiver sends for a single assertion, including any Rank for the new XP
+    changed_prereq_keys = get_changed_prereq_keys(BadgeAssertion(badge_id=badge_id))
+    for user_id in user_ids:
+        update_quest_conditions_for_user.apply_async(args=[user_id, changed_prereq_keys], queue='default')
+
+    return f"Refreshed {len(user_ids)} students granted badge {badge_id}."
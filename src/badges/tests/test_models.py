@@ -1,5 +1,8 @@
 from unittest import mock
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from django_tenants.test.cases import TenantTestCase
@@ -7,9 +10,12 @@ from django_tenants.test.client import TenantClient
 from model_bakery import baker
 from model_bakery.recipe import Recipe
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, tenant_queries
 from badges.models import Badge, BadgeAssertion, BadgeRarity, BadgeSeries, BadgeType
+from courses.models import Rank
 from siteconfig.models import SiteConfig
 from notifications.models import Notification
+from quest_manager.models import Quest, QuestSubmission
 
 User = get_user_model()
 
@@ -69,7 +75,7 @@ class BadgeSeriesTestModel(TenantTestCase):
         self.assertEqual(str(self.badge_series), self.badge_series.name)
 
 
-class BadgeTestModel(TenantTestCase):
+class BadgeTestModel(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.client = TenantClient(self.tenant)
@@ -94,32 +100,62 @@ class BadgeTestModel(TenantTestCase):
     def test_badge_url(self):
         self.assertEqual(self.client.get(self.badge.get_absolute_url(), follow=True).status_code, 200)
 
-    @mock.patch('badges.models.BadgeRarity.objects.get_rarity')
-    def test_get_rarity_icon__without_rarity(self, mock_get_rarity):
-        mock_get_rarity.return_value = None
+    def test_get_rarity_icon__without_rarity(self):
+        BadgeRarity.objects.all().delete()
+
+        self.assertEqual(self.badge.get_rarity_icon(), '')
+
+    def test_get_rarity_icon__with_rarity(self):
+        BadgeRarity.objects.all().delete()
+        rarity = baker.make(BadgeRarity, name='Common', percentile=100.0)
+
+        self.assertEqual(self.badge.get_rarity_icon(), rarity.get_icon_html())
+
+    def test_calculate_stats(self):
+        """ Stats count every assertion and each distinct earner, and assign the rarity by the fraction of active users """
+        BadgeRarity.objects.all().delete()
+        rare = baker.make(BadgeRarity, name='Rare', percentile=10.0)
+        common = baker.make(BadgeRarity, name='Common', percentile=100.0)
+        student = baker.make(User)
+        baker.make(BadgeAssertion, user=student, badge=self.badge, _quantity=2)
+
+        stats = Badge.objects.calculate_stats()
+
+        num_active_users = User.objects.filter(is_active=True).count()
+        self.assertEqual(stats[self.badge.id], (2, 1, 2 / num_active_users, common))
+        # badges that haven't been granted
+        self.assertEqual(stats[None], (0, 0, 0.0, rare))
+        self.assertEqual(Badge.objects.get_stats(baker.make(Badge)), stats[None])
+
+    def test_calculate_stats__queries_independent_of_number_of_badges(self):
+        """ One grouped query for all the assertions, plus counting active users and loading the rarities """
+        for badge in baker.make(Badge, _quantity=5):
+            baker.make(BadgeAssertion, badge=badge, _quantity=2)
+
+        with self.assertNumTenantQueries(3):
+            Badge.objects.calculate_stats()
 
-        result = self.badge.get_rarity_icon()
+    def test_get_rarity_icon__cached(self):
+        """ Once the stats are cached, rendering the rarity of any badge doesn't query the database """
+        badges = baker.make(Badge, _quantity=5)
+        self.badge.get_rarity_icon()
 
-        mock_get_rarity.assert_called_once()
-        self.assertEqual(result, '')
+        with self.assertNumTenantQueries(0):
+            for badge in badges:
+                badge.get_rarity_icon()
+                badge.percent_of_active_users_granted_this()
 
-    @mock.patch('badges.models.BadgeRarity.objects.get_rarity')
-    @mock.patch('badges.models.Badge.percent_of_active_users_granted_this')
-    def test_get_rarity_icon__with_rarity(self, mock_percentile, mock_get_rarity):
-        mock_percentile.return_value = 80  # Set the desired percentile value
-        mock_badge_rarity = mock.Mock()
-        mock_badge_rarity.get_icon_html.return_value = '<span class="badge-icon">Icon</span>'
-        mock_get_rarity.return_value = mock_badge_rarity
+    def test_stats__invalidated_when_assertions_change(self):
+        self.assertEqual(Badge.objects.get_stats(self.badge).num_assertions, 0)
 
-        result = self.badge.get_rarity_icon()
+        assertion = baker.make(BadgeAssertion, badge=self.badge)
+        self.assertEqual(Badge.objects.get_stats(self.badge).num_assertions, 1)
 
-        mock_percentile.assert_called_once()
-        mock_get_rarity.assert_called_once_with(80)  # Verify the correct percentile is passed
-        mock_badge_rarity.get_icon_html.assert_called_once()
-        self.assertEqual(result, '<span class="badge-icon">Icon</span>')
+        assertion.delete()
+        self.assertEqual(Badge.objects.get_stats(self.badge).num_assertions, 0)
 
 
-class BadgeAssertionManagerTest(TenantTestCase):
+class BadgeAssertionManagerTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.client = TenantClient(self.tenant)
@@ -202,6 +238,107 @@ class BadgeAssertionManagerTest(TenantTestCase):
         qs = BadgeAssertion.objects.all_for_user_distinct(user=self.student)
         self.assertQuerysetEqual(qs, [badge_assertion3, badge_assertion2, badge_assertion])
 
+    def test_bulk_create_assertions(self):
+        """ Each student gets the next ordinal of the badge, a notification, and one refresh task is scheduled for all """
+        badge = baker.make(Badge, xp=10)
+        students = baker.make(User, _quantity=3)
+        BadgeAssertion.objects.bulk_create([BadgeAssertion(user=students[0], badge=badge, ordinal=1)])
+
+        with mock.patch('badges.tasks.refresh_users_granted_badge.apply_async') as refresh:
+            new_assertions = BadgeAssertion.objects.bulk_create_assertions(students, badge)
+
+        self.assertEqual([assertion.ordinal for assertion in new_assertions], [2, 1, 1])
+        self.assertEqual(BadgeAssertion.objects.filter(badge=badge).count(), 4)
+        for student in students:
+            self.assertEqual(Notification.objects.all_for_user(student).filter(verb="granted you a").count(), 1)
+        refresh.assert_called_once_with(args=[badge.id, [student.id for student in students]], queue='default')
+
+    def test_bulk_create_assertions__ordinals_in_one_query(self):
+        """ The number of queries doesn't depend on how many assertions the students already have """
+        badge = baker.make(Badge)
+        students = baker.make(User, _quantity=5)
+
+        def count_queries():
+            with mock.patch('badges.tasks.refresh_users_granted_badge.apply_async'), \
+                    mock.patch('badges.models.notify_badge_granted'), \
+                    CaptureQueriesContext(connection) as context:
+                BadgeAssertion.objects.bulk_create_assertions(students, badge)
+            return len(tenant_queries(context))
+
+        first = count_queries()
+        self.assertEqual(count_queries(), first)
+
+    def make_badge_chain(self):
+        """ Returns a quest and three badges that each require the one before it, starting with the quest """
+        quest = baker.make(Quest)
+        first = baker.make(Badge, name='First', xp=5)
+        second = baker.make(Badge, name='Second', xp=10)
+        third = baker.make(Badge, name='Third', xp=20)
+        first.add_simple_prereqs([quest])
+        second.add_simple_prereqs([first])
+        third.add_simple_prereqs([second])
+        return quest, [first, second, third]
+
+    def test_check_for_new_assertions__grants_badge_chain(self):
+        """ Granting a badge grants the badges that rely on it in the same pass, and the XP is refreshed once """
+        quest, chain = self.make_badge_chain()
+        unrelated = baker.make(Badge, name='Unrelated')
+        unrelated.add_simple_prereqs([baker.make(Quest)])
+        baker.make(QuestSubmission, user=self.student, quest=quest, semester=self.sem, is_completed=True, is_approved=True)
+
+        new_assertions = BadgeAssertion.objects.check_for_new_assertions(self.student)
+
+        self.assertCountEqual([assertion.badge for assertion in new_assertions], chain)
+        self.assertCountEqual(
+            BadgeAssertion.objects.filter(user=self.student).values_list('badge_id', flat=True),
+            [badge.id for badge in chain],
+        )
+        self.assertTrue(all(assertion.ordinal == 1 for assertion in new_assertions))
+        self.assertEqual(self.student.profile.xp_cached, 35)
+        self.assertEqual(
+            Notification.objects.all_for_user(self.student).filter(verb="granted you a").count(), 3
+        )
+
+    def test_check_for_new_assertions__already_earned(self):
+        """ Badges the user has already earned are not granted again """
+        quest, chain = self.make_badge_chain()
+        baker.make(QuestSubmission, user=self.student, quest=quest, semester=self.sem, is_completed=True, is_approved=True)
+
+        BadgeAssertion.objects.check_for_new_assertions(self.student)
+        self.assertEqual(BadgeAssertion.objects.check_for_new_assertions(self.student), [])
+        self.assertEqual(BadgeAssertion.objects.filter(user=self.student).count(), len(chain))
+
+    def test_check_for_new_assertions__transfer(self):
+        """ Transferred badges don't grant XP """
+        quest, chain = self.make_badge_chain()
+        baker.make(QuestSubmission, user=self.student, quest=quest, semester=self.sem, is_completed=True, is_approved=True)
+
+        new_assertions = BadgeAssertion.objects.check_for_new_assertions(self.student, transfer=True)
+
+        self.assertEqual(len(new_assertions), len(chain))
+        self.assertTrue(all(assertion.do_not_grant_xp for assertion in new_assertions))
+        self.assertEqual(self.student.profile.xp_cached, 0)
+
+    @mock.patch('prerequisites.tasks.update_quest_conditions_for_user.apply_async')
+    def test_check_for_new_assertions__rank_chain(self, mock_update_quests):
+        """ A badge whose XP reaches a Rank grants the badges that require that Rank in the same pass,
+        and the quests that rely on any Rank are updated """
+        quest = baker.make(Quest)
+        first = baker.make(Badge, name='First', xp=50)
+        first.add_simple_prereqs([quest])
+        rank = baker.make(Rank, name='Fifty', xp=50)
+        second = baker.make(Badge, name='Second', xp=10)
+        second.add_simple_prereqs([rank])
+        baker.make(QuestSubmission, user=self.student, quest=quest, semester=self.sem, is_completed=True, is_approved=True)
+
+        new_assertions = BadgeAssertion.objects.check_for_new_assertions(self.student)
+
+        self.assertCountEqual([assertion.badge for assertion in new_assertions], [first, second])
+        self.assertEqual(self.student.profile.xp_cached, 60)
+        changed_prereq_keys = mock_update_quests.call_args.kwargs['args'][1]
+        self.assertIn([ContentType.objects.get_for_model(Rank).id, None], changed_prereq_keys)
+        self.assertIn([ContentType.objects.get_for_model(Badge).id, second.id], changed_prereq_keys)
+
 
 class BadgeAssertionTestModel(TenantTestCase):
 
@@ -0,0 +1,82 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from badges.models import Badge, BadgeAssertion
+from badges.tasks import refresh_users_granted_badge
+from courses.models import Rank
+from notifications.models import Notification
+from prerequisites.models import PrereqAllConditionsMet
+from prerequisites.tasks import update_quest_conditions_for_user
+from profile_manager.models import XPLedgerEntry
+from quest_manager.models import Quest
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
+
+
+class BadgeTasksTests(TenantTestCase):
+    """
+    Run tasks (from tenant module) asyncronously with apply()
+    """
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.badge = baker.make(Badge, xp=100)
+        self.students = baker.make(User, _quantity=2)
+
+    @mock.patch('badges.tasks.update_quest_conditions_for_user.apply_async')
+    def test_refresh_users_granted_badge(self, update_quest_conditions):
+        """ Records the XP of the bulk created assertions, notifies students that ranked up,
+        and updates each student's available quests """
+        BadgeAssertion.objects.bulk_create([
+            BadgeAssertion(user=student, badge=self.badge, semester=self.sem) for student in self.students
+        ])
+
+        refresh_users_granted_badge.apply(args=[self.badge.id, [student.id for student in self.students]])
+
+        for student in self.students:
+            student.profile.refresh_from_db()
+            self.assertEqual(student.profile.xp_cached, 100)
+            self.assertEqual(XPLedgerEntry.objects.filter(user=student, badge=self.badge).count(), 1)
+            self.assertTrue(Notification.objects.all_for_user(student).filter(verb="promoted you to").exists())
+        self.assertEqual(update_quest_conditions.call_count, len(self.students))
+
+    @mock.patch('badges.tasks.update_quest_conditions_for_user.apply_async')
+    def test_refresh_users_granted_badge__transfer(self, update_quest_conditions):
+        """ Transferred assertions don't grant XP, so nobody ranks up """
+        BadgeAssertion.objects.bulk_create([
+            BadgeAssertion(user=student, badge=self.badge, semester=self.sem, do_not_grant_xp=True)
+            for student in self.students
+        ])
+
+        refresh_users_granted_badge.apply(args=[self.badge.id, [student.id for student in self.students]])
+
+        for student in self.students:
+            student.profile.refresh_from_db()
+            self.assertEqual(student.profile.xp_cached, 0)
+            self.assertFalse(Notification.objects.all_for_user(student).filter(verb="promoted you to").exists())
+        self.assertEqual(update_quest_conditions.call_count, len(self.students))
+
+    @mock.patch('badges.tasks.update_quest_conditions_for_user.apply_async')
+    def test_refresh_users_granted_badge__crosses_rank(self, update_quest_conditions):
+        """ Quests that require a Rank become available to the students whose XP reached it from the bulk grant """
+        rank = baker.make(Rank, name='Hundred', xp=100)
+        quest = baker.make(Quest)
+        quest.add_simple_prereqs([rank])
+        for student in self.students:
+            baker.make(PrereqAllConditionsMet, user=student, model_name=Quest.get_model_name(), ids=[])
+        BadgeAssertion.objects.bulk_create([
+            BadgeAssertion(user=student, badge=self.badge, semester=self.sem) for student in self.students
+        ])
+
+        refresh_users_granted_badge.apply(args=[self.badge.id, [student.id for student in self.students]])
+
+        for call in update_quest_conditions.call_args_list:
+            self.assertIn([ContentType.objects.get_for_model(Rank).id, None], call.kwargs['args'][1])
+            update_quest_conditions_for_user.apply(args=call.kwargs['args'])
+        for student in self.students:
+            self.assertIn(quest.id, PrereqAllConditionsMet.objects.get(user=student, model_name=Quest.get_model_name()).ids)
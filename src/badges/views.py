@@ -231,9 +231,11 @@ def bulk_assertion_create(request, badge_id=None):
         # TODO: Why does this form use Profile model instead of User model?
         profiles = form.cleaned_data['students']
 
+        profiles = list(profiles.select_related('user'))
+        BadgeAssertion.objects.bulk_create_assertions([profile.user for profile in profiles], badge)
+
         result_message = f"{SiteConfig.get().custom_name_for_badge} {str(badge)} granted to "
         for profile in profiles:
-            BadgeAssertion.objects.create_assertion(profile.user, badge)
             result_message += profile.preferred_full_name() + "; "
 
         messages.success(request, result_message)
@@ -5,6 +5,7 @@ from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.db.models import Q
 from django.utils.html import escape
 from utilities.html import urlize
 
@@ -27,6 +28,10 @@ class CommentQuerySet(models.query.QuerySet):
     def get_no_parents(self):
         return self.filter(parent=None)
 
+    def with_thread_relations(self):
+        """ Gets the users, profiles and attached documents shown with each comment in comments.html """
+        return self.select_related('user__profile').prefetch_related('document_set')
+
 
 class CommentManager(models.Manager):
     def get_queryset(self):
@@ -34,7 +39,31 @@ class CommentManager(models.Manager):
         return qs.select_related('user')
 
     def all_with_target_object(self, object):
-        return self.get_queryset().get_object_target(object).get_no_parents()
+        return self.get_queryset().get_object_target(object).get_no_parents().with_thread_relations()
+
+    def prefetch_threads(self, objects):
+        """ Gets the comment threads of all the objects (e.g. a page of announcements) with a single query, plus one for
+        their documents, and sets each object's `prefetched_comments` so its `get_comments()` doesn't query again.
+
+        Returns:
+            list: the objects
+        """
+        objects = list(objects)
+        content_types = ContentType.objects.get_for_models(*{type(object) for object in objects})
+
+        threads = {(content_types[type(object)].id, object.id): [] for object in objects}
+        targets = Q()
+        for model, content_type in content_types.items():
+            object_ids = [object.id for object in objects if type(object) is model]
+            targets |= Q(target_content_type=content_type, target_object_id__in=object_ids)
+
+        if threads:
+            for comment in self.get_queryset().filter(targets).get_no_parents().with_thread_relations():
+                threads[(comment.target_content_type_id, comment.target_object_id)].append(comment)
+
+        for object in objects:
+            object.prefetched_comments = threads[(content_types[type(object)].id, object.id)]
+        return objects
 
     # def all(self):
     #     return self.get_queryset.get_active().get_no_parents()
@@ -6,12 +6,15 @@ from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 from model_bakery.recipe import Recipe
 
-from comments.models import Comment, clean_html
+from hackerspace_online.tests.utils import TenantTestUtilsMixin
+from announcements.models import Announcement
+from comments.models import Comment, Document, clean_html
+from quest_manager.models import QuestSubmission
 
 User = get_user_model()
 
 
-class CommentManagerTest(TenantTestCase):
+class CommentManagerTest(TenantTestUtilsMixin, TenantTestCase):
 
     def test_create_comment__with_required_parameters(self):
         user = baker.make(User)
@@ -55,6 +58,33 @@ class CommentManagerTest(TenantTestCase):
         self.assertEqual(comment.target_object_id, target.id)
         self.assertEqual(comment.parent, parent)
 
+    def test_prefetch_threads(self):
+        """ The comment threads of several objects, of different models, are fetched with a query for the comments and
+        one for their documents, and nothing else is queried to show them """
+        user = baker.make(User)
+        announcements = baker.make('announcements.Announcement', _quantity=3)
+        submission = baker.make('quest_manager.QuestSubmission')
+        comment1 = Comment.objects.create_comment(user=user, text="1", path="/", target=announcements[0])
+        comment2 = Comment.objects.create_comment(user=user, text="2", path="/", target=announcements[0])
+        comment3 = Comment.objects.create_comment(user=user, text="3", path="/", target=submission)
+        # replies aren't part of the thread
+        Comment.objects.create_comment(user=user, text="reply", path="/", target=announcements[0], parent=comment1)
+        baker.make(Document, comment=comment3, docfile='documents/file.txt')
+
+        objects = [*Announcement.objects.filter(pk__in=[a.pk for a in announcements]), submission]
+        ContentType.objects.get_for_models(Announcement, QuestSubmission)  # content types are cached after this
+        with self.assertNumTenantQueries(2):
+            self.assertEqual(Comment.objects.prefetch_threads(objects), objects)
+
+        with self.assertNumQueries(0):
+            self.assertCountEqual(objects[0].get_comments(), [comment1, comment2])
+            self.assertEqual(objects[1].get_comments(), [])
+            self.assertEqual(objects[3].get_comments(), [comment3])
+            self.assertEqual(objects[3].get_comments()[0].user.profile, user.profile)
+            self.assertEqual(len(objects[3].get_comments()[0].document_set.all()), 1)
+
+        self.assertEqual(Comment.objects.prefetch_threads([]), [])
+
 
 class CleanHTMLTests(TestCase):
     def test_format_unformatted_links(self):
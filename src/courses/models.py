@@ -1,10 +1,12 @@
+from bisect import bisect_right
 from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.validators import validate_comma_separated_integer_list
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import connection, models
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
@@ -17,33 +19,84 @@ from quest_manager.models import QuestSubmission
 from siteconfig.models import SiteConfig
 
 
+class MarkRangeIndex:
+    """ The active MarkRanges of a tenant for each weekday, sorted by minimum_mark, with the ids of the courses each
+    one is limited to.  Built once from two queries and cached (see MarkRangeManager.index()), so finding the range
+    of a mark is a lookup instead of a query for every page a student views.
+    """
+
+    def __init__(self, mark_ranges, course_ids):
+        """
+        Args:
+            mark_ranges: the active MarkRanges
+            course_ids: {mark range id: set of course ids}, ranges that aren't in it apply to all courses
+        """
+        # {weekday: [(minimum_mark, id, course ids, MarkRange)]}, where Monday=1 and Sunday=7
+        self.ranges = {day: [] for day in range(1, 8)}
+        for mark_range in mark_ranges:
+            entry = (mark_range.minimum_mark, mark_range.pk, frozenset(course_ids.get(mark_range.pk, ())), mark_range)
+            for day in self.ranges:
+                if str(day) in mark_range.days:
+                    self.ranges[day].append(entry)
+
+        for ranges in self.ranges.values():
+            # ranges with the same minimum mark are ordered by when they were created
+            ranges.sort(key=lambda entry: entry[:2])
+
+    def get_range(self, mark, course_ids=(), day=None):
+        """ The highest range on this day (default: today) whose minimum is <= mark, out of the ranges for all courses
+        and the ranges for any of these courses """
+        if mark is None:
+            return None
+        if day is None:
+            day = timezone.localtime(timezone.now()).isoweekday()
+
+        ranges = self.ranges[day]
+        course_ids = set(course_ids)
+        # skip the ranges that are too high, then return the highest one that applies to these courses
+        for _, _, range_course_ids, mark_range in reversed(ranges[:bisect_right(ranges, mark, key=lambda entry: entry[0])]):
+            if not range_course_ids or not range_course_ids.isdisjoint(course_ids):
+                return mark_range
+        return None
+
+
 class MarkRangeManager(models.Manager):
+    def index_cache_key(self):
+        return f'{connection.schema_name}-markrange-index'
+
+    def invalidate_index(self):
+        cache.delete(self.index_cache_key())
+
+    def index(self):
+        """ The MarkRangeIndex of this tenant, cached until a MarkRange or a Course changes """
+        index = cache.get(self.index_cache_key())
+        if index is None:
+            mark_ranges = list(self.get_queryset().filter(active=True))
+            course_ids = {}
+            through = self.model.courses.through.objects.filter(markrange__active=True)
+            for mark_range_id, course_id in through.values_list('markrange_id', 'course_id'):
+                course_ids.setdefault(mark_range_id, set()).add(course_id)
+
+            index = MarkRangeIndex(mark_ranges, course_ids)
+            cache.set(self.index_cache_key(), index, self.model.INDEX_TIMEOUT)
+        return index
+
     def get_range(self, mark, courses=None):
         """ return the MarkRange encompassed by this mark adn the list of courses """
-        self.get_queryset().filter(active=True)
-        day = timezone.localtime(timezone.now()).isoweekday()
-        # ranges for all courses
-        ranges_qs = self.get_queryset().filter(active=True, courses=None, days__contains=str(day))
-        if courses:
-            for course in courses:
-                courses_qs = course.markrange_set.filter(active=True, days__contains=str(day))  # ranges for this course
-                ranges_qs = ranges_qs | courses_qs
-
-        ranges_qs = ranges_qs.filter(minimum_mark__lte=mark)  # filter out ranges that are too high
-
-        return ranges_qs.last()  # return the highest range that qualifies
+        return self.index().get_range(mark, [course.pk for course in courses or []])
 
     def get_range_for_user(self, user):
-        mark = user.profile.mark_cached
-        student_course_ids = user.profile.current_courses().values_list('course', flat=True)
+        """ The MarkRange of the user's cached mark and current courses, without querying the database once cached """
+        student_course_ids = CourseStudent.objects.current_course_ids(user)
         if student_course_ids:
-            courses = Course.objects.filter(id__in=student_course_ids)
-            return self.get_range(mark, courses)
+            return self.index().get_range(user.profile.mark_cached, student_course_ids)
         else:
             return None
 
 
 class MarkRange(models.Model):
+    INDEX_TIMEOUT = 60 * 60 * 24
+
     name = models.CharField(max_length=50, default="Chillax Line")
     minimum_mark = models.FloatField(default=72.5, help_text="Minimum mark as a percentage from 0 to 100 (or higher)")
     active = models.BooleanField(default=True)
@@ -135,6 +188,17 @@ class Rank(IsAPrereqMixin, models.Model):
         # profile = Profile.objects.get(user=user)
         return user.profile.xp_cached >= self.xp
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        rank_xps = dict(cls.objects.filter(id__in={object_id for object_id, _ in requirements}).values_list('id', 'xp'))
+        xp = user.profile.xp_cached
+        return {
+            (object_id, num_required): xp >= rank_xps[object_id]
+            for object_id, num_required in requirements if object_id in rank_xps
+        }
+
     def get_map(self):
         from djcytoscape.models import CytoScape
         return CytoScape.objects.get_map_for_init(self)
@@ -158,6 +222,17 @@ class Grade(IsAPrereqMixin, models.Model):
         else:
             return False
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        grade_values = dict(cls.objects.filter(id__in={object_id for object_id, _ in requirements}).values_list('id', 'value'))
+        current_values = set(CourseStudent.objects.current_courses(user).values_list('grade_fk__value', flat=True))
+        return {
+            (object_id, num_required): grade_values[object_id] in current_values
+            for object_id, num_required in requirements if object_id in grade_values
+        }
+
 
 class SemesterManager(models.Manager):
 
@@ -195,16 +270,83 @@ class SemesterManager(models.Manager):
 
         return active_sem
 
+    def mark_histogram_cache_key(self):
+        return f'{connection.schema_name}-mark-histogram'
+
+    def calendar_cache_key(self, semester_id):
+        return f'{connection.schema_name}-semester-{semester_id}-calendar'
+
+    def invalidate_calendar(self, semester_id):
+        cache.delete(self.calendar_cache_key(semester_id))
+
+    def invalidate_mark_histogram(self):
+        """ Only the active semester's students have their marks recalculated, so one histogram is cached per tenant """
+        cache.delete(self.mark_histogram_cache_key())
+
 
 def default_end_date():
     return date.today() + timedelta(days=135)
 
 
+class SemesterCalendar:
+    """ The class days of a semester: every day from the first to the last day, excluding weekends and ExcludedDates.
+    Built once from a single query for the excluded days and cached (see Semester.calendar()), so counting class
+    days and finding the date of a class day are lookups in the `days` array instead of queries.
+    """
+
+    def __init__(self, first_day, last_day, excluded_days):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.excluded_days = sorted(excluded_days)
+        # datetime64[D] holidays for numpy's busday functions, used for dates outside of the semester
+        self.holidays = numpy.array(self.excluded_days, dtype='datetime64[D]')
+
+        days = numpy.arange(first_day, last_day + timedelta(days=1), dtype='datetime64[D]')
+        self.days = days[numpy.is_busday(days, holidays=self.holidays)]
+
+    def is_class_day(self, day):
+        return bool(numpy.is_busday(day, holidays=self.holidays))
+
+    def num_days(self, last_day=None):
+        """ The number of class days from the first day up to and including `last_day` (default: the semester's last day).
+        Like numpy.busday_count this is negative if `last_day` is before the first day.
+        """
+        if last_day is None:
+            last_day = self.last_day
+
+        if self.first_day <= last_day <= self.last_day:
+            return int(numpy.searchsorted(self.days, numpy.datetime64(last_day, 'D'), side='right'))
+
+        count = numpy.busday_count(self.first_day, last_day, holidays=self.holidays)
+        if self.is_class_day(last_day):  # end date is not included, so add here.
+            count += 1
+        return int(count)
+
+    def class_days(self, last_day=None):
+        """ A numpy array (datetime64[D]) of the class days up to and including `last_day`,
+        so class day `n` is `class_days()[n - 1]` """
+        if last_day is None:
+            return self.days
+        return self.days[:numpy.searchsorted(self.days, numpy.datetime64(last_day, 'D'), side='right')]
+
+    def class_day(self, n, roll='forward'):
+        """ The date of class day `n`, where the first class day is 1.  `roll` is how a first day that isn't a class
+        day is moved to one before counting, as in numpy.busday_offset """
+        if 0 < n <= len(self.days) and (roll == 'forward' or self.is_class_day(self.first_day)):
+            return self.days[n - 1].item()
+        return numpy.busday_offset(self.first_day, n - 1, roll=roll, holidays=self.holidays).item()
+
+
 class Semester(models.Model):
     CLOSED = -1
     QUEST_AWAITING_APPROVAL = -2
     STUDENTS_WITH_NEGATIVE_XP = -3
 
+    # 0%, 10%, 20%, ... , 100%+ (marks over 100% are counted in the last bin)
+    MARK_HISTOGRAM_BINS = numpy.arange(0, 111, 10)
+    MARK_HISTOGRAM_TIMEOUT = 60 * 60
+    CALENDAR_TIMEOUT = 60 * 60 * 24
+
     name = models.CharField(
         blank=True, unique=False, max_length=50,
         help_text="If left blank, the semester will display it's First Day as a default name, in the form: mmm-YYYY."
@@ -238,30 +380,42 @@ class Semester(models.Model):
         # the current local date.  Use current local date with date.today()
         return self.first_day <= date.today() <= self.last_day
 
+    def calendar(self):
+        """ The SemesterCalendar of this semester's class days, cached until the semester or its ExcludedDates change """
+        cache_key = Semester.objects.calendar_cache_key(self.pk)
+        calendar = cache.get(cache_key)
+        # also rebuild it if this instance's dates were changed but not saved yet
+        if calendar is None or (calendar.first_day, calendar.last_day) != (self.first_day, self.last_day):
+            calendar = SemesterCalendar(self.first_day, self.last_day, self.excluded_days())
+            cache.set(cache_key, calendar, self.CALENDAR_TIMEOUT)
+        return calendar
+
+    def _last_day(self, upto_today=False):
+        if upto_today and date.today() < self.last_day:
+            return date.today()
+        return self.last_day
+
     def num_days(self, upto_today=False):
         '''The number of classes in the semester (from start date to end date
         excluding weekends and ExcludedDates). '''
-
-        excluded_days = self.excluded_days()
-        if upto_today and date.today() < self.last_day:
-            last_day = date.today()
-        else:
-            last_day = self.last_day
-        count = numpy.busday_count(self.first_day, last_day, holidays=excluded_days)
-        if numpy.is_busday(last_day, holidays=excluded_days):  # end date is not included, so add here.
-            count += 1
-        # We want to return an int because a numpty.int64 is not JSON serializable as of the moment
-        return count.item() if hasattr(count, 'item') else count
+        return self.calendar().num_days(self._last_day(upto_today))
 
     def excluded_days(self):
         return self.excludeddate_set.all().values_list('date', flat=True)
 
+    def class_days(self, upto_today=False):
+        """ A numpy array (datetime64[D]) of every class day in the semester, excluding weekends and ExcludedDates,
+        so class day `n` is `class_days()[n - 1]`.
+        """
+        return self.calendar().class_days(self._last_day(upto_today))
+
     def days_so_far(self):
         return self.num_days(True)
 
     def fraction_complete(self):
-        current_days = self.num_days(True)
-        total_days = self.num_days()
+        calendar = self.calendar()
+        current_days = calendar.num_days(self._last_day(upto_today=True))
+        total_days = calendar.num_days()
         return current_days / total_days
 
     def percent_complete(self):
@@ -282,12 +436,9 @@ class Semester(models.Model):
     def get_date(self, fraction_complete):
         """ Gets the closest date, rolling back if it falls on a weekend or excluded
         after a fraction of the semester is over """
-        days = self.num_days()
-        days_to_fraction = int(days * fraction_complete)
-        excluded_days = self.excluded_days()
-        date_after_fraction = numpy.busday_offset(self.first_day, offsets=days_to_fraction, roll='backward',
-                                                  holidays=excluded_days)
-        return date_after_fraction.item()
+        calendar = self.calendar()
+        days_to_fraction = int(calendar.num_days() * fraction_complete)
+        return calendar.class_day(days_to_fraction + 1, roll='backward')
 
     def get_datetime_by_days_since_start(self, class_days, add_holidays=False):
         """ The date `class days` from the start of the semester
@@ -301,10 +452,8 @@ class Semester(models.Model):
         Returns:
             {datetime} -- [description]
         """
-        excluded_days = self.excluded_days()
-
-        # The next day of class excluding holidays/weekends, -1 because first day counts as 1, not zero.
-        d = numpy.busday_offset(self.first_day, class_days - 1, roll='forward', holidays=excluded_days).astype(date)
+        # The next day of class excluding holidays/weekends, first day counts as 1, not zero.
+        d = self.calendar().class_day(class_days)
 
         # Might want to include the holidays (if class day is Friday, then work done on weekend/holidays won't show up
         # till Monday.  For chart, want to include those days
@@ -334,10 +483,30 @@ class Semester(models.Model):
 
     def get_student_mark_list(self, students_only=False):
         students = CourseStudent.objects.all_users_for_active_semester(students_only=students_only)
-        mark_list = []
-        for student in students:
-            mark_list.append(student.profile.mark_cached)
-        return mark_list
+        return list(students.values_list('profile__mark_cached', flat=True))
+
+    def get_mark_histogram(self):
+        """
+        Histogram of the cached marks of the active students in this semester, using MARK_HISTOGRAM_BINS.
+        Marks are read with a single query and the result is cached until a student's mark or course changes.
+
+        Returns:
+            list[int]: number of students in each bin
+        """
+        cache_key = Semester.objects.mark_histogram_cache_key()
+        semester_id, histogram = cache.get(cache_key, (None, None))
+        if semester_id == self.pk:
+            return histogram
+
+        marks = CourseStudent.objects.all_for_semester(self, students_only=True).filter(user__is_active=True)
+        marks = marks.order_by().values_list('user', 'user__profile__mark_cached').distinct()  # one mark per student
+        # mark_cached can be None, which becomes nan and then 0
+        marks = numpy.nan_to_num(numpy.array([mark for _, mark in marks], dtype=float))
+
+        histogram, _ = numpy.histogram(numpy.clip(marks, 0, 100), bins=self.MARK_HISTOGRAM_BINS)
+        histogram = [int(count) for count in histogram]  # int64 -> int so it can be cached and serialized
+        cache.set(cache_key, (self.pk, histogram), self.MARK_HISTOGRAM_TIMEOUT)
+        return histogram
 
 
 class BlockManager(models.Manager):
@@ -378,6 +547,17 @@ class Block(IsAPrereqMixin, models.Model):
         # num_required is not used for this one
         return CourseStudent.objects.current_courses(user).filter(block=self).exists()
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        block_ids = set(cls.objects.filter(id__in={object_id for object_id, _ in requirements}).values_list('id', flat=True))
+        current_block_ids = set(CourseStudent.objects.current_courses(user).values_list('block_id', flat=True))
+        return {
+            (object_id, num_required): object_id in current_block_ids
+            for object_id, num_required in requirements if object_id in block_ids
+        }
+
 
 class ExcludedDate(models.Model):
     semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
@@ -411,6 +591,17 @@ class Course(IsAPrereqMixin, models.Model):
         else:
             return False
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        course_ids = set(cls.objects.filter(id__in={object_id for object_id, _ in requirements}).values_list('id', flat=True))
+        current_course_ids = set(CourseStudent.objects.current_courses(user).values_list('course_id', flat=True))
+        return {
+            (object_id, num_required): object_id in current_course_ids
+            for object_id, num_required in requirements if object_id in course_ids
+        }
+
     @staticmethod
     def autocomplete_search_fields():  # for grapelli prereq selection
         return ("title__icontains",)
@@ -491,6 +682,21 @@ class CourseStudentManager(models.Manager):
     def current_courses(self, user):
         return self.all_for_user(user).get_semester(SiteConfig.get().active_semester)
 
+    def current_course_ids_cache_key(self, user_id):
+        return f'{connection.schema_name}-user-{user_id}-current-course-ids'
+
+    def current_course_ids(self, user):
+        """ The ids of the courses the user is in during the active semester,
+        cached until one of the user's CourseStudents changes or the active semester changes """
+        semester_id = SiteConfig.get().active_semester_id
+        cache_key = self.current_course_ids_cache_key(user.pk)
+        cached = cache.get(cache_key)
+        if cached is None or cached[0] != semester_id:
+            course_ids = list(self.all_for_user(user).get_semester(semester_id).values_list('course_id', flat=True))
+            cached = (semester_id, course_ids)
+            cache.set(cache_key, cached, self.model.CURRENT_COURSE_IDS_TIMEOUT)
+        return cached[1]
+
     def all_users_for_active_semester(self, students_only=False):
         """
         :return: queryset of all Users who are enrolled in a course during the active semester (doubles removed)
@@ -511,6 +717,8 @@ class CourseStudentManager(models.Manager):
 
 
 class CourseStudent(models.Model):
+    CURRENT_COURSE_IDS_TIMEOUT = 60 * 60
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     semester = models.ForeignKey(Semester, on_delete=models.SET_NULL, null=True)
     block = models.ForeignKey(Block, on_delete=models.PROTECT, null=True, verbose_name="Group")
@@ -570,3 +778,35 @@ def coursestudent_post_save_callback(instance, **kwargs):
     If they make a manual XP adjustment we need to invalidate the user's xp_cache to recalculate xp
     """
     instance.user.profile.xp_invalidate_cache()
+
+
+@receiver([post_save, post_delete], sender=Semester, dispatch_uid='courses.models.semester_calendar')
+def semester_invalidate_calendar(instance, **kwargs):
+    Semester.objects.invalidate_calendar(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=ExcludedDate, dispatch_uid='courses.models.excludeddate_calendar')
+def excludeddate_invalidate_calendar(instance, **kwargs):
+    Semester.objects.invalidate_calendar(instance.semester_id)
+
+
+@receiver([post_save, post_delete], sender=CourseStudent, dispatch_uid='courses.models.coursestudent_mark_histogram')
+def coursestudent_invalidate_mark_histogram(instance, **kwargs):
+    Semester.objects.invalidate_mark_histogram()
+
+
+@receiver(post_save, sender='profile_manager.Profile', dispatch_uid='courses.models.profile_mark_histogram')
+def profile_invalidate_mark_histogram(instance, **kwargs):
+    Semester.objects.invalidate_mark_histogram()
+
+
+@receiver([post_save, post_delete], sender=CourseStudent, dispatch_uid='courses.models.coursestudent_current_course_ids')
+def coursestudent_invalidate_current_course_ids(instance, **kwargs):
+    cache.delete(CourseStudent.objects.current_course_ids_cache_key(instance.user_id))
+
+
+@receiver([post_save, post_delete], sender=MarkRange, dispatch_uid='courses.models.markrange_index')
+@receiver(m2m_changed, sender=MarkRange.courses.through, dispatch_uid='courses.models.markrange_courses_index')
+@receiver([post_save, post_delete], sender=Course, dispatch_uid='courses.models.course_markrange_index')
+def invalidate_markrange_index(**kwargs):
+    MarkRange.objects.invalidate_index()
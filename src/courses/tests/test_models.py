@@ -10,6 +10,7 @@ from freezegun import freeze_time
 from unittest.mock import patch
 from model_bakery import baker
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin
 from courses.models import Block, Course, CourseStudent, ExcludedDate, MarkRange, Rank, Semester
 from siteconfig.models import SiteConfig
 
@@ -83,6 +84,57 @@ class MarkRangeManagerTest(TenantTestCase):
         with patch.object(user.profile, 'mark_cached', new=40.0):
             self.assertIsNone(MarkRange.objects.get_range_for_user(user))
 
+    @freeze_time('2025-01-06 12:00', tz_offset=0)  # a Monday
+    def test_get_range__days(self):
+        """ Only the ranges active on today's weekday are used """
+        mr_60_tuesday = baker.make(MarkRange, minimum_mark=60.0, days="2")
+
+        self.assertEqual(MarkRange.objects.get_range(65.0), self.mr_50)
+        with freeze_time('2025-01-07 12:00', tz_offset=0):
+            self.assertEqual(MarkRange.objects.get_range(65.0), mr_60_tuesday)
+
+    def test_get_range__index_invalidated(self):
+        """ The cached index of ranges is rebuilt when a range, its courses, or a course change """
+        course = baker.make(Course)
+        self.assertEqual(MarkRange.objects.get_range(80.0, [course]), self.mr_75)
+
+        self.mr_75.active = False
+        self.mr_75.save()
+        self.assertEqual(MarkRange.objects.get_range(80.0, [course]), self.mr_50)
+
+        mr_60 = baker.make(MarkRange, minimum_mark=60.0)
+        self.assertEqual(MarkRange.objects.get_range(80.0, [course]), mr_60)
+
+        other_course = baker.make(Course)
+        mr_60.courses.add(other_course)
+        self.assertEqual(MarkRange.objects.get_range(80.0, [course]), self.mr_50)
+
+        mr_60.courses.add(course)
+        self.assertEqual(MarkRange.objects.get_range(80.0, [course]), mr_60)
+
+        course.delete()
+        self.assertEqual(MarkRange.objects.get_range(80.0, [course]), self.mr_50)
+
+    def test_get_range_for_user__no_queries(self):
+        """ Once the ranges and the user's current courses are cached, finding the user's range doesn't query the database """
+        user = baker.make(User)
+        course = baker.make(Course)
+        mr_60 = baker.make(MarkRange, minimum_mark=60.0, courses=[course])
+
+        self.assertIsNone(MarkRange.objects.get_range_for_user(user))
+
+        # joining a course invalidates the user's cached courses
+        baker.make(CourseStudent, user=user, course=course, semester=SiteConfig.get().active_semester)
+        with patch.object(user.profile, 'mark_cached', new=80.0):
+            self.assertEqual(MarkRange.objects.get_range_for_user(user), self.mr_75)
+
+            with self.assertNumQueries(0):
+                self.assertEqual(MarkRange.objects.get_range_for_user(user), self.mr_75)
+
+            mr_60.minimum_mark = 80.0
+            mr_60.save()
+            self.assertEqual(MarkRange.objects.get_range_for_user(user), mr_60)
+
 
 class BlockModelManagerTest(TenantTestCase):
 
@@ -145,7 +197,7 @@ class SemesterModelManagerTest(TenantTestCase):
         # TODO
 
 
-class SemesterModelTest(TenantTestCase):
+class SemesterModelTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.semester_start = date(2019, 9, 1)  # Sep 1st 2019
@@ -220,6 +272,20 @@ class SemesterModelTest(TenantTestCase):
         dates = self.semester.excluded_days()
         self.assertListEqual(list(dates), [date(2019, 9, 1), date(2019, 9, 2)])
 
+    def test_class_days(self):
+        """ Every class day in the semester, matching num_days and get_datetime_by_days_since_start """
+        baker.make(ExcludedDate, semester=self.semester, date=date(2019, 9, 2))  # Mon
+
+        class_days = self.semester.class_days()
+        self.assertEqual(len(class_days), self.semester.num_days())
+        for n in range(1, len(class_days) + 1):
+            self.assertEqual(class_days[n - 1].item(), self.semester.get_datetime_by_days_since_start(n).date())
+
+        with freeze_time(date(2019, 9, 15), tz_offset=0):
+            class_days = self.semester.class_days(upto_today=True)
+            self.assertEqual(len(class_days), self.semester.num_days(upto_today=True))
+            self.assertEqual(class_days[-1].item(), date(2019, 9, 13))
+
     def test_days_so_far(self):
         self.assertEqual(self.semester.days_so_far(), self.semester.num_days(upto_today=True))
 
@@ -281,6 +347,68 @@ class SemesterModelTest(TenantTestCase):
         active_semester.reset_students_xp_cached()
         self.assertEqual(student.profile.xp_cached, 0)
 
+    def test_calendar__cached(self):
+        """ The calendar is built with one query, then read from the cache until an ExcludedDate changes """
+        self.assertEqual(self.semester.num_days(), 21)
+
+        with self.assertNumTenantQueries(0):
+            self.semester.num_days()
+            self.semester.fraction_complete()
+            self.semester.get_interim1_date()
+            self.semester.get_datetime_by_days_since_start(3)
+
+        excluded_date = baker.make(ExcludedDate, semester=self.semester, date=date(2019, 9, 2))  # Mon
+        self.assertEqual(self.semester.num_days(), 20)
+        self.assertEqual(self.semester.get_datetime_by_days_since_start(1).date(), date(2019, 9, 3))
+
+        excluded_date.delete()
+        self.assertEqual(self.semester.num_days(), 21)
+
+    def test_calendar__semester_dates_changed(self):
+        """ Changing the semester's dates rebuilds its calendar, even before the semester is saved """
+        self.assertEqual(self.semester.num_days(), 21)
+
+        self.semester.last_day = date(2019, 9, 13)  # Fri
+        self.assertEqual(self.semester.num_days(), 10)
+        self.semester.save()
+        self.assertEqual(Semester.objects.get(pk=self.semester.pk).num_days(), 10)
+
+    def make_student_with_mark(self, mark, semester):
+        """Enrol a new student in semester, then set their cached mark (enrolling recalculates it)"""
+        student = baker.make(User)
+        baker.make(CourseStudent, user=student, course=baker.make(Course), semester=semester)
+        student.profile.mark_cached = mark
+        student.profile.save()
+        return student
+
+    def test_get_mark_histogram(self):
+        """Marks are counted in 10% bins, with None counted as 0 and marks over 100% counted in the last bin"""
+        active_semester = SiteConfig.get().active_semester
+        for mark in [None, 5, 10, 55.5, 100, 150]:
+            self.make_student_with_mark(mark, active_semester)
+        self.make_student_with_mark(50, self.semester)  # different semester
+
+        self.assertEqual(active_semester.get_mark_histogram(), [2, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2])
+
+    def test_get_mark_histogram__cached_until_mark_changes(self):
+        """The histogram is cached, and saving a student's profile or course invalidates it"""
+        active_semester = SiteConfig.get().active_semester
+        student = self.make_student_with_mark(5, active_semester)
+        self.assertEqual(active_semester.get_mark_histogram()[0], 1)
+
+        with self.assertNumTenantQueries(0):
+            active_semester.get_mark_histogram()
+
+        student.profile.mark_cached = 95
+        student.profile.save()
+        self.assertEqual(active_semester.get_mark_histogram()[9], 1)
+
+        self.make_student_with_mark(None, active_semester)
+        self.assertEqual(sum(active_semester.get_mark_histogram()), 2)
+
+        CourseStudent.objects.filter(user=student).delete()  # queryset delete still sends post_delete
+        self.assertEqual(sum(active_semester.get_mark_histogram()), 1)
+
 
 class CourseModelTest(TenantTestCase):
 
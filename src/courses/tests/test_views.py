@@ -1,7 +1,9 @@
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.shortcuts import reverse
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from django_tenants.test.cases import TenantTestCase
@@ -12,7 +14,7 @@ from freezegun import freeze_time
 from courses.forms import CourseStudentStaffForm, ExcludedDateFormset, SemesterForm
 from courses.models import Block, Course, CourseStudent, MarkRange, Semester, Rank, ExcludedDate
 from notifications.models import Notification, notify_rank_up
-from hackerspace_online.tests.utils import ViewTestUtilsMixin, generate_form_data, model_to_form_data, generate_formset_data
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, ViewTestUtilsMixin, generate_form_data, model_to_form_data, generate_formset_data
 from siteconfig.models import SiteConfig
 from djcytoscape.models import CytoScape
 
@@ -658,7 +660,7 @@ class MarkRangeViewTests(ViewTestUtilsMixin, TenantTestCase):
         self.assertFalse(MarkRange.objects.filter(id=1).exists())
 
 
-class SemesterViewTests(ViewTestUtilsMixin, TenantTestCase):
+class SemesterViewTests(TenantTestUtilsMixin, ViewTestUtilsMixin, TenantTestCase):
 
     def generate_dates(quantity, dates=None):
         """
@@ -977,7 +979,7 @@ class BlockViewTests(ViewTestUtilsMixin, TenantTestCase):
         self.assertEqual(form['current_teacher'].value(), SiteConfig.get().deck_owner.pk)
 
 
-class TestAjax_MarkDistributionChart(ViewTestUtilsMixin, TenantTestCase):
+class TestAjax_MarkDistributionChart(TenantTestUtilsMixin, ViewTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.client = TenantClient(self.tenant)
@@ -1076,8 +1078,35 @@ class TestAjax_MarkDistributionChart(ViewTestUtilsMixin, TenantTestCase):
         self.assertNotEqual(total_students, len(test_account_students))
         self.assertEqual(total_students, len(active_sem_students))
 
+    def test_user_outside_active_semester_added_to_histogram(self):
+        """ a user who isn't a student in the active semester is overlaid on the students' histogram """
+        active_sem_students = [self.create_student_course(100) for i in range(3)]
+        for cs in active_sem_students:
+            cs.user.profile.mark_cached = 100
+            cs.user.profile.save()
+
+        self.client.force_login(self.teacher)
+        response = self.client.get(
+            reverse('courses:mark_distribution_chart', args=[self.teacher.id]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        json_response = json.loads(response.content)
 
-class TestAjax_ProgressChart(ViewTestUtilsMixin, TenantTestCase):
+        # teacher has no mark, so they are added to the first bin
+        self.assertEqual(json_response['data']['user_id'], 0)
+        self.assertEqual(json_response['data']['students'], [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3])
+
+        # a student is already counted, and their bin is the one their mark is in
+        response = self.client.get(
+            reverse('courses:mark_distribution_chart', args=[active_sem_students[0].user.id]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        json_response = json.loads(response.content)
+        self.assertEqual(json_response['data']['user_id'], 10)
+        self.assertEqual(json_response['data']['students'], [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3])
+
+
+class TestAjax_ProgressChart(TenantTestUtilsMixin, ViewTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.client = TenantClient(self.tenant)
@@ -1289,6 +1318,21 @@ class TestAjax_ProgressChart(ViewTestUtilsMixin, TenantTestCase):
             # giving 10 valid days
             self.assertEqual(valid_days, 10)
 
+    def test_ajax_progress_chart__queries_independent_of_days_so_far(self):
+        """ The number of queries shouldn't grow with how far into the semester we are """
+        self.client.force_login(self.student)
+        for day in range(10):
+            self.create_quest_and_submissions(self.base_xp, datetime.datetime(2024, 1, 1 + day, 12, tzinfo=self.tz))
+
+        num_queries = []
+        for today in [datetime.datetime(2024, 1, 5, 12, tzinfo=self.tz), datetime.datetime(2024, 3, 29, 12, tzinfo=self.tz)]:
+            with freeze_time(today), CaptureQueriesContext(connection) as context:
+                response = self.client.post(reverse('courses:ajax_progress_chart', args=[self.student.pk]), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                self.assertEqual(response.status_code, 200)
+            num_queries.append(len(context.captured_queries))
+
+        self.assertEqual(num_queries[0], num_queries[1])
+
 
 class MarkCalculationsViewTests(ViewTestUtilsMixin, TenantTestCase):
 
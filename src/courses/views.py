@@ -1,4 +1,5 @@
 import json
+from collections import Counter, defaultdict
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
@@ -29,7 +30,6 @@ from djcytoscape.views import UpdateMapMessageMixin
 from .forms import BlockForm, CourseStudentForm, CourseStudentStaffForm, MarkRangeForm, SemesterForm, ExcludedDateFormset, ExcludedDateFormsetHelper
 from .models import Block, Course, CourseStudent, Rank, Semester, MarkRange
 
-from django.db.models import Q
 from django.db.models.functions import Greatest
 
 import numpy
@@ -573,41 +573,37 @@ def ajax_progress_chart(request, user_id=0):
     if request.method == "POST":
         sem = SiteConfig.get().active_semester
 
-        # generate a list of dates, from first date of semester to today
-        datelist = []
-        for i in range(1, sem.days_so_far() + 1):
-            # need to ignore weekends and non-class days
-            next_day_of_class = sem.get_datetime_by_days_since_start(i, add_holidays=True)
-            datelist.append(next_day_of_class)
+        # every class day from the first day of the semester to today, ignoring weekends and non-class days
+        class_days = sem.class_days(upto_today=True)
 
         xp_data = []
         # generate an list of dictionary data for chart.js:
         #   x: day into course
         #   y: XP earned so far
 
-        xp = 0
+        today = timezone.localtime()
+
+        # XP as of the end of each class day, and as of right now, from the student's XP ledger
+        xp_by_day, xp_today = user.profile.xp_by_class_day(class_days)
+
         num_courses = user.profile.num_courses()
-        # days_so_far == len(datelist)
-        for day in range(0, sem.days_so_far()):
-            xp = user.profile.xp_to_date(datelist[day]) / num_courses
+        for day, xp in enumerate(xp_by_day):
             xp_data.append(
                 # day 0-indexed
-                {'x': day + 1, 'y': xp}
+                {'x': day + 1, 'y': xp / num_courses}
             )
 
-        today = timezone.localtime()
-
         # SAT and SUN are always excluded by numpy.busday_offset
         # use today.date() because its a datetime.datetime object and we compare it to a DateField (returns datetime.date)
-        if today.weekday() in [5, 6] or today.date() in sem.excluded_days():  # SAT, SAT or a day specifically excluded
-            # according to a comment inside get_datetime_by_days_since_start:
-            #   "work done on weekend/holidays won't show up till Monday"
+        # xp_data is empty if the semester hasn't had a class day yet
+        if xp_data and not sem.calendar().is_class_day(today.date()):  # SAT, SAT or a day specifically excluded
+            # work done on weekend/holidays won't show up till Monday
 
             # total_xp <= xp_to_date(today) since the latest xp_data day is the last valid day (usually a friday)
             # ie. if today is sunday: friday's total xp <= sunday's total xp
             # (if a submission is removed then will subtract from both friday and sunday xp)
             total_xp = xp_data[-1]['y']
-            difference = user.profile.xp_to_date(today) - total_xp
+            difference = xp_today - total_xp
 
             # if true: user has earned xp during the weekend.
             # add that xp to the last valid date
@@ -627,8 +623,6 @@ def ajax_progress_chart(request, user_id=0):
 
 @method_decorator(xml_http_request_required, name='dispatch')
 class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, LoginRequiredMixin, View):
-    _BINS = 10
-    _BIN_WIDTH = 10
 
     def get(self, *args, **kwargs):
         self.user = self.get_user()
@@ -640,57 +634,41 @@ class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, LoginRequiredMixin, Vie
         pk = self.kwargs['user_id']
         return get_object_or_404(User, pk=pk)
 
-    def get_datasets(self):
-        """query datasets for both histograms ( marks over 100% will be capped at 100% )
+    def get_user_bin(self, bins):
+        """find which bin of the histogram the queried user's mark is in ( marks over 100% will be capped at 100% )
 
         Returns:
-            tuple[int, list[ints]]: queried user's mark and all students in active semester's mark
+            int: index of the user's bin
         """
-        # grab dataset
         user_mark = self.user.profile.mark_cached or 0  # can be nonetype
-        student_marks = Semester.get_student_mark_list(Semester, students_only=True)
-        # only remove user's mark from student_marks if user is part of active sem
-        if CourseStudent.objects.all_users_for_active_semester(students_only=True).filter(id=self.user.id).exists():
-            student_marks.remove(user_mark)
+        user_mark = numpy.clip(float(user_mark), 0, 100)
+        return int(numpy.searchsorted(bins, user_mark, side='right')) - 1
 
-        # limit marks, so marks > 100 can show on histogram
-        user_mark = min(user_mark, 100)
-        student_marks = numpy.clip(student_marks, 0, 100)
-
-        return user_mark, student_marks
-
-    def generate_histograms(self):
-        """generates histograms
+    def generate_histogram(self):
+        """overlays the queried user on the active semester's cached histogram of student marks
 
         Returns:
-            tuple[list[int], list[int], list[int]]:
-
-                for first two list in tuple:
-                    histogram of values using student and queried user's marks
-
-                last el in tuple:
-                    histogram's bins in list form
+            tuple[list[int], int, list[int]]: histogram of all students' marks including the user,
+                index of the user's bin, and the histogram's bins
         """
-        user_mark, student_marks = self.get_datasets()
+        semester = SiteConfig.get().active_semester
+        bins = Semester.MARK_HISTOGRAM_BINS
 
-        # histogram length will be len(bin)-1, so bin length has to be self._BIN_SIZE+1
-        bins = numpy.arange(0, self._BINS * (self._BIN_WIDTH + 1) + 1, self._BIN_WIDTH)
-        student_histogram, _ = numpy.histogram(student_marks, bins=bins)
-        user_histogram, _ = numpy.histogram(user_mark, bins=bins)
+        # copy, so the cached histogram isn't changed
+        student_histogram = list(semester.get_mark_histogram())
+        user_bin = self.get_user_bin(bins)
 
-        return student_histogram, user_histogram, bins
+        # the user is only already counted in the histogram if they are a student in the active semester
+        user_is_counted = CourseStudent.objects.all_for_semester(semester, students_only=True).filter(
+            user=self.user, user__is_active=True
+        ).exists()
+        if not user_is_counted:
+            student_histogram[user_bin] += 1
 
-    def get_json_data(self):
-        student_histogram, user_histogram, bins = self.generate_histograms()
+        return student_histogram, user_bin, bins
 
-        # combine histogram
-        student_histogram = numpy.add(student_histogram, user_histogram)
-        # make histogram json serializable (int64 -> int)
-        student_histogram = list(map(int, student_histogram))
-
-        # this will tell use where in the student_histogram user data point was added
-        user_histogram = list(user_histogram)
-        user_id = user_histogram.index(max(user_histogram))
+    def get_json_data(self):
+        student_histogram, user_bin, bins = self.generate_histogram()
 
         # labels
         # 0%, 10%, 20%, ... , 100%+
@@ -703,7 +681,7 @@ class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, LoginRequiredMixin, Vie
         return json.dumps({
             'labels': bin_labels,  # list[str]
             'data': {
-                'user_id': user_id,  # int
+                'user_id': user_bin,  # int
                 'students': student_histogram,  # list[int]
             }
         })
@@ -735,52 +713,48 @@ class Ajax_TagChart(NonPublicOnlyViewMixin, LoginRequiredMixin, View):
                     list has 2 values, 0 or xp. list[index] == 0 means that quest doesn't have tag for user_tags[index].
                     If list[index] == quest.xp then quest has tag user_tags[index]
         """
-        submissions_queryset = get_quest_submission_by_tag(self.user, user_tags).order_by('quest_id', 'ordinal')
+        submissions = get_quest_submission_by_tag(self.user, user_tags).order_by('quest', 'ordinal')
 
-        # use this to keep track of how much xp submission has
+        # use xp_earned to keep track of how much xp submission has
         # since xp_earned can change if it does not meet the cut off
-        submissions_xp = submissions_queryset.annotate(xp_earned=Greatest('quest__xp', 'xp_requested')).values('id', 'xp_earned')
-        submissions_xp = {sub['id']: sub['xp_earned'] for sub in submissions_xp}  # convert to dict for easier access
+        submissions = submissions.annotate(xp_earned=Greatest('quest__xp', 'xp_requested'))
+        submissions = submissions.select_related('quest').prefetch_related('quest__tags')
 
         # change xp_earned or remove submissions if they go over max_xp
-        quest_ids = submissions_queryset.filter(quest__max_xp__gt=-1).distinct('quest').values_list('quest', flat=True)
-        keep_submissions_id = []
-        for quest_id in quest_ids:
-
-            submissions_for_quest = submissions_queryset.filter(quest_id=quest_id)
-            current_xp_total = 0
-            for submission in submissions_for_quest:
-                keep_submissions_id.append(submission.id)
-
-                # change xp earned to match max_xp cutoff
-                # since all other sub after this will be 0 stop here
-                if submissions_xp[submission.id] + current_xp_total > submission.quest.max_xp:
-                    new_xp_amount = submission.quest.max_xp - current_xp_total
-                    submissions_xp[submission.id] = new_xp_amount
-                    break
-
-                current_xp_total += submissions_xp[submission.id]
-
-        # remove ids not in keep_submissions_id since they should have xp_earned of 0 anyway
         # exception of quest__max_xp=-1 since they dont have max xp
-        submissions_queryset = submissions_queryset.filter(Q(quest__max_xp=-1) | Q(id__in=keep_submissions_id)).order_by('quest', 'ordinal')
+        submissions_by_quest = defaultdict(list)
+        current_xp_totals = defaultdict(int)
+        capped_quest_ids = set()
+        for submission in submissions:
+            # all other subs after the cut off would have 0 xp, so leave them out
+            if submission.quest_id in capped_quest_ids:
+                continue
+            submissions_by_quest[submission.quest_id].append(submission)
+
+            max_xp = submission.quest.max_xp
+            if max_xp > -1:
+                # change xp earned to match max_xp cutoff
+                if submission.xp_earned + current_xp_totals[submission.quest_id] > max_xp:
+                    submission.xp_earned = max_xp - current_xp_totals[submission.quest_id]
+                    capped_quest_ids.add(submission.quest_id)
+                current_xp_totals[submission.quest_id] += submission.xp_earned
 
         # formats quest_queryset for chart.js
         submission_dataset = []
-        for submission in submissions_queryset:
-            quest = submission.quest
-            quest_tags = quest.tags.all().values_list('name', flat=True)
+        for quest_submissions in submissions_by_quest.values():
+            for submission in quest_submissions:
+                quest = submission.quest
+                quest_tags = [tag.name for tag in quest.tags.all()]
 
-            # gets xp in all related to quest tags
-            xp_earned = submissions_xp[submission.id]
-            xp_in_tag = [xp_earned if tag in quest_tags else 0 for tag in user_tags]
+                # gets xp in all related to quest tags
+                xp_in_tag = [submission.xp_earned if tag in quest_tags else 0 for tag in user_tags]
 
-            # account for ordinal in name
-            name = quest.name
-            if submissions_queryset.filter(quest__id=quest.id).count() > 1:
-                name += f" ({submission.ordinal})"
+                # account for ordinal in name
+                name = quest.name
+                if len(quest_submissions) > 1:
+                    name += f" ({submission.ordinal})"
 
-            submission_dataset.append({'name': name, 'dataset': xp_in_tag})
+                submission_dataset.append({'name': name, 'dataset': xp_in_tag})
 
         return submission_dataset
 
@@ -799,19 +773,21 @@ class Ajax_TagChart(NonPublicOnlyViewMixin, LoginRequiredMixin, View):
         """
         # use assertions instead of badges so we can count for multiple of same assertion
         assertion_queryset = get_badge_assertion_by_tags(self.user, user_tags).order_by('badge_id', 'ordinal')
+        assertions = list(assertion_queryset.select_related('badge').prefetch_related('badge__tags'))
+        num_assertions = Counter(assertion.badge_id for assertion in assertions)
 
         # formats badge_queryset for chart.js
         assertion_dataset = []
-        for assertion in assertion_queryset:
+        for assertion in assertions:
             badge = assertion.badge
-            badge_tags = badge.tags.all().values_list('name', flat=True)
+            badge_tags = [tag.name for tag in badge.tags.all()]
 
             # gets xp in all related to badge tags
             xp_in_tag = [badge.xp if tag in badge_tags else 0 for tag in user_tags]
 
             # account for ordinal in name
             name = badge.name
-            if assertion_queryset.filter(badge__id=badge.id).count() > 1:
+            if num_assertions[badge.id] > 1:
                 name += f" ({assertion.ordinal})"
 
             assertion_dataset.append({'name': name, 'dataset': xp_in_tag})
@@ -2,19 +2,22 @@ import json
 import re
 
 import random
+from collections import defaultdict
+
 from badges.models import Badge
 from courses.models import Rank
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
-from django.db import models
-from django.shortcuts import get_object_or_404
+from django.db import models, transaction
+from django.db.models import Sum
 from django.utils import timezone
 
 from url_or_relative_url_field.fields import URLOrRelativeURLField
 
-from quest_manager.models import Category
+from prerequisites.models import Prereq
+from quest_manager.models import Category, Quest
 
 
 def clean_JSON(dirty_json_str):
@@ -202,13 +205,12 @@ class CytoElement(models.Model):
         return json.dumps(self.json_dict())
 
     def convert_to_transition_node(self, obj, scape):
-        """ If this obj is a transition node (to a new map), convert it."""
+        """ If this obj is a transition node (to a new map), convert it.  The node is not saved."""
         ct = ContentType.objects.get_for_model(obj)
 
         self.href = reverse('maps:quest_map_interlink', args=[ct.id, obj.id, scape.id])
         self.classes = "link child-map"
         self.is_transition = True
-        self.save()
 
     @staticmethod
     def generate_selector_id(obj):
@@ -277,8 +279,8 @@ class TempCampaign:
         """ Adds nodes the the temp campaign for later cleanup
 
         Args:
-            node_id (int): the source node that is in this campaign
-            reliant_node_id (int): the target node that has the source as a prerequisite.  This node also be in the campaign, or may not.
+            node_id (str): key of the source node that is in this campaign
+            reliant_node_id (str): key of the target node that has the source as a prerequisite.  This node also be in the campaign, or may not.
         """
         node = self.get_node(node_id)
         node.reliant_node_ids.append(reliant_node_id)
@@ -370,6 +372,91 @@ class TempCampaign:
         return self.get_common_prereq_node_ids() is True
 
 
+class MapData:
+    """
+    The prerequisite graph, and the objects in it, loaded up front in a constant number of queries so that the nodes
+    and edges of a map can be calculated in memory instead of querying the reliant objects of each node as it is
+    visited.  Calculating a map doesn't change any of this, so one instance can be shared to calculate many maps,
+    e.g. when regenerating all of them.
+    """
+
+    def __init__(self):
+        self.reliant_prereqs = defaultdict(list)  # {(content_type_id, object_id): [prereqs the object is part of]}
+        self.or_prereq_parent_keys = set()
+        self.inverted_prereq_parent_keys = set()
+        parent_ids = defaultdict(set)  # {content_type_id: {parent_object_id, ...}}
+
+        for prereq in Prereq.objects.order_by('id'):
+            parent_key = (prereq.parent_content_type_id, prereq.parent_object_id)
+            parent_ids[prereq.parent_content_type_id].add(prereq.parent_object_id)
+
+            # same as Prereq.objects.all_reliant_on(obj, exclude_NOT=True), which only excludes inverted main prereqs
+            reliant_on = set()
+            if not prereq.prereq_invert:
+                reliant_on.add((prereq.prereq_content_type_id, prereq.prereq_object_id))
+            if prereq.or_prereq_object_id is not None:
+                reliant_on.add((prereq.or_prereq_content_type_id, prereq.or_prereq_object_id))
+            for key in reliant_on:
+                self.reliant_prereqs[key].append(prereq)
+
+            # same as HasPrereqsMixin.has_or_prereq() and has_inverted_prereq()
+            if prereq.prereq_invert or prereq.or_prereq_invert:
+                self.inverted_prereq_parent_keys.add(parent_key)
+            elif prereq.or_prereq_object_id is not None:
+                self.or_prereq_parent_keys.add(parent_key)
+
+        # the parent objects, i.e. every object that could be a reliant object in a map
+        self.objects = {}
+        for content_type_id, object_ids in parent_ids.items():
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model_class is None:
+                continue
+            qs = model_class._base_manager.filter(id__in=object_ids)
+            if model_class is Quest:
+                qs = qs.select_related('campaign')
+            for obj in qs:
+                self.objects[(content_type_id, obj.id)] = obj
+
+        # Quest.active queries each quest to check if it's expired
+        self.active_quest_ids = set(Quest.objects.get_active().values_list('id', flat=True))
+
+        # same as Category.xp_sum()
+        self.campaign_xp_sums = dict(
+            Quest.objects.all().published().not_archived().order_by()
+            .values('campaign_id').annotate(xp_sum=Sum('xp')).values_list('campaign_id', 'xp_sum')
+        )
+
+    @staticmethod
+    def get_key(obj):
+        return ContentType.objects.get_for_model(obj).id, obj.id
+
+    def is_active(self, obj):
+        if type(obj) is Quest:
+            return obj.id in self.active_quest_ids
+        return not hasattr(obj, 'active') or obj.active
+
+    def get_reliant_objects(self, obj):
+        """ Same as obj.get_reliant_objects(exclude_NOT=True, sort=True) """
+        reliant_objects = []
+        for prereq in self.reliant_prereqs.get(self.get_key(obj), []):
+            parent_obj = self.objects.get((prereq.parent_content_type_id, prereq.parent_object_id))
+            if parent_obj is not None and self.is_active(parent_obj):
+                reliant_objects.append(parent_obj)
+        return sorted(reliant_objects, key=str)
+
+    def has_or_prereq(self, obj):
+        """ Same as obj.has_or_prereq() """
+        return self.get_key(obj) in self.or_prereq_parent_keys
+
+    def has_inverted_prereq(self, obj):
+        """ Same as obj.has_inverted_prereq() """
+        return self.get_key(obj) in self.inverted_prereq_parent_keys
+
+    def xp_sum(self, campaign):
+        """ Same as campaign.xp_sum() """
+        return self.campaign_xp_sums.get(campaign.id)
+
+
 class CytoScapeQueryset(models.QuerySet):
 
     def get_maps_as_formatted_string(self):
@@ -493,6 +580,9 @@ class CytoScape(models.Model):
                                     models.Q(app_label='badges', model='badge') | \
                                     models.Q(app_label='courses', model='rank')
 
+    # element fields compared by save_graph() when regenerating, the rest are part of an element's key
+    GRAPH_ELEMENT_FIELDS = ['label', 'classes', 'href', 'id_styles', 'is_transition', 'min_len', 'data_parent']
+
     name = models.CharField(max_length=250)
 
     # initial_object = models.OneToOneField(Quest)
@@ -596,7 +686,7 @@ class CytoScape(models.Model):
         self.save()
 
     @staticmethod
-    def generate_label(obj):
+    def generate_label(obj, xp_sum=None):
         # set max label length in characters
         # object labels with large xp values require a shorter name length so all values when combined comply with max label length
         if hasattr(obj, 'xp'):
@@ -623,7 +713,9 @@ class CytoScape(models.Model):
                 plus = ""
             post = f" ({str(obj.xp)}{plus})"
         elif type(obj) is Category:
-            post = f" ({str(obj.xp_sum())} XP)"
+            if xp_sum is None:
+                xp_sum = obj.xp_sum()
+            post = f" ({str(xp_sum)} XP)"
 
         # if hasattr(obj, 'max_repeats'): # stop trying to be fancy!
         #     if obj.max_repeats != 0:
@@ -648,6 +740,50 @@ class CytoScape(models.Model):
         except self.DoesNotExist:
             return None
 
+    def init_graph(self):
+        """
+        Create the in-memory graph used to calculate this map, or clear it if it already exists.  Nodes are keyed by
+        `node_key()` and edges by a (source key, target key) tuple, so the graph can be compared with the elements
+        already saved for this scape before anything is written to the database (see `save_graph()`)
+        """
+        self.graph_nodes = {}
+        self.graph_edges = {}
+        self.init_temp_campaign_list()
+
+    @staticmethod
+    def node_key(node):
+        """ A key that identifies the same node between map regenerations, even though its label may change.
+        Nodes representing an object use their selector_id, other nodes (e.g. the link to a parent map) are unique
+        within a scape by their href.
+        """
+        return node.selector_id or node.href
+
+    def get_or_add_node(self, **kwargs):
+        """ Get the node in the in-memory graph matching these kwargs, or add a new (unsaved) one.
+        Similar to get_or_create, returns a tuple of (node, created)
+        """
+        node = CytoElement(scape=self, group=CytoElement.NODES, **kwargs)
+        key = self.node_key(node)
+        if key in self.graph_nodes:
+            return self.graph_nodes[key], False
+        self.graph_nodes[key] = node
+        return node, True
+
+    def get_or_add_edge(self, source_key, target_key, **kwargs):
+        """ Get the edge in the in-memory graph between these nodes, or add a new (unsaved) one.
+        kwargs are only used if the edge is added, similar to the `defaults` of get_or_create.
+        """
+        key = (source_key, target_key)
+        if key not in self.graph_edges:
+            self.graph_edges[key] = CytoElement(
+                scape=self,
+                group=CytoElement.EDGES,
+                data_source=self.graph_nodes[source_key],
+                data_target=self.graph_nodes[target_key],
+                **kwargs
+            )
+        return self.graph_edges[key]
+
     def create_first_node(self, obj):
         """ Creates the first node from `obj`, then if this map has a parent, creates an aditiona node to link back to back to the parent scape/map.
         Returns the first node."""
@@ -657,21 +793,14 @@ class CytoScape(models.Model):
 
         if self.parent_scape:
             # the node to link to the parent map
-            parent_node, _ = CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.NODES,
+            parent_node, _ = self.get_or_add_node(
                 label=f"{self.parent_scape.name} Quest Map",
                 href=reverse('maps:quest_map', args=[self.parent_scape.id]),
                 classes='link parent-map'
             )
 
             # link them together with an edge
-            CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.EDGES,
-                data_source=parent_node,
-                data_target=first_node,
-            )
+            self.get_or_add_edge(self.node_key(parent_node), self.node_key(first_node))
 
         return first_node
 
@@ -687,21 +816,14 @@ class CytoScape(models.Model):
         else:
             label = "The Void"
 
-        child_map_node, _ = CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.NODES,
+        child_map_node, _ = self.get_or_add_node(
             label=label,
             href=reverse('maps:quest_map_interlink', args=[ct.id, obj.id, self.id]),  # <content_type_id>, <object_id>, <originating_scape_id>
             classes="link child-map",
         )
 
         # link them together with an edge
-        CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.EDGES,
-            data_source=data_source,
-            data_target=child_map_node,
-        )
+        self.get_or_add_edge(self.node_key(data_source), self.node_key(child_map_node))
 
         return child_map_node
 
@@ -719,17 +841,13 @@ class CytoScape(models.Model):
         if hasattr(obj, 'map_transition'):
             map_transition = obj.map_transition
 
-        new_node, created = CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.NODES,
+        new_node, created = self.get_or_add_node(
             selector_id=CytoElement.generate_selector_id(obj),
             label=self.generate_label(obj),
-            defaults={
-                      'id_styles': "'background-image': '" + img_url + "'",
-                      'classes': type(obj).__name__,
-                      'href': obj.get_absolute_url(),
-                      'is_transition': map_transition,
-                     }
+            id_styles="'background-image': '" + img_url + "'",
+            classes=type(obj).__name__,
+            href=obj.get_absolute_url(),
+            is_transition=map_transition,
         )
 
         # if this is a transition node (to a new map), format it and link it.
@@ -772,26 +890,25 @@ class CytoScape(models.Model):
         if hasattr(obj, 'campaign') and obj.campaign is not None:
             campaign = obj.campaign
 
-            # Create a node for this campaign (or get it if it already exists)
-            campaign_node, campaign_created = CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.NODES,
-                label=CytoScape.generate_label(obj.campaign),
+            # Create a node for this campaign (or get it if it already exists).  Campaigns can also be prereqs with their
+            # own node, so the compound node gets a different selector_id than `generate_selector_id()`
+            campaign_node, campaign_created = self.get_or_add_node(
+                selector_id=f"Campaign: {campaign.id}",
+                label=CytoScape.generate_label(campaign, xp_sum=self.map_data.xp_sum(campaign)),
                 classes="campaign",
-                # defaults={'attribute': value},
             )
 
             # Add a parent (i.e. campaign) to the target node (to form a compound node)
             target_node.data_parent = campaign_node
-            target_node.save()
 
             # TempCampaign utility for cleaning up the edges and making the resulting map look good, after the entire map is built
+            campaign_key = self.node_key(campaign_node)
             if campaign_created:
-                self.campaign_list.append(TempCampaign(campaign_node.id))
-            temp_campaign = self.get_temp_campaign(campaign_node.id)  # not a Django model, so custom method
+                self.campaign_list.append(TempCampaign(campaign_key))
+            temp_campaign = self.get_temp_campaign(campaign_key)  # not a Django model, so custom method
 
             # TODO: Nodes might be present multiple times through different source nodes?  check and combine
-            temp_campaign.add_node(target_node.id, source_node.id)
+            temp_campaign.add_node(self.node_key(target_node), self.node_key(source_node))
 
         return campaign, campaign_node, campaign_created
 
@@ -820,13 +937,7 @@ class CytoScape(models.Model):
                 for current_node in campaign.nodes:
                     next_node = campaign.get_next_node(current_node)
                     if next_node:
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=current_node.id,
-                            data_target_id=next_node.id,
-                            defaults={'classes': 'hidden', },
-                        )
+                        self.get_or_add_edge(current_node.id, next_node.id, classes='hidden')
 
                 first_node = campaign.get_first_node()
                 for prereq_node_id in common_prereq_ids:
@@ -836,28 +947,13 @@ class CytoScape(models.Model):
                         # we already know all quests have this prereq node in common, so the edges should all exist
                         # unless quest has internal prereq...
                         if prereq_node_id in quest_node.prereq_node_ids:
-                            edge_node = get_object_or_404(CytoElement,
-                                                          data_source_id=prereq_node_id,
-                                                          data_target_id=quest_node.id)
-                            edge_node.delete()
+                            self.graph_edges.pop((prereq_node_id, quest_node.id), None)
 
                     # 3. add edges between common prereqs and campaign/compound/parent node
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source_id=prereq_node_id,
-                        data_target_id=campaign.node_id,
-                        # defaults={'attribute': value},
-                    )
+                    self.get_or_add_edge(prereq_node_id, campaign.node_id)
 
                     # 4. add invisible edge (for structure) from prereqs to first node
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source_id=prereq_node_id,
-                        data_target_id=first_node.id,
-                        defaults={'classes': 'hidden', }
-                    )
+                    self.get_or_add_edge(prereq_node_id, first_node.id, classes='hidden')
 
                 # TODO this should no longer be required now that Campaigns can be set as prerequisites
                 # TODO but will break old maps / prereq setups if removed
@@ -870,41 +966,18 @@ class CytoScape(models.Model):
                             # we already know all quests have this reliant node in common, so the edges should all exist
                             # unless it has an internal reliant...
                             if reliant_node_id in quest_node.reliant_node_ids:
-                                edge_node = get_object_or_404(CytoElement,
-                                                              data_source_id=quest_node.id,
-                                                              data_target_id=reliant_node_id)
-                                edge_node.delete()
+                                self.graph_edges.pop((quest_node.id, reliant_node_id), None)
 
                         # 6. add edges between campaign/compound/parent node and common reliants
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=campaign.node_id,
-                            data_target_id=reliant_node_id,
-                            # defaults={'attribute': value},
-                        )
+                        self.get_or_add_edge(campaign.node_id, reliant_node_id)
 
                         # 7. add invisible edge (for structure) from last node to reliants
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=last_node.id,
-                            data_target_id=reliant_node_id,
-                            defaults={'classes': 'hidden', }
-                            # defaults={'attribute': value},
-                        )
+                        self.get_or_add_edge(last_node.id, reliant_node_id, classes='hidden')
 
             # 8. add invisible edge (for structure) from last node to campaign reliants
             # TODO actually add nodes to the campaign_reliant_nodes_ids list!!!!
             for reliant_node_id in campaign.campaign_reliant_node_ids:
-                CytoElement.objects.get_or_create(
-                    scape=self,
-                    group=CytoElement.EDGES,
-                    data_source_id=last_node.id,
-                    data_target_id=reliant_node_id,
-                    defaults={'classes': 'hidden', }
-                    # defaults={'attribute': value},
-                )
+                self.get_or_add_edge(last_node.id, reliant_node_id, classes='hidden')
 
     def find_reliant_objects_and_add_target_nodes(self, source_obj, source_node: CytoElement):
         """ Recursivly connect nodes together with edges.  Starts at the top and works down through all objects
@@ -920,7 +993,8 @@ class CytoScape(models.Model):
 
         target_nodes are nodes created from reliant objects (objects that rely on the source_obj as a prerequisite)
         """
-        reliant_objects = source_obj.get_reliant_objects(exclude_NOT=True, sort=True)
+        reliant_objects = self.map_data.get_reliant_objects(source_obj)
+        source_key = self.node_key(source_node)
 
         for obj in reliant_objects:
             # source_node
@@ -930,16 +1004,17 @@ class CytoScape(models.Model):
 
             # create or get the node represented by the reliant object
             target_node, node_created = self.create_node_from_object(obj)
+            target_key = self.node_key(target_node)
 
             # if source node is in a compound node (has a parent / campaign), add target_node as a reliant in the temp_campaign
             if source_node.data_parent:
-                temp_campaign: TempCampaign = self.get_temp_campaign(source_node.data_parent.id)
-                temp_campaign.add_reliant(source_node.id, target_node.id)
+                temp_campaign: TempCampaign = self.get_temp_campaign(self.node_key(source_node.data_parent))
+                temp_campaign.add_reliant(source_key, target_key)
 
             # if the source node is ITSELF a campaign (parent of a compound node)
-            if source_node.is_parent():
-                temp_campaign: TempCampaign = self.get_temp_campaign(source_node.id)
-                temp_campaign.add_campaign_reliant(target_node.id)
+            temp_campaign: TempCampaign = self.get_temp_campaign(source_key)
+            if temp_campaign:
+                temp_campaign.add_campaign_reliant(target_key)
 
             # add new_node to a campaign/compound/parent, if required
             campaign_obj, campaign_node, campaign_node_created = self.add_to_campaign(obj, target_node, source_node)
@@ -950,20 +1025,14 @@ class CytoScape(models.Model):
                 # these nodes need to be added to the temp_campaigncampaign_reliant_node_ids for later cleanup
 
             # add a class to alternate prerequisites edges so they can be styled differently if desired
-            if obj.has_or_prereq() or obj.has_inverted_prereq():
+            if self.map_data.has_or_prereq(obj) or self.map_data.has_inverted_prereq(obj):
                 # add "alternate" class
                 defaults = {'classes': 'complicated-prereqs'}
             else:
                 defaults = {}
 
             # TODO: should add number of times prereq is required, similar to repeat edges below
-            CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.EDGES,
-                data_source=source_node,
-                data_target=target_node,
-                defaults=defaults,
-            )
+            self.get_or_add_edge(source_key, target_key, **defaults)
 
             # If repeatable, also add circular edge
             if hasattr(obj, 'max_repeats'):
@@ -973,16 +1042,7 @@ class CytoScape(models.Model):
                     else:
                         label = 'x' + str(obj.max_repeats)
 
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source=target_node,
-                        data_target=target_node,
-                        defaults={
-                            'label': label,
-                            'classes': 'repeat-edge',
-                        },
-                    )
+                    self.get_or_add_edge(target_key, target_key, label=label, classes='repeat-edge')
 
             # recursive, continue adding if this is a new node, and not a closing node
             if node_created and not self.is_transition_node(target_node):
@@ -1014,29 +1074,127 @@ class CytoScape(models.Model):
         scape.calculate_nodes()
         return scape
 
-    def calculate_nodes(self,):
+    def calculate_nodes(self, map_data=None):
+        """ Calculate all the nodes and edges of this map in memory, then save the ones that changed.
+
+        map_data (MapData): the prerequisite graph to use, pass the same one when calculating many maps so that it is
+            only loaded once.  If None, it is loaded for this map.
+        """
+        self.map_data = map_data or MapData()
+
+        # In-memory nodes and edges, and the temp campaign list used to track funky edges required for compound nodes
+        # to display properly with dagre
+        self.init_graph()
 
         # Create the starting node from the initial quest, and a link back to the parent map if there is one
         first_node = self.create_first_node(self.initial_content_object)
 
-        # Temp campaign list used to track funky edges required for compound nodes to display properly with dagre
-        self.init_temp_campaign_list()
-
         # Add nodes reliant on the first_node, this is recursive and will generate all nodes until endpoints reached
         # Endpoints... not sure yet, but probably quests starting with '~' tilde character, or add a new field?
         self.find_reliant_objects_and_add_target_nodes(self.initial_content_object, first_node)
 
         # Add those funky edges for proper display of compound (parent) nodes in cyto dagre layout
         self.fix_nonsequential_campaign_edges()
-        self.last_regeneration = timezone.now()
-        self.update_cache()
-        self.save()
 
-    def regenerate(self):
+        # Only write what changed since the last time this map was calculated
+        self.save_graph()
+
+    def save_graph(self):
+        """ Compare the in-memory graph built by `calculate_nodes()` with the elements already saved for this scape, and
+        bulk insert, update, or delete only the elements that changed.  Saved elements keep their ids, so if the only
+        changes are to labels (e.g. a quest was renamed) the cached elements_json is patched instead of regenerated.
+        """
+        saved_nodes = {}
+        saved_edges = {}
+        stale_ids = []
+
+        elements = list(self.cytoelement_set.order_by('id'))
+        saved_node_keys = {element.id: self.node_key(element) for element in elements if element.group == CytoElement.NODES}
+        for element in elements:
+            if element.group == CytoElement.NODES:
+                saved, key = saved_nodes, saved_node_keys[element.id]
+                keyed = key is not None
+            else:
+                saved = saved_edges
+                key = (saved_node_keys.get(element.data_source_id), saved_node_keys.get(element.data_target_id))
+                keyed = None not in key
+            # unkeyed or duplicate elements can only come from maps generated before elements were keyed, don't keep them
+            if not keyed or key in saved:
+                stale_ids.append(element.id)
+            else:
+                saved[key] = element
+
+        with transaction.atomic():
+            # nodes first, compound (campaign) nodes before their children so the children can reference them
+            new_nodes = []
+            for key, node in self.graph_nodes.items():
+                if key in saved_nodes:
+                    node.id = saved_nodes[key].id
+                else:
+                    new_nodes.append(node)
+            CytoElement.objects.bulk_create([node for node in new_nodes if node.data_parent is None])
+            for node in self.graph_nodes.values():
+                node.data_parent_id = node.data_parent.id if node.data_parent else None
+            CytoElement.objects.bulk_create([node for node in new_nodes if node.data_parent is not None])
+
+            new_edges = []
+            for key, edge in self.graph_edges.items():
+                edge.data_source_id = edge.data_source.id
+                edge.data_target_id = edge.data_target.id
+                if key in saved_edges:
+                    edge.id = saved_edges[key].id
+                else:
+                    new_edges.append(edge)
+            CytoElement.objects.bulk_create(new_edges)
+
+            changed_elements = []
+            changed_fields = set()
+            for graph, saved in ((self.graph_nodes, saved_nodes), (self.graph_edges, saved_edges)):
+                for key, element in graph.items():
+                    if key in saved:
+                        fields = self.changed_element_fields(saved.pop(key), element)
+                        if fields:
+                            changed_elements.append(element)
+                            changed_fields.update(fields)
+            if changed_elements:
+                CytoElement.objects.bulk_update(changed_elements, changed_fields)
+
+            # whatever is left over is no longer part of the map
+            stale_ids += [element.id for element in list(saved_nodes.values()) + list(saved_edges.values())]
+            if stale_ids:
+                CytoElement.objects.filter(id__in=stale_ids).delete()
+
+            self.last_regeneration = timezone.now()
+            if new_nodes or new_edges or stale_ids or changed_fields - {'label'} or self.elements_json is None:
+                self.update_cache()
+            else:
+                if changed_elements:
+                    self.patch_elements_json_labels({element.id: element.label for element in changed_elements})
+                self.save()
+
+    def changed_element_fields(self, saved_element, element):
+        """ Returns the names of the fields that differ between a saved element and its in-memory version """
+        fields = [CytoElement._meta.get_field(name) for name in self.GRAPH_ELEMENT_FIELDS]
+        return [field.name for field in fields if getattr(saved_element, field.attname) != getattr(element, field.attname)]
+
+    def patch_elements_json_labels(self, labels):
+        """ Replace the labels of some elements in the cached elements_json, without rebuilding it from the database.
+
+        labels (dict): {element_id: new label}
+        """
+        elements_dict = json.loads(self.elements_json)
+        for element_json in elements_dict['nodes'] + elements_dict['edges']:
+            data = element_json['data']
+            if data['id'] in labels:
+                if labels[data['id']]:
+                    data['label'] = labels[data['id']]
+                else:
+                    data.pop('label', None)
+        self.elements_json = json.dumps(elements_dict)
+
+    def regenerate(self, map_data=None):
         if self.initial_content_object is None:
             self.delete()
             raise (self.InitialObjectDoesNotExist)
 
-        # Delete existing nodes
-        CytoElement.objects.all_for_scape(self).delete()
-        self.calculate_nodes()
+        self.calculate_nodes(map_data)
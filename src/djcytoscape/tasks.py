@@ -5,7 +5,7 @@ from hackerspace_online.celery import app
 from notifications.signals import notify
 from siteconfig.models import SiteConfig
 
-from .models import CytoScape
+from .models import CytoScape, MapData
 
 User = get_user_model()
 
@@ -13,9 +13,11 @@ User = get_user_model()
 @app.task(name='djcytoscape.tasks.regenerate_all_maps')
 def regenerate_all_maps(requesting_user_id):
     requesting_user = User.objects.get(id=requesting_user_id)
+    # load the prerequisite graph once for all of the maps
+    map_data = MapData()
     for scape in CytoScape.objects.all():
         try:
-            scape.regenerate()
+            scape.regenerate(map_data)
         except scape.InitialObjectDoesNotExist:
             notify.send(
                 SiteConfig.get().deck_ai,
@@ -43,8 +45,9 @@ def regenerate_map(map_ids):
     ARGS:
         map_ids (list[int]): list of ids belonging to Cytoscape maps
     """
+    map_data = MapData()
     for scape in CytoScape.objects.filter(id__in=map_ids):
         try:
-            scape.regenerate()
+            scape.regenerate(map_data)
         except scape.InitialObjectDoesNotExist:
             pass
@@ -4,16 +4,19 @@ from itertools import cycle
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 
 from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 
 # from siteconfig.models import SiteConfig
-from djcytoscape.models import CytoElement, CytoScape, TempCampaign, TempCampaignNode, clean_JSON
+from djcytoscape.models import CytoElement, CytoScape, MapData, TempCampaign, TempCampaignNode, clean_JSON
 from quest_manager.models import Quest, Category
 
 # from django_tenants.test.client import TenantClient
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, tenant_queries
 from hackerspace_online.shell_utils import generate_quests
 
 
@@ -185,7 +188,41 @@ class TempCampaignTest(TenantTestCase):
         self.assertIsInstance(self.temp_campaign, TempCampaign)
 
 
-class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
+class MapDataTest(TenantTestCase):
+    def setUp(self):
+        self.map_data = MapData()
+
+    def test_get_reliant_objects(self):
+        """Should match the reliant objects found through the prereq methods of each object"""
+        for quest in Quest.objects.all():
+            self.assertCountEqual(
+                self.map_data.get_reliant_objects(quest),
+                quest.get_reliant_objects(exclude_NOT=True, sort=True),
+            )
+
+    def test_has_or_prereq__has_inverted_prereq(self):
+        """Should match the prereq methods of each object"""
+        quest_or, quest_not = baker.make(Quest, _quantity=2)
+        quest_or.add_simple_prereqs([Quest.objects.first()])
+        quest_or.prereqs().update(or_prereq_content_type=ContentType.objects.get_for_model(Quest),
+                                  or_prereq_object_id=Quest.objects.last().id)
+        quest_not.add_simple_prereqs([Quest.objects.first()])
+        quest_not.prereqs().update(prereq_invert=True)
+        self.map_data = MapData()
+
+        for quest in Quest.objects.all():
+            self.assertEqual(self.map_data.has_or_prereq(quest), quest.has_or_prereq())
+            self.assertEqual(self.map_data.has_inverted_prereq(quest), quest.has_inverted_prereq())
+        self.assertTrue(self.map_data.has_or_prereq(quest_or))
+        self.assertTrue(self.map_data.has_inverted_prereq(quest_not))
+
+    def test_xp_sum(self):
+        """Should match Category.xp_sum()"""
+        for category in Category.objects.all():
+            self.assertEqual(self.map_data.xp_sum(category), category.xp_sum())
+
+
+class CytoScapeModelTest(TenantTestUtilsMixin, JSONTestCaseMixin, TenantTestCase):
     def setUp(self):
         self.map = generate_real_primary_map()
 
@@ -216,6 +253,22 @@ class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
         CytoScape.generate_map(quest, "test")
         self.assertEqual(CytoScape.objects.count(), 2)
 
+    def test_calculate_nodes__queries_independent_of_map_size(self):
+        """With the prerequisite graph preloaded, calculating a map doesn't query each node's reliant objects"""
+        def count_queries(length):
+            quests = baker.make(Quest, _quantity=length)
+            for prereq_quest, quest in zip(quests, quests[1:]):
+                quest.add_simple_prereqs([prereq_quest])
+            scape = baker.make(CytoScape, initial_content_object=quests[0])
+            scape = CytoScape.objects.get(id=scape.id)
+            map_data = MapData()
+            with CaptureQueriesContext(connection) as queries:
+                scape.calculate_nodes(map_data)
+            self.assertEqual(scape.elements().nodes().count(), length)
+            return len(tenant_queries(queries))
+
+        self.assertEqual(count_queries(3), count_queries(12))
+
     def test_generate_map__long_name_xp(self):
         """
         objects with long names + xp should be truncated correctly during map generation to avoid raising a DataError where labels are too long:
@@ -271,6 +324,66 @@ class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
         """Can regenerate without error on a known good map object"""
         self.map.regenerate()
 
+    def test_regenerate__unchanged_map_keeps_elements(self):
+        """Regenerating a map when nothing changed should not insert, update, or delete any elements"""
+        element_ids = list(self.map.elements().values_list('id', flat=True))
+        elements_json = self.map.elements_json
+
+        self.map.regenerate()
+
+        self.assertCountEqual(self.map.elements().values_list('id', flat=True), element_ids)
+        self.assertEqual(self.map.elements_json, elements_json)
+
+    def test_regenerate__label_change_patches_elements_json(self):
+        """When only a label changes, the element keeps its id and the cached json is patched to match the elements"""
+        node = CytoElement.objects.get(scape=self.map, selector_id='Quest: 6')
+        element_ids = list(self.map.elements().values_list('id', flat=True))
+
+        Quest.objects.filter(id=6).update(name='Renamed quest')  # without signals
+        self.map.regenerate()
+
+        node.refresh_from_db()
+        self.assertEqual(node.label, 'Renamed quest (0)')
+        self.assertCountEqual(self.map.elements().values_list('id', flat=True), element_ids)
+        patched_dict, elements_dict = json.loads(self.map.elements_json), self.map.elements_dict()
+        for group in ['nodes', 'edges']:
+            # elements with the same parent aren't in any particular order
+            self.assertCountEqual(patched_dict[group], elements_dict[group])
+
+    def test_regenerate__only_adds_new_elements(self):
+        """A new reliant quest adds its node and edge, existing elements are kept"""
+        element_ids = set(self.map.elements().values_list('id', flat=True))
+        new_quest = baker.make(Quest, name='New quest')
+        new_quest.add_simple_prereqs([Quest.objects.get(id=6)])
+
+        self.map.regenerate()
+
+        new_ids = set(self.map.elements().values_list('id', flat=True)) - element_ids
+        self.assertEqual(len(new_ids), 2)  # node and edge
+        self.assertTrue(element_ids.issubset(self.map.elements().values_list('id', flat=True)))
+        self.assertTrue(self.map.elements().filter(selector_id=f'Quest: {new_quest.id}').exists())
+        self.assertIn(f'/quests/{new_quest.id}/', self.map.elements_json)
+
+    def test_regenerate__matches_new_map(self):
+        """A regenerated map has the same elements as a map generated from scratch"""
+        def element_set(scape):
+            keys = {element.id: scape.node_key(element) for element in scape.elements().nodes()}
+            return {
+                (keys.get(e.id), keys.get(e.data_source_id), keys.get(e.data_target_id), keys.get(e.data_parent_id),
+                 e.label, e.classes, e.id_styles)
+                for e in scape.elements()
+            }
+
+        quest_6 = Quest.objects.get(id=6)
+        quest_6.published = False
+        quest_6.save()
+        self.map.regenerate()
+        regenerated_elements = element_set(self.map)
+
+        self.map.delete()
+        new_map = generate_real_primary_map()
+        self.assertEqual(regenerated_elements, element_set(new_map))
+
     def test_maps_dont_include_drafts(self):
         """Draft unpublished quests should not appear in maps"""
 
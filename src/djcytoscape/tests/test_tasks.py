@@ -1,9 +1,14 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
 from django_tenants.test.cases import TenantTestCase
 
 from model_bakery import baker
 
-from djcytoscape.models import CytoScape
-from djcytoscape.tasks import regenerate_map
+from djcytoscape.models import CytoScape, MapData
+from djcytoscape.tasks import regenerate_all_maps, regenerate_map
+
+User = get_user_model()
 
 
 class CytoScapeTaskTests(TenantTestCase):
@@ -33,3 +38,17 @@ class CytoScapeTaskTests(TenantTestCase):
 
         # should be 3 as self.quest got linked to 3 maps
         self.assertEqual(CytoScape.objects.get_related_maps(self.quest).count(), 3)
+
+    def test_regenerate_all_maps__shares_map_data(self):
+        """ The prerequisite graph is loaded once and used to regenerate every map """
+        map_origins = baker.make('quest_manager.Quest', _quantity=3)
+        for count, origin in enumerate(map_origins):
+            CytoScape.generate_map(origin, f"Map {count}")
+        self.quest.add_simple_prereqs(map_origins)
+        user = baker.make(User, is_staff=True)
+
+        with patch('djcytoscape.tasks.MapData', wraps=MapData) as map_data:
+            regenerate_all_maps.apply(args=[user.id], queue='default').get()
+
+        map_data.assert_called_once()
+        self.assertEqual(CytoScape.objects.get_related_maps(self.quest).count(), 3)
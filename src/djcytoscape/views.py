@@ -18,7 +18,7 @@ from quest_manager.models import QuestSubmission, Quest
 from siteconfig.models import SiteConfig
 from tenant.views import NonPublicOnlyViewMixin, non_public_only_view
 
-from .models import CytoScape
+from .models import CytoScape, MapData
 from .forms import GenerateQuestMapForm, QuestMapForm
 from .tasks import regenerate_all_maps
 
@@ -234,9 +234,10 @@ def regenerate_all(request):
         messages.warning(request, "You have a lot of maps, so the map regeneration is being processed in the background. It may take a few minutes.")  # noqa
         regenerate_all_maps.apply_async(args=[request.user.id], queue='default')
     else:
+        map_data = MapData()
         for scape in CytoScape.objects.all():
             try:
-                scape.regenerate()
+                scape.regenerate(map_data)
             except scape.InitialObjectDoesNotExist:
                 messages.warning(request, f"The initial object for the '{scape.name} Map' no longer exists. The map has now been removed too.")
 
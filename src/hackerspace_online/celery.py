@@ -50,6 +50,13 @@ app.conf.beat_schedule = {
             "queue": "default",
         }
     },
+    "Update the cached fields of all tenants for the Django Admin hourly task": {
+        "task": "tenant.tasks.update_cached_fields_for_all_tenants",
+        "schedule": crontab(minute=30),
+        "options": {
+            "queue": "default",
+        }
+    },
 }
 
 
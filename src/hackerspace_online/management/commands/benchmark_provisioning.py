@@ -0,0 +1,69 @@
+import time
+
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django_tenants.utils import get_public_schema_name, schema_context, schema_exists
+
+from tenant.models import Tenant
+from tenant.utils import update_tenant_template
+
+
+class Command(BaseCommand):
+    """ Creates tenants the way TenantCreate does, first by migrating and initializing each of them, then by cloning the
+    template schema (see `update_tenant_template`), and reports how long it takes.
+    The tenants are deleted and their schemas dropped afterwards.
+
+    python src/manage.py benchmark_provisioning --repeat 3
+    """
+
+    MODES = ['migrate', 'clone']
+
+    help = "Reports how long it takes to create a tenant by migrating and initializing it, and by cloning the template schema."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', action='store', type=int, default=3,
+            help='Number of tenants to create with each mode. Defaults to 3'
+        )
+        parser.add_argument(
+            '--modes', action='store', nargs='+', choices=self.MODES,
+            help='A space separated list of the modes to benchmark. Defaults to all of them'
+        )
+
+    def handle(self, *args, **options):
+        names = [f"benchmark-{mode}-{n}" for mode in self.MODES for n in range(options['repeat'])]
+        existing = Tenant.objects.filter(name__in=names).values_list('name', flat=True)
+        if existing:
+            raise CommandError(f'Error: tenant "{existing[0]}" already exists, delete it first.')
+
+        self.stdout.write(f"{'mode':<10}{'tenants':>9}{'mean s':>9}{'min s':>9}{'max s':>9}")
+        for mode in options['modes'] or self.MODES:
+            with override_settings(TENANT_CREATION_FAKES_MIGRATIONS=(mode == 'clone')):
+                if mode == 'clone':
+                    # creating or migrating the template is a one time cost, report it separately
+                    start = time.perf_counter()
+                    updated = update_tenant_template()
+                    seconds = time.perf_counter() - start
+                    self.stdout.write(f"{'template':<10}{'':>9}{seconds:>9.2f}{'':>9}{'':>9}  {'updated' if updated else 'up to date'}")
+
+                seconds = [self.provision(f"benchmark-{mode}-{n}") for n in range(options['repeat'])]
+                self.stdout.write(
+                    f"{mode:<10}{len(seconds):>9}{numpy.mean(seconds):>9.2f}{min(seconds):>9.2f}{max(seconds):>9.2f}"
+                )
+
+    def provision(self, name):
+        """
+        Returns:
+            float: the number of seconds it took to create the tenant
+        """
+        with schema_context(get_public_schema_name()):
+            start = time.perf_counter()
+            tenant = Tenant(name=name)
+            tenant.save(verbosity=0)
+            seconds = time.perf_counter() - start
+
+            if not schema_exists(tenant.schema_name):
+                raise CommandError(f'Error: the schema of tenant "{name}" was not created')
+            tenant.delete(force_drop=True)
+        return seconds
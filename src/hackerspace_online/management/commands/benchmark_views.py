@@ -0,0 +1,190 @@
+import time
+
+import numpy
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django_tenants.test.client import TenantClient
+from django_tenants.utils import schema_context
+
+from courses.models import Block
+from djcytoscape.models import CytoScape
+from quest_manager.models import QuestSubmission
+from tenant.models import Tenant
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """ Requests the views that are hit the most, on a deck with production sized data (see `generate_content --bulk`),
+    and reports how many queries and how long each request takes.
+
+    Each view is requested once to warm up the caches (reported as "cold"), then `--repeat` more times.
+    A view is over budget if any of the repeated requests runs more queries than its budget, or if the 95th percentile
+    of their latency is over its budget, in which case the command fails after printing the report.
+
+    python src/manage.py benchmark_views hackerspace --repeat 20 --budget quest_list=40,500
+    """
+
+    # {view: (max queries per request, max 95th percentile latency in ms)}
+    BUDGETS = {
+        'quest_list': (60, 1000),
+        'approvals': (60, 1500),
+        'ajax_submission_count': (5, 100),
+        'profile_detail': (80, 1500),
+        'progress_chart': (15, 300),
+        'tag_chart': (20, 300),
+        'mark_chart': (10, 200),
+        'map': (40, 1000),
+    }
+
+    help = ("Requests the hot views of a deck as a student and a teacher, and reports query counts and latency percentiles. "
+            "Fails if a view goes over its budget.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'schema_name', action='store', type=str,
+            help='The name of the tenant/schema to benchmark.'
+        )
+
+        # optional arguments
+        parser.add_argument(
+            '--repeat', action='store', type=int, default=10,
+            help='Number of times each view is requested after warming up. Defaults to 10'
+        )
+        parser.add_argument(
+            '--views', action='store', nargs='+', choices=list(self.BUDGETS),
+            help='A space separated list of the views to benchmark. Defaults to all of them'
+        )
+        parser.add_argument(
+            '--budget', action='append', default=[],
+            help='Override the budget of a view, in the form view=queries,ms. Can be repeated'
+        )
+        parser.add_argument(
+            '--student', action='store', type=str,
+            help='Username of the student to request views as. Defaults to the student with the most submissions'
+        )
+        parser.add_argument(
+            '--teacher', action='store', type=str,
+            help='Username of the teacher to request views as. Defaults to the teacher of a block'
+        )
+        parser.add_argument(
+            '--report_only', action='store_true',
+            help="Print the report, but don't fail when a view is over budget"
+        )
+
+    def handle(self, *args, **options):
+        budgets = self.get_budgets(options['budget'])
+
+        try:
+            tenant = Tenant.objects.get(schema_name=options['schema_name'])
+        except Tenant.DoesNotExist:
+            raise CommandError(f'Error: Schema name: "{options["schema_name"]}" does not exist!')
+
+        with schema_context(tenant.schema_name):
+            student = self.get_student(options['student'])
+            teacher = self.get_teacher(options['teacher'])
+            requests = self.get_requests(student, teacher)
+
+            over_budget = []
+            self.stdout.write(
+                f"{'view':<24}{'cold q':>8}{'cold ms':>10}{'queries':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                f"{'budget':>14}"
+            )
+            for view in options['views'] or list(self.BUDGETS):
+                if requests.get(view) is None:
+                    self.stdout.write(f"{view:<24}skipped, nothing to request")
+                    continue
+
+                client = TenantClient(tenant)
+                client.force_login(requests[view][0])
+                results = [self.request(client, *requests[view][1:]) for _ in range(options['repeat'] + 1)]
+
+                (cold_queries, cold_ms), results = results[0], results[1:]
+                max_queries = max(queries for queries, ms in results)
+                p50, p95, p99 = numpy.percentile([ms for queries, ms in results], [50, 95, 99])
+
+                budget_queries, budget_ms = budgets[view]
+                over = max_queries > budget_queries or p95 > budget_ms
+                if over:
+                    over_budget.append(view)
+                self.stdout.write(
+                    f"{view:<24}{cold_queries:>8}{cold_ms:>10.1f}{max_queries:>9}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}"
+                    f"{f'{budget_queries}q/{budget_ms}ms':>14}{'  OVER' if over else ''}"
+                )
+
+        if over_budget and not options['report_only']:
+            raise CommandError(f"Over budget: {', '.join(over_budget)}")
+
+    def get_budgets(self, overrides):
+        budgets = dict(self.BUDGETS)
+        for override in overrides:
+            try:
+                view, budget = override.split('=')
+                queries, ms = budget.split(',')
+                budgets[view] = (int(queries), float(ms))
+            except ValueError:
+                raise CommandError(f'Error: budget "{override}" should be in the form view=queries,ms')
+            if view not in self.BUDGETS:
+                raise CommandError(f'Error: "{view}" is not one of the views: {", ".join(self.BUDGETS)}')
+        return budgets
+
+    def get_student(self, username):
+        if username:
+            return User.objects.get(username=username)
+
+        busiest = QuestSubmission.objects.get_queryset(
+            active_semester_only=True, exclude_quests_not_published=False, include_related=False,
+        )
+        busiest = busiest.filter(user__is_staff=False).order_by().values('user').annotate(
+            num_submissions=Count('id'),
+        ).order_by('-num_submissions').first()
+        if busiest is None:
+            raise CommandError('Error: no students have submissions in the active semester, use --student')
+        return User.objects.get(id=busiest['user'])
+
+    def get_teacher(self, username):
+        if username:
+            return User.objects.get(username=username)
+
+        block = Block.objects.filter(current_teacher__isnull=False).select_related('current_teacher').first()
+        return block.current_teacher if block else User.objects.filter(is_staff=True).first()
+
+    def get_requests(self, student, teacher):
+        """
+        Returns:
+            dict[str, tuple[User, str, str, bool]]: {view: (user, method, url, is ajax)}, None for views with nothing to request
+        """
+        scape = CytoScape.objects.filter(is_the_primary_scape=True).first() or CytoScape.objects.first()
+
+        return {
+            'quest_list': (student, 'get', reverse('quests:quests'), False),
+            'approvals': (teacher, 'get', reverse('quests:approvals'), False),
+            'ajax_submission_count': (teacher, 'post', reverse('quests:ajax_submission_count'), True),
+            'profile_detail': (student, 'get', reverse('profiles:profile_detail', args=[student.profile.pk]), False),
+            'progress_chart': (student, 'post', reverse('courses:ajax_progress_chart', args=[student.pk]), True),
+            'tag_chart': (student, 'get', reverse('courses:ajax_tag_progress_chart', args=[student.pk]), True),
+            'mark_chart': (student, 'get', reverse('courses:mark_distribution_chart', args=[student.pk]), True),
+            'map': (student, 'get', reverse('maps:quest_map_personalized', args=[scape.id, student.id]), False) if scape else None,
+        }
+
+    def request(self, client, method, url, ajax):
+        """
+        Returns:
+            tuple[int, float]: number of queries and latency in ms
+        """
+        headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, **headers)
+            ms = (time.perf_counter() - start) * 1000
+
+        if response.status_code != 200:
+            raise CommandError(f'Error: {url} returned {response.status_code}')
+
+        # django-tenants sets the search_path before queries, those aren't the view's queries
+        queries = len([query for query in context.captured_queries if not query['sql'].startswith('SET')])
+        return queries, ms
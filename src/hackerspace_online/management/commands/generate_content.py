@@ -3,13 +3,14 @@ from django.core.management.base import BaseCommand, CommandError
 from django_tenants.utils import schema_context
 from tenant.models import Tenant
 
-from hackerspace_online.shell_utils import generate_content
+from hackerspace_online.shell_utils import generate_bulk_content, generate_content
 
 User = get_user_model()
 
 
 class Command(BaseCommand):
-    help = "This command procedurally generates quests, campaigns, and students"
+    help = "This command procedurally generates quests, campaigns, and students. " \
+           "With --bulk it generates a production sized deck with semesters, badges, submissions and assertions"
 
     def add_arguments(self, parser):
         # argument(s)
@@ -36,13 +37,40 @@ class Command(BaseCommand):
             help='This determines if command prints what it generates in the console. Defaults to False'
         )
 
+        # bulk generation
+        parser.add_argument(
+            '--bulk', action='store_true',
+            help='Generate a production sized deck with bulk_create, see shell_utils.generate_bulk_content'
+        )
+        parser.add_argument(
+            '--num_semesters', action='store', type=int,
+            help='With --bulk, number of semesters including the active one.\nIf left empty defaults to 3'
+        )
+        parser.add_argument(
+            '--num_badges', action='store', type=int,
+            help='With --bulk, number of new badges created.\nIf left empty defaults to 40'
+        )
+        parser.add_argument(
+            '--num_submissions', action='store', type=int,
+            help='With --bulk, number of new quest submissions created.\nIf left empty defaults to 200000'
+        )
+        parser.add_argument(
+            '--num_assertions', action='store', type=int,
+            help='With --bulk, number of new badge assertions created.\nIf left empty defaults to 20000'
+        )
+        parser.add_argument(
+            '--seed', action='store', type=int,
+            help='With --bulk, seed for the random choices so the same deck can be generated again'
+        )
+
     def handle(self, *args, **options):
 
         # grab variables
         schema_name = options.get('schema_name')
-        num_quests_per_campaign = options.get('num_quests_per_campaign') or 10
-        num_campaigns = options.get('num_campaigns') or 5
-        num_students = options.get('num_students') or 100
+        bulk = options.get('bulk') or False
+        num_quests_per_campaign = options.get('num_quests_per_campaign') or (25 if bulk else 10)
+        num_campaigns = options.get('num_campaigns') or (20 if bulk else 5)
+        num_students = options.get('num_students') or (2000 if bulk else 100)
         quiet = options.get('quiet') or False
 
         # error handling
@@ -53,6 +81,20 @@ class Command(BaseCommand):
 
         # tenant exist, proceed
         with schema_context(tenant.schema_name):
+            if bulk:
+                generate_bulk_content(
+                    num_students=num_students,
+                    num_semesters=options.get('num_semesters') or 3,
+                    num_campaigns=num_campaigns,
+                    num_quest_per_campaign=num_quests_per_campaign,
+                    num_badges=options.get('num_badges') or 40,
+                    num_submissions=options.get('num_submissions') or 200000,
+                    num_assertions=options.get('num_assertions') or 20000,
+                    seed=options.get('seed'),
+                    quiet=quiet,
+                )
+                return
+
             # proceed with generation
             generate_content(
                 num_quests_per_campaign,
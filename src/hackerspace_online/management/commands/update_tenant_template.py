@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from django_tenants.utils import get_creation_fakes_migrations, get_tenant_base_schema, schema_exists
+
+from tenant.utils import update_tenant_template
+
+
+class Command(BaseCommand):
+
+    help = ("Creates the template schema that new tenants are cloned from when TENANT_CREATION_FAKES_MIGRATIONS is set, "
+            "or migrates it if there are new migrations.  Run it after `migrate_schemas` so the next new tenant doesn't "
+            "have to wait for the template to be migrated.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop the template and create it again, e.g. after the initial data in tenant/initialization.py changed'
+        )
+
+    def handle(self, *args, **options):
+        if not get_creation_fakes_migrations():
+            raise CommandError("TENANT_CREATION_FAKES_MIGRATIONS isn't set, new tenants aren't cloned from a template.")
+
+        schema_name = get_tenant_base_schema()
+        if options['rebuild'] and schema_exists(schema_name):
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA {connection.ops.quote_name(schema_name)} CASCADE")
+            self.stdout.write(f"Dropped the template schema `{schema_name}`")
+
+        if update_tenant_template(verbosity=options['verbosity']):
+            self.stdout.write(self.style.SUCCESS(f"The template schema `{schema_name}` was updated"))
+        else:
+            self.stdout.write(f"The template schema `{schema_name}` is already up to date")
@@ -487,6 +487,12 @@ TENANT_DEFAULT_OWNER_USERNAME = env('TENANT_DEFAULT_OWNER_USERNAME')
 TENANT_DEFAULT_OWNER_PASSWORD = env('TENANT_DEFAULT_OWNER_PASSWORD')
 TENANT_DEFAULT_OWNER_EMAIL = env('TENANT_DEFAULT_OWNER_EMAIL', default='')
 
+# Create new tenants by cloning a migrated and initialized template schema, instead of running every migration and
+# creating the initial data one object at a time.  See `tenant.utils.update_tenant_template`
+TENANT_CREATION_FAKES_MIGRATIONS = env.bool('TENANT_CREATION_FAKES_MIGRATIONS', default=False)
+# tenant names must start with a letter, so this can't be the schema of a tenant
+TENANT_BASE_SCHEMA = env('TENANT_BASE_SCHEMA', default='_tenant_template')
+
 SHOW_PUBLIC_IF_NO_TENANT_FOUND = True
 
 # See this: https://github.com/timberline-secondary/hackerspace/issues/388
@@ -1,11 +1,21 @@
 import names
 import namegenerator
 import random
+from datetime import datetime, time, timedelta
 
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
 
-from quest_manager.models import Quest, Category
-from badges.models import Badge
+from quest_manager.models import Quest, QuestSubmission, Category
+from badges.models import Badge, BadgeAssertion, BadgeType
+from courses.models import Block, Course, CourseStudent, Semester
+from djcytoscape.models import CytoScape
+from prerequisites.models import Prereq
+from prerequisites.tasks import update_quest_conditions_all_users
+from profile_manager.models import Profile, XPLedgerEntry
+from siteconfig.models import SiteConfig
 
 User = get_user_model()
 
@@ -110,3 +120,261 @@ def generate_content(num_quest_per_campaign=10, num_campaigns=5, num_students=10
         print('\n')
 
     generate_students(num=num_students, quiet=quiet)
+
+
+BULK_BATCH_SIZE = 5000
+
+
+def _random_datetime(rng, semester):
+    """ A random aware datetime during the semester, but not in the future """
+    last_day = min(semester.last_day, timezone.localdate())
+    days = max((last_day - semester.first_day).days, 0)
+    day = semester.first_day + timedelta(days=rng.randint(0, days))
+    dt = datetime.combine(day, time(hour=rng.randint(8, 15), minute=rng.randint(0, 59)))
+    return timezone.make_aware(dt, timezone.get_default_timezone())
+
+
+def _draw(rng, function):
+    """ Call a function from a library that draws from the global random module (names, namegenerator),
+    seeded from `rng` so a seeded dataset gets the same names every time """
+    state = random.getstate()
+    random.seed(rng.getrandbits(64))
+    try:
+        return function()
+    finally:
+        random.setstate(state)
+
+
+def _bulk_create_users(rng, num, prefix, is_staff=False):
+    """ Create users and their profiles with bulk_create, since the post_save signal that creates profiles is skipped """
+    password = make_password(None)  # unusable, and only hashed once
+    # names is slow, so mix and match from a pool of names
+    first_names = [_draw(rng, names.get_first_name) for _ in range(min(num, 100))]
+    last_names = [_draw(rng, names.get_last_name) for _ in range(min(num, 100))]
+    users = []
+    for i in range(num):
+        first = rng.choice(first_names)
+        last = rng.choice(last_names)
+        # the index keeps usernames unique, even with thousands of random names
+        username = f"{prefix}{i}.{first.lower()}.{last.lower()}"
+        users.append(User(
+            username=username, email=f"{username}@example.com", first_name=first, last_name=last,
+            is_staff=is_staff, password=password,
+        ))
+    users = User.objects.bulk_create(users, batch_size=BULK_BATCH_SIZE)
+    Profile.objects.bulk_create([Profile(user=user) for user in users], batch_size=BULK_BATCH_SIZE)
+    return users
+
+
+def _prereq(parent, prereq_object, ct, or_prereq_object=None, invert=False):
+    """ An unsaved Prereq, `ct` is a dict of ContentTypes by model so they are only looked up once """
+    prereq = Prereq(
+        parent_content_type=ct[type(parent)], parent_object_id=parent.id,
+        prereq_content_type=ct[type(prereq_object)], prereq_object_id=prereq_object.id, prereq_invert=invert,
+    )
+    if or_prereq_object is not None:
+        prereq.or_prereq_content_type = ct[type(or_prereq_object)]
+        prereq.or_prereq_object_id = or_prereq_object.id
+    return prereq
+
+
+def generate_bulk_content(num_students=2000, num_teachers=4, num_semesters=3, num_campaigns=20, num_quest_per_campaign=25,
+                          num_badges=40, num_submissions=200000, num_assertions=20000, seed=None, quiet=False):
+    """ Generates a production sized deck to reproduce load locally, creating everything with bulk_create:
+
+    - past semesters before the active one, and a course for each semester
+    - teachers, each with a block, and students enrolled in a block in the active semester and some past semesters
+    - campaigns of quests with branching prerequisites (several quests unlocked by one, AND, OR and NOT conditions),
+      and a map starting from the first campaign
+    - badges, and submissions and badge assertions spread over the semesters.  Most submissions are approved,
+      the rest are awaiting approval or in progress.  Repeats past a quest's max_repeats are skipped,
+      so there can be fewer than num_submissions.
+
+    Signals aren't sent by bulk_create, so the XP ledger and the students' cached XP are reconciled afterwards,
+    and the available quests are recalculated by a task.  Prerequisites aren't enforced on the submissions.
+
+    Run with:
+
+    python src/manage.py generate_content tenant_name --bulk
+
+    or:
+
+    python src/manage.py tenant_command shell
+    Enter Tenant Schema ('?' to list schemas): tenant_name
+
+    In [1]: from hackerspace_online.shell_utils import generate_bulk_content
+
+    In [2]: generate_bulk_content(num_students=2000, num_submissions=200000)
+
+    Input:
+        seed (int): seed for the random choices and names, so a dataset can be regenerated
+
+    Returns:
+        dict[str, int]: how many of each object were created
+    """
+    rng = random.Random(seed)
+    active_semester = SiteConfig.get().active_semester
+    ct = {model: ContentType.objects.get_for_model(model) for model in (Quest, Badge)}
+
+    def log(message):
+        if not quiet:
+            print(message)
+
+    # SEMESTERS AND COURSES
+    past_semesters = Semester.objects.bulk_create([
+        Semester(
+            first_day=active_semester.first_day - timedelta(days=150 * i),
+            last_day=active_semester.first_day - timedelta(days=150 * i - 135),
+            closed=True,
+        )
+        for i in range(num_semesters - 1, 0, -1)
+    ])
+    semesters = past_semesters + [active_semester]
+    courses = Course.objects.bulk_create([Course(title=f"Course-{_draw(rng, namegenerator.gen)}"[:50]) for _ in semesters])
+    log(f"{len(semesters)} semesters and courses")
+
+    # TEACHERS AND STUDENTS
+    teachers = _bulk_create_users(rng, num_teachers, 'teacher', is_staff=True)
+    blocks = Block.objects.bulk_create([
+        Block(name=f"Block-{_draw(rng, namegenerator.gen)}"[:50], current_teacher=teacher) for teacher in teachers
+    ])
+    students = _bulk_create_users(rng, num_students, 'student')
+    log(f"{len(teachers)} teachers and {len(students)} students")
+
+    course_students = []
+    enrolments = {}  # {user_id: [semesters]}
+    for student in students:
+        # everyone is in the active semester, and some students were in past semesters too
+        student_semesters = [semester for semester in past_semesters if rng.random() < 0.5] + [active_semester]
+        enrolments[student.id] = student_semesters
+        for semester in student_semesters:
+            course_students.append(CourseStudent(
+                user=student, semester=semester, block=rng.choice(blocks), course=courses[semesters.index(semester)],
+            ))
+    CourseStudent.objects.bulk_create(course_students, batch_size=BULK_BATCH_SIZE)
+    log(f"{len(course_students)} course enrolments")
+
+    # BADGES
+    badge_type = BadgeType.objects.first() or BadgeType.objects.create(name='Talent')
+    badges = Badge.objects.bulk_create([
+        Badge(name=f"Badge-{_draw(rng, namegenerator.gen)}"[:50], xp=rng.choice([0, 0, 5, 10, 25]), badge_type=badge_type)
+        for _ in range(num_badges)
+    ])
+    log(f"{len(badges)} badges")
+
+    # CAMPAIGNS AND QUESTS
+    campaigns = Category.objects.bulk_create([
+        Category(title=f"Campaign-{_draw(rng, namegenerator.gen)}"[:50]) for _ in range(num_campaigns)
+    ])
+    quests_by_campaign = []
+    all_quests = []
+    for campaign in campaigns:
+        quests = [
+            Quest(
+                name=_draw(rng, namegenerator.gen), campaign=campaign, xp=rng.randint(0, 20),
+                # some quests are repeatable, with a limit on the xp they can earn
+                max_repeats=rng.choice([0, 0, 0, -1, 3]), max_xp=rng.choice([-1, -1, 50]),
+            )
+            for _ in range(num_quest_per_campaign)
+        ]
+        quests_by_campaign.append(quests)
+        all_quests.extend(quests)
+    all_quests = Quest.objects.bulk_create(all_quests, batch_size=BULK_BATCH_SIZE)
+    log(f"{len(all_quests)} quests in {len(campaigns)} campaigns")
+
+    # PREREQUISITES
+    start_badge = Badge.objects.filter(import_id="fa3b0518-cf9c-443c-8fe4-f4a887b495a7").first() or badges[0]
+    prereqs = []
+    for c, quests in enumerate(quests_by_campaign):
+        # campaigns start after the start badge, or after the end of the previous campaign
+        if c > 0 and rng.random() < 0.5:
+            prereqs.append(_prereq(quests[0], start_badge, ct, or_prereq_object=quests_by_campaign[c - 1][-1]))
+        else:
+            prereqs.append(_prereq(quests[0], start_badge, ct))
+
+        for i, quest in enumerate(quests[1:], start=1):
+            # pick a parent from the last few quests, so the graph branches
+            earlier = quests[max(0, i - 4):i]
+            parent = rng.choice(earlier)
+            roll = rng.random()
+            if roll < 0.2:
+                # OR: either an earlier quest or a badge
+                prereqs.append(_prereq(quest, parent, ct, or_prereq_object=rng.choice(badges + earlier)))
+            else:
+                prereqs.append(_prereq(quest, parent, ct))
+            if 0.2 <= roll < 0.4 and len(earlier) > 1:
+                # AND: a second quest is also required
+                prereqs.append(_prereq(quest, rng.choice([q for q in earlier if q is not parent]), ct))
+            if roll >= 0.95:
+                # NOT: students who have a badge can't see this quest
+                prereqs.append(_prereq(quest, rng.choice(badges), ct, invert=True))
+    Prereq.objects.bulk_create(prereqs, batch_size=BULK_BATCH_SIZE)
+    log(f"{len(prereqs)} prerequisites")
+
+    # a map of the first campaign, and whatever it leads to
+    scape = CytoScape.generate_map(quests_by_campaign[0][0], f"Map-{_draw(rng, namegenerator.gen)}"[:50])
+    log(f"{scape} map")
+
+    # SUBMISSIONS
+    ordinals = {}
+    submissions = []
+    for _ in range(num_submissions):
+        student = rng.choice(students)
+        quest = rng.choice(all_quests)
+        if quest.max_repeats != -1 and ordinals.get((student.id, quest.id), 0) > quest.max_repeats:
+            continue  # no repeats left
+        # most of the work happens in the active semester
+        semester = active_semester if rng.random() < 0.6 else rng.choice(enrolments[student.id])
+        ordinal = ordinals[student.id, quest.id] = ordinals.get((student.id, quest.id), 0) + 1
+        submitted_at = _random_datetime(rng, semester)
+
+        roll = rng.random()
+        # only the active semester has submissions that are still in progress or waiting for approval
+        is_completed = semester != active_semester or roll > 0.05
+        is_approved = semester != active_semester or roll > 0.08
+        submissions.append(QuestSubmission(
+            quest=quest, user=student, semester=semester, ordinal=ordinal,
+            is_completed=is_completed, is_approved=is_approved,
+            first_time_completed=submitted_at if is_completed else None,
+            time_completed=submitted_at if is_completed else None,
+            time_approved=submitted_at if is_approved else None,
+        ))
+    QuestSubmission.objects.bulk_create(submissions, batch_size=BULK_BATCH_SIZE)
+    log(f"{len(submissions)} quest submissions")
+
+    # BADGE ASSERTIONS
+    ordinals = {}
+    assertions = []
+    for _ in range(num_assertions):
+        student = rng.choice(students)
+        badge = rng.choice(badges)
+        semester = rng.choice(enrolments[student.id])
+        ordinal = ordinals[student.id, badge.id] = ordinals.get((student.id, badge.id), 0) + 1
+        assertions.append(BadgeAssertion(
+            badge=badge, user=student, semester=semester, ordinal=ordinal, issued_by=rng.choice(teachers),
+        ))
+    assertions = BadgeAssertion.objects.bulk_create(assertions, batch_size=BULK_BATCH_SIZE)
+    # timestamp is auto_now_add, so it can only be backdated after the assertions are created
+    for assertion in assertions:
+        assertion.timestamp = _random_datetime(rng, assertion.semester)
+    BadgeAssertion.objects.bulk_update(assertions, ['timestamp'], batch_size=BULK_BATCH_SIZE)
+    log(f"{len(assertions)} badge assertions")
+
+    # XP AND AVAILABLE QUESTS
+    XPLedgerEntry.objects.reconcile_quest_xp()
+    XPLedgerEntry.objects.reconcile_badge_xp()
+    update_quest_conditions_all_users.apply_async(args=[1], queue='default')
+    log("XP ledger reconciled, available quests will be recalculated by a task")
+
+    return {
+        'semesters': len(past_semesters),
+        'teachers': len(teachers),
+        'students': len(students),
+        'course_students': len(course_students),
+        'badges': len(badges),
+        'campaigns': len(campaigns),
+        'quests': len(all_quests),
+        'prereqs': len(prereqs),
+        'submissions': len(submissions),
+        'assertions': len(assertions),
+    }
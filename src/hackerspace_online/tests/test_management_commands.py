@@ -6,14 +6,17 @@ from django.contrib.auth import get_user_model
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
 from django.core.management import call_command
-from django.test import TestCase
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
 from django_tenants.test.cases import TenantTestCase
-from django_tenants.utils import tenant_context, get_public_schema_name, schema_context
+from django_tenants.utils import tenant_context, get_public_schema_name, schema_context, schema_exists
 
 from model_bakery import baker
 
 # from hackerspace_online.management.commands import find_replace
-from quest_manager.models import Quest, Category
+from courses.models import Block, CourseStudent
+from quest_manager.models import Quest, QuestSubmission, Category
+from siteconfig.models import SiteConfig
 from tenant.models import Tenant
 
 User = get_user_model()
@@ -133,6 +136,74 @@ class GenerateContentTest(TenantTestCase, CommandMixin):
         self.assertEqual(User.objects.count(), expected_user_count)
 
 
+class BenchmarkViewsTest(TenantTestCase, CommandMixin):
+    """ benchmark_views requests the hot views of an existing tenant and reports on them """
+    name = "benchmark_views"
+
+    def setUp(self):
+        self.teacher = baker.make(User, is_staff=True)
+        self.student = baker.make(User)
+        semester = SiteConfig.get().active_semester
+        baker.make(CourseStudent, user=self.student, semester=semester, block=baker.make(Block, current_teacher=self.teacher))
+        baker.make(
+            QuestSubmission, user=self.student, quest=baker.make(Quest), semester=semester,
+            is_completed=True, is_approved=True,
+        )
+
+    def test_benchmark_views__report(self):
+        """ Every view is requested and reported on, as the student with the most submissions """
+        out = self.call_command(self.tenant.schema_name, '--repeat', 2, '--report_only')
+
+        for view in ['quest_list', 'approvals', 'ajax_submission_count', 'profile_detail', 'progress_chart', 'tag_chart',
+                     'mark_chart', 'map']:
+            self.assertIn(view, out)
+
+    def test_benchmark_views__over_budget(self):
+        """ The command fails when a view goes over its budget, unless only reporting """
+        with self.assertRaisesMessage(CommandError, 'Over budget: ajax_submission_count'):
+            self.call_command(self.tenant.schema_name, '--repeat', 1, '--views', 'ajax_submission_count',
+                              '--budget', 'ajax_submission_count=0,1000')
+
+        out = self.call_command(self.tenant.schema_name, '--repeat', 1, '--views', 'ajax_submission_count',
+                                '--budget', 'ajax_submission_count=0,1000', '--report_only')
+        self.assertIn('OVER', out)
+
+    def test_benchmark_views__invalid_budget(self):
+        """ Budgets have to be for a known view, in the form view=queries,ms """
+        with self.assertRaisesMessage(CommandError, 'view=queries,ms'):
+            self.call_command(self.tenant.schema_name, '--budget', 'quest_list=10')
+        with self.assertRaisesMessage(CommandError, 'is not one of the views'):
+            self.call_command(self.tenant.schema_name, '--budget', 'not_a_view=10,10')
+
+
+class UpdateTenantTemplateTest(TestCase, CommandMixin):
+    """ update_tenant_template creates or migrates the schema that new tenants are cloned from """
+    name = "update_tenant_template"
+
+    @override_settings(TENANT_CREATION_FAKES_MIGRATIONS=False)
+    def test_update_tenant_template__cloning_disabled(self):
+        """ There is no template to update unless new tenants are cloned from it """
+        with self.assertRaisesMessage(CommandError, "TENANT_CREATION_FAKES_MIGRATIONS isn't set"):
+            self.call_command()
+
+
+class BenchmarkProvisioningTest(TenantTestCase, CommandMixin):
+    """ benchmark_provisioning times the creation of tenants and deletes them afterwards """
+    name = "benchmark_provisioning"
+
+    @override_settings(TENANT_BASE_SCHEMA='_test_tenant_template')
+    def test_benchmark_provisioning__clone(self):
+        """ The template is created first and reported separately, then the cloned tenants """
+        out = self.call_command('--repeat', 1, '--modes', 'clone')
+
+        self.assertIn('template', out)
+        self.assertIn('clone', out)
+        self.assertNotIn('migrate', out)
+        with schema_context(get_public_schema_name()):
+            self.assertFalse(Tenant.objects.filter(name='benchmark-clone-0').exists())
+            self.assertFalse(schema_exists('benchmark_clone_0'))
+
+
 class FullCleanTest(TestCase, CommandMixin):
     name = 'full_clean'
 
@@ -1,9 +1,19 @@
+import random
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.db.models import F
 
+import namegenerator
+import names
 from django_tenants.test.cases import TenantTestCase
 
-from hackerspace_online.shell_utils import generate_quests, generate_students
-from quest_manager.models import Quest, Category
+from courses.models import CourseStudent
+from hackerspace_online.shell_utils import _draw, generate_bulk_content, generate_quests, generate_students
+from prerequisites.models import Prereq
+from profile_manager.models import Profile, XPLedgerEntry
+from quest_manager.models import Quest, QuestSubmission, Category
+from siteconfig.models import SiteConfig
 
 # from django_tenants.test.client import TenantClient
 
@@ -45,3 +55,49 @@ class ShellUtilsTest(TenantTestCase):
         quest_qs = Quest.objects.order_by('-pk')[:num_quest * num_campaigns]
         campaign_ids = set(quest_qs.values_list('campaign_id', flat=True))
         self.assertEqual(len(campaign_ids), num_campaigns)
+
+    @mock.patch('hackerspace_online.shell_utils.update_quest_conditions_all_users.apply_async')
+    def test_generate_bulk_content(self, update_quest_conditions):
+        """ Generates a small deck: the counts returned match what was created, every student is enrolled in the
+        active semester, the prerequisites include OR and NOT conditions, and the cached XP matches the ledger """
+        num_prereqs_before = Prereq.objects.count()
+        num_course_students_before = CourseStudent.objects.count()
+
+        counts = generate_bulk_content(
+            num_students=5, num_campaigns=4, num_quest_per_campaign=10, num_submissions=50, num_assertions=10,
+            seed=1, quiet=True,
+        )
+
+        self.assertEqual(counts['students'], 5)
+        self.assertEqual(counts['campaigns'], 4)
+        self.assertEqual(counts['quests'], 40)
+        self.assertEqual(counts['assertions'], 10)
+        self.assertLessEqual(counts['submissions'], 50)  # repeats past a quest's max_repeats are skipped
+        self.assertFalse(
+            QuestSubmission.objects.exclude(quest__max_repeats=-1).filter(ordinal__gt=F('quest__max_repeats') + 1).exists()
+        )
+        self.assertEqual(counts['course_students'], CourseStudent.objects.count() - num_course_students_before)
+        self.assertEqual(counts['prereqs'], Prereq.objects.count() - num_prereqs_before)
+        update_quest_conditions.assert_called_once()
+
+        active_semester = SiteConfig.get().active_semester
+        self.assertTrue(XPLedgerEntry.objects.exists())
+        students = User.objects.filter(username__startswith='student')
+        self.assertEqual(students.count(), 5)
+        for student in students:
+            self.assertTrue(Profile.objects.filter(user=student).exists())
+            self.assertTrue(CourseStudent.objects.filter(user=student, semester=active_semester).exists())
+            self.assertEqual(
+                Profile.objects.get(user=student).xp_cached,
+                XPLedgerEntry.objects.get_user(student).get_semester(active_semester).total(),
+            )
+
+        self.assertTrue(Prereq.objects.filter(or_prereq_object_id__isnull=False).exists())
+        self.assertTrue(Prereq.objects.filter(prereq_invert=True).exists())
+
+    def test_draw__seeded_names(self):
+        """ Names drawn with the same seed are the same, and the global random module is left as it was """
+        state = random.getstate()
+        for function in (names.get_first_name, namegenerator.gen):
+            self.assertEqual(_draw(random.Random(1), function), _draw(random.Random(1), function))
+        self.assertEqual(random.getstate(), state)
@@ -1,10 +1,14 @@
 from django.contrib import messages
 from django.conf import settings
 from django.core import serializers
+from django.core.cache import cache
+from django.db import connection
 from django.shortcuts import reverse
+from django.test.utils import CaptureQueriesContext
 
 from model_bakery import baker
 
+from contextlib import contextmanager
 import json
 import warnings
 
@@ -157,6 +161,47 @@ def generate_formset_data(model_formset, prefix='form', quantity=1, **kwargs):
     return formset_data
 
 
+def tenant_queries(captured_queries):
+    """
+        The queries captured with CaptureQueriesContext, without the `SET search_path` queries that django-tenants runs
+        before a query whenever the connection's schema may have changed.  How many of those run depends on what ran
+        before, not on the code being tested.
+
+        EXAMPLE:
+        >>> with CaptureQueriesContext(connection) as context:
+                Badge.objects.calculate_stats()
+        >>> len(tenant_queries(context))
+        3
+    """
+    return [query for query in captured_queries if not query['sql'].startswith('SET')]
+
+
+class TenantTestUtilsMixin():
+    """
+    Utility methods for tests that count queries or rely on the cache.  The base class must be a django TestCase.
+
+    The cache is cleared after each test, because cached values (e.g. the SiteConfig with its active semester) aren't
+    rolled back with the test's transaction.
+    """
+
+    def tearDown(self):
+        cache.clear()
+        super().tearDown()
+
+    @contextmanager
+    def assertNumTenantQueries(self, num):
+        """
+        Like assertNumQueries(), but ignoring the `SET search_path` queries run by django-tenants (see tenant_queries()).
+        """
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = tenant_queries(context)
+        self.assertEqual(
+            len(queries), num,
+            f"{len(queries)} queries executed, {num} expected\n" + "\n".join(query['sql'] for query in queries)
+        )
+
+
 class ViewTestUtilsMixin():
     """
     Utility methods to make cleaner tests for common response assertions.  The base class must
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='action_preview',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
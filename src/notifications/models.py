@@ -1,8 +1,16 @@
+import re
+import uuid
+from html.parser import HTMLParser
+
 from django.apps import apps
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.db.models import Q
 from django.urls import reverse
 from django.utils import timezone
@@ -15,6 +23,60 @@ from .signals import notify
 
 # Create your models here.
 
+# How many notifications are inserted per query when notifying many users at once
+NOTIFICATION_BATCH_SIZE = 500
+
+
+class NotificationPreviewParser(HTMLParser):
+    """
+    Finds the img tags in html in a single pass, with the position each would have in the text that django's
+    strip_tags() leaves of the html before it.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.text_length = 0
+        self.images = []  # [(position, tag), ...]
+
+    def feed(self, data):
+        self.html = data
+        # where each line starts, to find the offset of an img tag in the html from getpos()
+        self.line_offsets = [0] + [match.end() for match in re.finditer("\n", data)]
+        # how many "<" there are in the html up to html_offset, and in the text so far
+        self.html_offset = 0
+        self.html_lt_count = 0
+        self.text_lt_count = 0
+        super().feed(data)
+
+    def is_stripped(self, end):
+        """ Whether strip_tags() changes the html before `end`, which must not be before the last `end` checked.
+        strip_tags() returns the html as it is written unless it removed a tag. """
+        self.html_lt_count += self.html.count("<", self.html_offset, end)
+        self.html_offset = end
+        return self.html_lt_count != self.text_lt_count
+
+    def handle_data(self, data):
+        self.text_length += len(data)
+        self.text_lt_count += data.count("<")
+
+    # strip_tags() writes references this way, so positions in the text match it
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+    def handle_starttag(self, tag, attrs):
+        tag_text = self.get_starttag_text()
+        # an unclosed tag can run into an img tag, e.g. '<img src="a" <img src="b">', so use the last "<img"
+        start = tag_text.rfind("<img")
+        if tag == "img" and start != -1:
+            line, column = self.getpos()
+            offset = self.line_offsets[line - 1] + column + start
+            # the position strip_tags() gives the html before the tag
+            position = self.text_length if self.is_stripped(offset) else offset
+            self.images.append((position, tag_text[start:]))
+
 
 class UserNotificationOptionSet(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -51,11 +113,13 @@ class NotificationQuerySet(models.query.QuerySet):
         qs = self.get_unread().get_user(recipient)
         qs.update(unread=False)
         qs.update(time_read=timezone.now())
+        Notification.objects.invalidate_unread([recipient.id])
 
     def mark_all_unread(self, recipient):
         qs = self.get_read().get_user(recipient)
         qs.update(unread=True)
         qs.update(time_read=None)
+        Notification.objects.invalidate_unread([recipient.id])
 
     def get_unread(self):
         return self.filter(unread=True)
@@ -71,6 +135,74 @@ class NotificationManager(models.Manager):
     def get_queryset(self):
         return NotificationQuerySet(self.model, using=self._db).order_by('-timestamp')
 
+    def bulk_create_for_users(self, sender, users, verb, icon=None, target=None, action=None, batch_size=None):
+        """
+        Create the same notification for each of `users`, inserted with bulk_create in batches.  Each user is only
+        notified once, and the sender is never notified of their own action.
+
+        :param users: a queryset or an iterable of Users.  A queryset is deduped and excludes the sender in SQL, and
+                      is never loaded as model instances.
+        :return: the number of notifications created
+        """
+        User = get_user_model()
+        fields = {
+            'verb': verb,
+            'sender_content_type': ContentType.objects.get_for_model(sender),
+            'sender_object_id': sender.id,
+        }
+        if icon is not None:
+            fields['font_icon'] = icon
+        for option, obj in (('target', target), ('action', action)):
+            if obj is not None:
+                fields[f'{option}_content_type'] = ContentType.objects.get_for_model(obj)
+                fields[f'{option}_object_id'] = obj.id
+        if action is not None:
+            fields['action_preview'] = self.model.html_strip(action)
+
+        # don't send a notification to yourself/themself
+        sender_id = sender.id if isinstance(sender, User) else None
+
+        if isinstance(users, models.QuerySet):
+            user_ids = list(
+                User.objects.filter(id__in=users.values('id')).exclude(id=sender_id)
+                .order_by('id').values_list('id', flat=True)
+            )
+        else:
+            user_ids = list(dict.fromkeys(user.id for user in users if user.id != sender_id))
+
+        batch_size = batch_size or NOTIFICATION_BATCH_SIZE
+        for start in range(0, len(user_ids), batch_size):
+            self.bulk_create([self.model(recipient_id=user_id, **fields) for user_id in user_ids[start:start + batch_size]])
+            # bulk_create doesn't send post_save
+            self.invalidate_unread(user_ids[start:start + batch_size])
+        return len(user_ids)
+
+    UNREAD_TIMEOUT = 60 * 60
+
+    @staticmethod
+    def unread_cache_key(user_id):
+        return f'{connection.schema_name}-notifications-unread-{user_id}'
+
+    def unread_status(self, user):
+        """
+        The user's number of unread notifications, and a version stamp that changes whenever their unread
+        notifications might have, so polling clients can tell if anything changed without querying.
+        Both are cached, and invalidated by the signals below whenever the user's notifications change.
+
+        :return: (version, count)
+        """
+        status = cache.get(self.unread_cache_key(user.id))
+        if status is None:
+            status = (uuid.uuid4().hex, self.all_unread(user).count())
+            cache.set(self.unread_cache_key(user.id), status, self.UNREAD_TIMEOUT)
+        return status
+
+    def invalidate_unread(self, user_ids):
+        keys = [self.unread_cache_key(user_id) for user_id in user_ids]
+        cache.delete_many(keys)
+        # and again after the transaction commits, in case a poll cached the old status again in the meantime
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
     def all_unread(self, user):
         return self.all_for_user(user).get_unread()
 
@@ -117,6 +249,9 @@ class Notification(models.Model):
 
     font_icon = models.CharField(max_length=255, default="<i class='fa fa-info-circle'></i>")
 
+    # html_strip() of the action object, stored when the notification is created so it isn't parsed on every render
+    action_preview = models.TextField(blank=True, default="")
+
     recipient = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='notifications', on_delete=models.CASCADE)
 
     timestamp = models.DateTimeField(auto_now_add=True, auto_now=False)
@@ -126,6 +261,10 @@ class Notification(models.Model):
 
     objects = NotificationManager()
 
+    # The root url used for the links in __str__.  If None, it is looked up from the current tenant each time, so set it
+    # when rendering many notifications at once (e.g. notification emails)
+    root_url = None
+
     def html_strip(string, char_limit=50, tag_size=1, resize_image=True, image_height=20, **kwargs) -> str:
         """
             Strips all html tags except img tags and imposes a length limit. Returns the input text without html tags save for img tag
@@ -134,44 +273,23 @@ class Notification(models.Model):
 
             resize_image: enables image resizing
             image_height: image height after resizing in pixels
+
+            The img tags are found in a single pass by NotificationPreviewParser, and only the shortened text is parsed
+            by BeautifulSoup, so this is linear in the length of the string.
         """
         if not string:
             return ""
         if type(string) is not str:
             string = str(string)
 
-        limit_imposed = False
-        HTML_tags = []
-        tag_index = []
-
-        # store HTML tags and index to lists
-        cache_open_index = None
-        for index in range(len(string)):
-            char = string[index]
-
-            # check for open img
-            if char == "<" and string[index:].startswith("<img"):
-                cache_open_index = index
-
-            # check for closed if open already found
-            elif cache_open_index is not None and char == ">":
-                # position img tag would be without html tags
-                offset = cache_open_index - len(strip_tags(string[:cache_open_index]))
-
-                start = cache_open_index
-                end = index + 1
-
-                # save the html tag and index to list
-                HTML_tags.append(string[start:end])
-                tag_index.append(cache_open_index - offset)
-
-                cache_open_index = None
-
-        # dict of html tag and its position in the string
-        html_index = {HTML_tags[i]: tag_index[i] for i in range(len(HTML_tags))}
+        parser = NotificationPreviewParser()
+        parser.feed(string)
+        parser.close()
+        # the img tags with their position in the text with all the tags stripped
+        images = parser.images
 
         # index count of images that will be shown
-        shown_tag_count = len([index for _, index in html_index.items() if index < char_limit])
+        shown_tag_count = len([position for position, _ in images if position < char_limit])
         # tags should count towards the character limit
         char_limit -= shown_tag_count * tag_size
 
@@ -181,11 +299,16 @@ class Notification(models.Model):
         limit_imposed = len(stripped) > char_limit
 
         # reinsert tags with new stripped text
-        for tag, index in html_index.items():
-            if index < char_limit:
-                text = text[:index] + tag + text[index:]
-
-        # resizes all images in string
+        pieces = []
+        start = 0
+        for position, tag in images:
+            if position < char_limit:
+                pieces += [text[start:position], tag]
+                start = position
+        pieces.append(text[start:])
+        text = "".join(pieces)
+
+        # resizes all images in the shortened text
         if resize_image:
             soup = BeautifulSoup(text, features="html.parser")
             for img in soup.findAll('img'):
@@ -207,13 +330,10 @@ class Notification(models.Model):
         except AttributeError:
             target_url = None
 
-        action = self.action_object
-
-        # uses custom strip
-        action = Notification.html_strip(action)
+        action = self.get_action_preview()
 
         # absolute url needed for when notifications are sent via email
-        root_url = get_root_url()
+        root_url = self.root_url or get_root_url()
         context = {
             "sender": self.sender_object,
             "verb": self.verb,
@@ -233,6 +353,13 @@ class Notification(models.Model):
             url = url_common_part + "</a>"  # this is for 'teacher returned/approved ...'
         return url
 
+    def get_action_preview(self):
+        """ The stripped html of the action object, computed here for notifications created without a stored preview """
+        if self.action_preview:
+            return self.action_preview
+        # uses custom strip
+        return Notification.html_strip(self.action_object)
+
     def mark_read(self):
         self.unread = False
         self.time_read = timezone.now()
@@ -270,7 +397,7 @@ class Notification(models.Model):
 
         # action = strip_tags(action)
 
-        action = Notification.html_strip(str(self.action_object))
+        action = self.get_action_preview()
 
         context = {
             "sender": self.sender_object,
@@ -303,7 +430,8 @@ def new_notification(sender, **kwargs):
         target (any Model): The object being notified about (Submission, Comment, BadgeAssertion, etc.)
         action (any Model): Used alongside "verb" to create syntax of notification ie. "<user> <verb> with <action>"
         recipient (User): The receiving User, required (but not used if affected_users are provided ...?)
-        affected_users (list of Users): everyone who should receive the notification
+        affected_users (queryset or list of Users): everyone who should receive the notification,
+            see NotificationManager.bulk_create_for_users()
         verb (string): sender 'verb' [target] [action]. E.g MrC 'commented on' SomeAnnouncement
         icon (html string): e.g.:
             "<span class='fa-stack'>" + \
@@ -327,35 +455,31 @@ def new_notification(sender, **kwargs):
     if affected_users is None:
         affected_users = [recipient, ]
 
-    for u in affected_users:
-        # don't send a notification to yourself/themself
-        if u == sender:
-            pass
-        else:
-            new_note = Notification(
-                recipient=u,
-                verb=verb,
-                sender_content_type=ContentType.objects.get_for_model(sender),
-                sender_object_id=sender.id,
-                font_icon=icon,
-            )
-            # Set the target if provided.
-            for option in ("target", "action"):
-                # obj = kwargs.pop(option, None) #don't want to remove option with pop
-                try:
-                    obj = kwargs[option]
-                    if obj is not None:
-                        setattr(new_note, "%s_content_type" % option, ContentType.objects.get_for_model(obj))
-                        setattr(new_note, "%s_object_id" % option, obj.id)
-                except:  # noqa
-                    # TODO make this except explicit, don't remember what it's doing
-                    pass
-            new_note.save()
+    Notification.objects.bulk_create_for_users(
+        sender,
+        affected_users,
+        verb,
+        icon=icon,
+        target=kwargs.get('target'),
+        action=kwargs.get('action'),
+    )
 
 
 notify.connect(new_notification)
 
 
+@receiver(post_save, sender=Notification, dispatch_uid="notifications.models.invalidate_unread_on_save")
+def invalidate_unread_on_save(sender, instance, **kwargs):
+    Notification.objects.invalidate_unread([instance.recipient_id])
+
+
+@receiver(post_delete, sender=Notification, dispatch_uid="notifications.models.invalidate_unread_on_delete")
+def invalidate_unread_on_delete(sender, instance, **kwargs):
+    # deleting read notifications, e.g. old ones, doesn't change anything the unread status reports
+    if instance.unread:
+        Notification.objects.invalidate_unread([instance.recipient_id])
+
+
 def deleted_object_receiver(sender, **kwargs):
     # Printing was causing and ASCII/Unicode error on the production server...I think
     # print("************delete signal ****************")
@@ -1,13 +1,19 @@
+from collections import defaultdict
 from datetime import timedelta
+from smtplib import SMTPException
+
+from django.db import connection
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
 from django_tenants.utils import get_tenant_model, tenant_context
 
 from hackerspace_online.celery import app
+from courses.models import CourseStudent
 from quest_manager.models import QuestSubmission
 from notifications.models import Notification
 
@@ -45,43 +51,114 @@ def email_notification_to_users_on_all_schemas():
     return "Scheduled email_notifications_to_users_on_schema for all schemas"
 
 
-@app.task(name='notifications.tasks.email_notifications_to_users_on_schema')
-def email_notifications_to_users_on_schema(root_url):
+# Number of users whose notification emails are generated, and sent, at a time
+NOTIFICATION_EMAIL_BATCH_SIZE = 200
+# A checkpoint older than this is from a previous day's run, so it is ignored
+NOTIFICATION_EMAIL_CHECKPOINT_TIMEOUT = 60 * 60 * 12
 
-    notification_emails = get_notification_emails(root_url)
-    connection = mail.get_connection()
-    connection.send_messages(notification_emails)
-    # send_email_notification_tenant.delay(root_url)
 
-    return f"Sent {len(notification_emails)} notification emails"
+def notification_email_checkpoint_key():
+    return f'{connection.schema_name}-notification-emails-checkpoint'
 
 
-def get_notification_emails(root_url):
-    users_to_email = Profile.objects.get_mailing_list(for_notification_email=True)
+@app.task(bind=True, name='notifications.tasks.email_notifications_to_users_on_schema', max_retries=3, default_retry_delay=60)
+def email_notifications_to_users_on_schema(self, root_url):
+    """
+    Send the notification emails in batches over one connection.  After each batch is sent, the id of its last user is
+    saved as a checkpoint so that if sending fails, the retry resumes after the users that already got their email.
+    """
+    checkpoint_key = notification_email_checkpoint_key()
+    num_sent = 0
 
-    notification_emails = []
+    try:
+        with mail.get_connection() as email_connection:
+            for last_user_id, notification_emails in generate_notification_email_batches(root_url, cache.get(checkpoint_key)):
+                if notification_emails:
+                    num_sent += email_connection.send_messages(notification_emails) or 0
+                cache.set(checkpoint_key, last_user_id, NOTIFICATION_EMAIL_CHECKPOINT_TIMEOUT)
+    except (SMTPException, OSError) as exc:
+        raise self.retry(exc=exc)
+
+    cache.delete(checkpoint_key)
+    return f"Sent {num_sent} notification emails"
 
-    for user in users_to_email:
-        email = generate_notification_email(user, root_url)
-        if email:
-            notification_emails.append(email)
 
+def get_notification_emails(root_url):
+    notification_emails = []
+    for _, emails in generate_notification_email_batches(root_url):
+        notification_emails += emails
     return notification_emails
 
 
-def generate_notification_email(user, root_url):
-    """Generate an email notification from user"""
+def generate_notification_email_batches(root_url, after_user_id=None, batch_size=NOTIFICATION_EMAIL_BATCH_SIZE):
+    """
+    Generate the notification emails for the mailing list in batches of users ordered by id, so only one batch is held
+    in memory at a time.  The unread notifications, enrolment and (for staff) submissions awaiting approval of all the
+    users in a batch are loaded together.
+
+    :param after_user_id: skip users up to and including this id, i.e. the checkpoint of a previous run
+    :return: yields a tuple of (id of the last user in the batch, [emails]) for each batch
+    """
+    users_to_email = Profile.objects.get_mailing_list(for_notification_email=True).order_by('id')
+    if after_user_id is not None:
+        users_to_email = users_to_email.filter(id__gt=after_user_id)
+
+    while True:
+        users = list(users_to_email.select_related('profile')[:batch_size])
+        if not users:
+            return
+
+        user_ids = [user.id for user in users]
+        unread_notifications = defaultdict(list)
+        for notification in Notification.objects.get_queryset().get_unread().filter(recipient_id__in=user_ids) \
+                .prefetch_related('sender_object', 'action_object', 'target_object'):
+            notification.root_url = root_url
+            unread_notifications[notification.recipient_id].append(notification)
+
+        enrolled_user_ids = set(
+            CourseStudent.objects.get_queryset().get_semester(SiteConfig.get().active_semester).filter(user_id__in=user_ids)
+            .values_list('user_id', flat=True)
+        )
+
+        teachers = [user for user in users if user.is_staff]
+        submissions_awaiting_approval = QuestSubmission.objects.all_awaiting_approval_by_teacher(teachers) if teachers else {}
+
+        notification_emails = []
+        for user in users:
+            email = generate_notification_email(
+                user,
+                root_url,
+                unread_notifications=unread_notifications[user.id],
+                submissions_awaiting_approval=submissions_awaiting_approval.get(user.id),
+                has_current_course=user.id in enrolled_user_ids,
+            )
+            if email:
+                notification_emails.append(email)
+
+        yield users[-1].id, notification_emails
+        users_to_email = users_to_email.filter(id__gt=users[-1].id)
+
+
+def generate_notification_email(user, root_url, unread_notifications=None, submissions_awaiting_approval=None,
+                                has_current_course=None):
+    """Generate an email notification from user.
+    The user's unread notifications, submissions awaiting approval, and enrolment can be passed in if they were
+    already loaded (see generate_notification_email_batches), otherwise they are queried here.
+    """
     html_template = get_template('notifications/email_notifications.html')
     subject = f'{SiteConfig.get().site_name_short} Notifications'
     to_email_address = user.email
-    unread_notifications = Notification.objects.all_unread(user)
-    submissions_awaiting_approval = None
+    if unread_notifications is None:
+        unread_notifications = Notification.objects.all_unread(user)
 
-    if user.is_staff:
+    if user.is_staff and submissions_awaiting_approval is None:
         submissions_awaiting_approval = QuestSubmission.objects.all_awaiting_approval(teacher=user)
 
+    if has_current_course is None:
+        has_current_course = user.is_staff or user.profile.has_current_course
+
     # Do not generate email notification for users that are not currently enrolled
-    if not user.is_staff and not user.profile.has_current_course:
+    if not user.is_staff and not has_current_course:
         return None
 
     if unread_notifications or submissions_awaiting_approval:
@@ -2,14 +2,18 @@ from django.contrib.auth import get_user_model
 
 from django_tenants.test.cases import TenantTestCase
 from django.contrib.contenttypes.models import ContentType
-from unittest import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.html import strip_tags
+from unittest import TestCase, mock
 from model_bakery import baker
 from model_bakery.recipe import Recipe
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin
 from notifications.models import Notification, new_notification
 
 
-class NotificationModelTest(TenantTestCase):
+class NotificationModelTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         User = get_user_model()
@@ -73,6 +77,106 @@ class NotificationModelTest(TenantTestCase):
         notes_unread = Notification.objects.all_unread(self.student)
         self.assertEqual(notes_unread.count(), 1)
 
+    def test_new_notification__affected_users_queryset(self):
+        """ A queryset of affected users is notified once each, without notifying the sender """
+        User = get_user_model()
+        students = baker.make(User, _quantity=3)
+        announcement = baker.make('announcements.Announcement')
+
+        new_notification(
+            self.teacher,
+            target=announcement,
+            recipient=self.teacher,
+            affected_users=User.objects.filter(id__in=[self.teacher.id] + [student.id for student in students]),
+            verb='posted',
+        )
+
+        self.assertEqual(Notification.objects.filter(verb='posted').count(), 3)
+        self.assertFalse(Notification.objects.filter(recipient=self.teacher, verb='posted').exists())
+        for student in students:
+            notification = Notification.objects.get(recipient=student, verb='posted')
+            self.assertEqual(notification.target_object, announcement)
+            self.assertEqual(notification.sender_object, self.teacher)
+
+    def test_bulk_create_for_users__dedupes_list(self):
+        """ Users that appear more than once in a list are only notified once, and the sender isn't notified """
+        num_created = Notification.objects.bulk_create_for_users(
+            self.teacher, [self.student, self.teacher, self.student], 'tested'
+        )
+
+        self.assertEqual(num_created, 1)
+        self.assertEqual(Notification.objects.all_for_user(self.student).filter(verb='tested').count(), 1)
+        self.assertEqual(Notification.objects.all_for_user(self.teacher).filter(verb='tested').count(), 0)
+
+    def test_bulk_create_for_users__batches(self):
+        """ Notifications are inserted one batch per query """
+        User = get_user_model()
+        students = baker.make(User, _quantity=5)
+        # content types are cached after the first lookup
+        ContentType.objects.get_for_model(self.teacher)
+
+        with CaptureQueriesContext(connection) as context:
+            Notification.objects.bulk_create_for_users(self.teacher, students, 'tested', batch_size=2)
+
+        inserts = [q for q in context.captured_queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Notification.objects.filter(verb='tested').count(), 5)
+
+    def test_new_notification__stores_action_preview(self):
+        """ The action's preview is computed once when the notification is created, and used to render it """
+        comment = baker.make('comments.Comment', text="<p>A <b>comment</b></p>")
+        new_notification(
+            self.student,
+            action=comment,
+            target=baker.make('announcements.Announcement'),
+            recipient=self.student,
+            affected_users=[self.teacher],
+            verb="commented on",
+        )
+        notification = Notification.objects.get(verb="commented on")
+        self.assertEqual(notification.action_preview, Notification.html_strip(comment))
+
+        with mock.patch('notifications.models.Notification.html_strip') as html_strip:
+            self.assertIn(notification.action_preview, notification.get_link())
+            self.assertIn(notification.action_preview, str(notification))
+        html_strip.assert_not_called()
+
+    def test_unread_status__cached(self):
+        """ The unread count is cached with a version, so asking again doesn't query the database """
+        baker.make(Notification, recipient=self.student, _quantity=2)
+
+        version, count = Notification.objects.unread_status(self.student)
+        self.assertEqual(count, 2)
+
+        with self.assertNumTenantQueries(0):
+            self.assertEqual(Notification.objects.unread_status(self.student), (version, count))
+
+    def test_unread_status__invalidated(self):
+        """ The version changes whenever the user's unread notifications change """
+        notification = baker.make(Notification, recipient=self.student)
+        versions = [Notification.objects.unread_status(self.student)[0]]
+
+        def assert_changed(expected_count):
+            version, count = Notification.objects.unread_status(self.student)
+            self.assertNotIn(version, versions)
+            self.assertEqual(count, expected_count)
+            versions.append(version)
+
+        notification.mark_read()
+        assert_changed(0)
+
+        Notification.objects.get_queryset().mark_all_unread(self.student)
+        assert_changed(1)
+
+        Notification.objects.get_queryset().mark_all_read(self.student)
+        assert_changed(0)
+
+        Notification.objects.bulk_create_for_users(self.teacher, [self.student], 'tested')
+        assert_changed(1)
+
+        Notification.objects.get(recipient=self.student, verb='tested').delete()
+        assert_changed(0)
+
     def test_url_correct_comment_hash(self):
         """ Checks if instances where an url is given. There is a corresponding comment hash with it
         ie. url...#comment-id.
@@ -171,3 +275,110 @@ class NotificationModel_html_strip_Test(TestCase):
             Notification.html_strip(test_case),
             expected_case
         )
+
+    def test_notification_html_strip__check_with_multiple_img_tags(self):
+        """
+            Test that html_strip() keeps multiple img tags in the order and place they were found.
+        """
+        test_case = '<p>ONE</p> <img src="ONE"> TWO <img src="TWO"> THREE'
+        expected_case = (
+            'ONE <img height="20px" src="ONE" style="" width="auto"/> TWO '
+            '<img height="20px" src="TWO" style="" width="auto"/> THREE'
+        )
+
+        self.assertEqual(
+            Notification.html_strip(test_case),
+            expected_case
+        )
+
+    def test_notification_html_strip__check_with_char_limit(self):
+        """
+            Test that images count towards the character limit and the text is cut off with "..."
+        """
+        test_case = '<p>AB</p><img src="SOURCE">CDEFGHIJ &amp; K'
+
+        self.assertEqual(
+            Notification.html_strip(test_case, char_limit=6, tag_size=2),
+            'AB<img height="20px" src="SOURCE" style="" width="auto"/>CD...'
+        )
+        self.assertEqual(
+            Notification.html_strip(test_case, char_limit=6, tag_size=2, resize_image=False),
+            'AB<img src="SOURCE">CD...'
+        )
+
+    def test_notification_html_strip__check_with_character_references(self):
+        """
+            Test that character references come out the way they did when the stripped text was parsed with BeautifulSoup:
+            an ampersand word without a semicolon stays as it is written, and references are converted then escaped.
+        """
+        cases = [
+            ("Q&A session", "Q&amp;A session"),
+            ("AT&T is ok", "AT&amp;T is ok"),
+            ("<p>Q&A session</p>", "Q&amp;A session"),
+            ("<p>it&#39s</p>", "it's"),
+            ("it&#39;s", "it's"),
+            ("&amp;", "&amp;"),
+            ("<b>&amp;</b> &lt;b&gt;", "&amp; &lt;b&gt;"),
+            ("<i>&unknown;</i>", "&amp;unknown"),
+            ("<i>&nbsp;</i>", "\xa0"),
+        ]
+        for test_case, expected_case in cases:
+            with self.subTest(test_case=test_case):
+                self.assertEqual(Notification.html_strip(test_case), expected_case)
+
+    def test_notification_html_strip__check_char_limit_with_character_references(self):
+        """
+            Test that references count towards the character limit as they are written in the html without tags,
+            and as strip_tags() writes them in html with tags
+        """
+        self.assertEqual(Notification.html_strip("Q&A &#39 xyz", char_limit=8), "Q&amp;A &amp;#39...")
+        self.assertEqual(Notification.html_strip("<b>Q&A &#39</b> xyz", char_limit=8), "Q&amp;A &amp;#3...")
+
+    def test_notification_html_strip__same_as_before(self):
+        """
+            Test that html_strip() gives the same output as it did before the img tags were found in a single pass by
+            NotificationPreviewParser.  The expected cases were generated with the previous implementation.
+        """
+        cases = [
+            ('Just some plain text',
+             'Just some plain text'),
+            ('<p>A <b>comment</b> with <em>markup</em></p>',
+             'A comment with markup'),
+            ('<p>Look</p> <img src="a.png"> here',
+             'Look <img height="20px" src="a.png" style="" width="auto"/> here'),
+            ('<img src="a.png" style="width: 100px; height: 50px">',
+             '<img height="20px" src="a.png" style="" width="auto"/>'),
+            ('<p>Text before</p><img alt="x" src="b.png"/><p>text after the image</p>',
+             'Text before<img alt="x" height="20px" src="b.png" style="" width="auto"/>text after the image'),
+            ('Q&A session',
+             'Q&amp;A session'),
+            ('<p>Q&A session</p>',
+             'Q&amp;A session'),
+            ('<p>it&#39;s &amp; &lt;b&gt;</p>',
+             "it's &amp; &lt;b&gt;"),
+            ('<i>&nbsp;</i>',
+             '\xa0'),
+            ('A long line of text that is well over the fifty character limit for previews',
+             'A long line of text that is well over the fifty ch...'),
+            ('<p>A long line of text with an image <img src="c.png"> past the limit of fifty characters</p>',
+             'A long line of text with an image <img height="20px" src="c.png" style="" width="auto"/> past the limit...'),
+            ('<div><p>Nested <span>tags</span></p>\n<p>over lines</p></div>',
+             'Nested tags\nover lines'),
+            ('<img src="broken" <img src="d.png">',
+             '<img height="20px" src="d.png" style="" width="auto"/>'),
+            ('a < b and c > d',
+             'a &lt; b and c &gt; d'),
+        ]
+        for test_case, expected_case in cases:
+            with self.subTest(test_case=test_case):
+                self.assertEqual(Notification.html_strip(test_case), expected_case)
+
+    def test_notification_html_strip__strips_once(self):
+        """
+            Test that the html is only stripped once, however many img tags it has.
+        """
+        test_case = "<p>text</p> " + '<img src="SOURCE"> ' * 20
+
+        with mock.patch('notifications.models.strip_tags', wraps=strip_tags) as strip:
+            Notification.html_strip(test_case, char_limit=100)
+        self.assertEqual(strip.call_count, 1)
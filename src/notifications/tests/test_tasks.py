@@ -4,13 +4,26 @@ from unittest.mock import patch
 
 from django_tenants.test.cases import TenantTestCase
 
+from allauth.account.models import EmailAddress
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, tenant_queries
 from notifications import tasks
 from notifications.models import Notification
-from notifications.tasks import generate_notification_email, get_notification_emails, delete_old_notifications
+from notifications.tasks import (
+    delete_old_notifications,
+    generate_notification_email,
+    generate_notification_email_batches,
+    get_notification_emails,
+    notification_email_checkpoint_key,
+)
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -170,6 +183,75 @@ class NotificationTasksTests(TenantTestCase):
         self.assertEqual(len(emails), 0)
 
 
+class NotificationEmailBatchesTests(TenantTestUtilsMixin, TenantTestCase):
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.root_url = 'https://test.com'
+        self.test_teacher = User.objects.create_user('test_teacher', email="teacher@email.com", is_staff=True)
+        self.students = [self.make_student_to_email(f"student{i}@email.com") for i in range(5)]
+
+    def make_student_to_email(self, email):
+        student = baker.make(User, email=email)
+        EmailAddress.objects.create(user=student, email=email, verified=True, primary=True)
+        baker.make('courses.CourseStudent', user=student, semester=self.sem)
+        student.profile.get_notifications_by_email = True
+        student.profile.save()
+        baker.make(Notification, recipient=student, sender_content_type=ContentType.objects.get_for_model(User),
+                   sender_object_id=self.test_teacher.id, _quantity=2)
+        return student
+
+    def test_generate_notification_email_batches(self):
+        """ Emails are generated in batches of users ordered by id, and can start after a checkpoint """
+        batches = list(generate_notification_email_batches(self.root_url, batch_size=2))
+
+        self.assertEqual([last_user_id for last_user_id, _ in batches], [self.students[i].id for i in (1, 3, 4)])
+        self.assertEqual(
+            [email.to[0] for _, emails in batches for email in emails],
+            [student.email for student in self.students],
+        )
+
+        batches = list(generate_notification_email_batches(self.root_url, after_user_id=self.students[2].id, batch_size=2))
+        self.assertEqual([email.to[0] for _, emails in batches for email in emails], [self.students[3].email, self.students[4].email])
+
+    def test_generate_notification_email_batches__queries_independent_of_batch_size(self):
+        """ The data for the emails is loaded per batch, not per user """
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                batches = list(generate_notification_email_batches(self.root_url, batch_size=100))
+            self.assertEqual(len(batches), 1)
+            return len(tenant_queries(queries))
+
+        num_queries = count_queries()
+        self.make_student_to_email("another@email.com")
+        self.assertEqual(count_queries(), num_queries)
+
+    def test_generate_notification_email_batches__teacher_submissions(self):
+        """ Staff emails include the same submissions as all_awaiting_approval(teacher) """
+        EmailAddress.objects.create(user=self.test_teacher, email=self.test_teacher.email, verified=True, primary=True)
+        self.test_teacher.profile.get_notifications_by_email = True
+        self.test_teacher.profile.save()
+        quest = baker.make('quest_manager.Quest', specific_teacher_to_notify=self.test_teacher)
+        sub = baker.make('quest_manager.QuestSubmission', quest=quest, user=self.students[0], is_completed=True,
+                         semester=self.sem)
+
+        emails = get_notification_emails(self.root_url)
+
+        teacher_email = next(email for email in emails if email.to == [self.test_teacher.email])
+        self.assertIn("Quest submissions awaiting your approval", teacher_email.alternatives[0][0])
+        self.assertIn(str(sub), teacher_email.alternatives[0][0])
+
+    def test_email_notifications_to_users_on_schema__resumes_from_checkpoint(self):
+        """ A retry only sends emails to users after the checkpoint, and the checkpoint is cleared when finished """
+        cache.set(notification_email_checkpoint_key(), self.students[2].id)
+
+        task_result = tasks.email_notifications_to_users_on_schema.apply(kwargs={"root_url": self.root_url})
+
+        self.assertTrue(task_result.successful())
+        self.assertEqual([message.to[0] for message in mail.outbox], [self.students[3].email, self.students[4].email])
+        self.assertIsNone(cache.get(notification_email_checkpoint_key()))
+
+
 class DeleteOldNotificationsTestCase(TenantTestCase):
     def setUp(self):
         super().setUp()
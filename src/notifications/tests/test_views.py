@@ -5,12 +5,12 @@ from django_tenants.test.cases import TenantTestCase
 from django_tenants.test.client import TenantClient
 from model_bakery import baker
 
-from hackerspace_online.tests.utils import ViewTestUtilsMixin
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, ViewTestUtilsMixin
 
 User = get_user_model()
 
 
-class NotificationViewTests(ViewTestUtilsMixin, TenantTestCase):
+class NotificationViewTests(TenantTestUtilsMixin, ViewTestUtilsMixin, TenantTestCase):
 
     # includes some basic model data
     # fixtures = ['initial_data.json']
@@ -119,3 +119,29 @@ class NotificationViewTests(ViewTestUtilsMixin, TenantTestCase):
             HTTP_X_REQUESTED_WITH='XMLHttpRequest',
         )
         self.assertEqual(response.status_code, 200)
+
+    def test_ajax__since(self):
+        """ Polling with the version of the last response returns no notifications until the unread ones change """
+        self.client.force_login(self.test_student1)
+        baker.make('notifications.Notification', recipient=self.test_student1)
+
+        data = self.client.post(reverse('notifications:ajax'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertTrue(data['changed'])
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(len(data['notifications']), 1)
+
+        unchanged = self.client.post(
+            reverse('notifications:ajax'), data={'since': data['version']}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        ).json()
+        self.assertFalse(unchanged['changed'])
+        self.assertEqual(unchanged['count'], 1)
+        self.assertNotIn('notifications', unchanged)
+
+        baker.make('notifications.Notification', recipient=self.test_student1)
+        changed = self.client.post(
+            reverse('notifications:ajax'), data={'since': data['version']}, HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        ).json()
+        self.assertTrue(changed['changed'])
+        self.assertNotEqual(changed['version'], data['version'])
+        self.assertEqual(changed['count'], 2)
+        self.assertEqual(len(changed['notifications']), 2)
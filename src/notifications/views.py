@@ -89,8 +89,18 @@ def ajax(request):
     if request.method == "POST":
 
         limit = 15
+        version, count = Notification.objects.unread_status(request.user)
+
+        # the client already has the latest list, so there's no need to build it again
+        if request.POST.get('since') == version:
+            return JsonResponse(data={
+                "changed": False,
+                "version": version,
+                "count": count,
+                "limit": limit,
+            })
+
         notifications = Notification.objects.all_unread(request.user)
-        count = notifications.count()
         # limit number of items else the list in the menu will go off
         # the bottom of the screen and can't get the links at the bottom...
         notifications = notifications[:limit]
@@ -104,6 +114,8 @@ def ajax(request):
             )
 
         data = {
+            "changed": True,
+            "version": version,
             "notifications": notes,
             "count": count,
             "limit": limit,
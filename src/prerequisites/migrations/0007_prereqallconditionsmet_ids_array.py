@@ -0,0 +1,37 @@
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Converts PrereqAllConditionsMet.ids from a string representation of a python list, e.g. '[25, 34, 55]',
+    to a postgres integer array, e.g. {25, 34, 55}, in place."""
+
+    dependencies = [
+        ('prerequisites', '0006_auto_20220629_1807'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+                ALTER TABLE prerequisites_prereqallconditionsmet
+                ALTER COLUMN ids TYPE integer[]
+                USING (
+                    CASE WHEN ids IS NULL OR btrim(ids, ' []') = '' THEN '{}'
+                    ELSE translate(ids, '[]', '{}')
+                    END
+                )::integer[];
+            """,
+            reverse_sql="""
+                ALTER TABLE prerequisites_prereqallconditionsmet
+                ALTER COLUMN ids TYPE text
+                USING '[' || array_to_string(ids, ', ') || ']';
+            """,
+            state_operations=[
+                migrations.AlterField(
+                    model_name='prereqallconditionsmet',
+                    name='ids',
+                    field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None),
+                ),
+            ],
+        ),
+    ]
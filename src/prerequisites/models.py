@@ -1,9 +1,12 @@
-import json
+from collections import defaultdict
+
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Func, Q, Value
+from django.db.models.expressions import RawSQL
 
 
 class HasPrereqsMixin:
@@ -113,6 +116,8 @@ class IsAPrereqMixin:
     2. if the model does not have a name field, then override the autocomplete_search_fields()  and dal_autocomplete_search_fields methods
      (see implementation below)
     3. implement the `condition_met_as_prerequisite(user, num_required)` method to the model class
+    4. optionally, override the `condition_met_as_prerequisite_batch(user, requirements)` classmethod so that many
+     objects can be evaluated at once in a few queries (see PrereqManager.all_conditions_met_ids())
 
     """
 
@@ -127,6 +132,25 @@ class IsAPrereqMixin:
         """
         raise NotImplementedError(f"{self.__class__.__name__} model must implement a condition_met_as_prerequisite() method")
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """
+        A batch version of condition_met_as_prerequisite() used by PrereqManager.all_conditions_met_ids() to evaluate
+        many prerequisites at once.  This default implementation loads the objects in one query and then calls
+        condition_met_as_prerequisite() on each of them, so implementing models should override it to use a
+        constant number of queries.
+
+        :param user: a django user
+        :param requirements: an iterable of (object_id, num_required) tuples
+        :return: a dict of {(object_id, num_required): True/False}.  Objects that don't exist are left out.
+        """
+        requirements = set(requirements)
+        objects = cls._base_manager.in_bulk({object_id for object_id, _ in requirements})
+        return {
+            (object_id, num_required): objects[object_id].condition_met_as_prerequisite(user, num_required)
+            for object_id, num_required in requirements if object_id in objects
+        }
+
     def is_used_prereq(self):
         """
         :return: True if this object has been assigned as a prerequisite to at least one another object.
@@ -318,6 +342,122 @@ class PrereqManager(models.Manager):
                 return False
         return True
 
+    def all_conditions_met_ids(self, parent_qs, user, no_prereq_means=True):
+        """
+        A batch version of all_conditions_met(), for every object in `parent_qs` at once.
+
+        Instead of resolving each prereq_object through its GenericForeignKey and querying its conditions one at a
+        time, all Prereq rows are loaded up front, each prerequisite model evaluates all of its requirements for the
+        user with condition_met_as_prerequisite_batch(), and then the AND/OR/NOT graph (including chains of named
+        Prereqs) is evaluated in memory.  So the number of queries depends on the number of prerequisite models,
+        not on the number of objects or Prereqs.
+
+        :param parent_qs: a queryset of objects that implement HasPrereqsMixin
+        :param no_prereq_means: see all_conditions_met()
+        :return: a list of pks of the objects in parent_qs for which the user has met all the prerequisites
+        """
+        parent_ct = ContentType.objects.get_for_model(parent_qs.model)
+        prereq_ct = ContentType.objects.get_for_model(self.model)
+        parent_ids = list(parent_qs.values_list('pk', flat=True))
+
+        all_prereqs = {prereq.id: prereq for prereq in self.get_queryset()}
+
+        parent_id_set = set(parent_ids)
+        prereqs_by_parent = defaultdict(list)
+        for prereq in all_prereqs.values():
+            if prereq.parent_content_type_id == parent_ct.id and prereq.parent_object_id in parent_id_set:
+                prereqs_by_parent[prereq.parent_object_id].append(prereq)
+
+        # gather every requirement the parents rely on, following named Prereqs used as prereq objects
+        requirements = defaultdict(set)  # {content_type_id: {(object_id, num_required), ...}}
+        prereqs_to_visit = [prereq for prereqs in prereqs_by_parent.values() for prereq in prereqs]
+        visited = set()
+        while prereqs_to_visit:
+            prereq = prereqs_to_visit.pop()
+            if prereq.id in visited:
+                continue
+            visited.add(prereq.id)
+            for content_type_id, object_id, num_required in prereq.get_requirements():
+                if content_type_id == prereq_ct.id:
+                    if object_id in all_prereqs:
+                        prereqs_to_visit.append(all_prereqs[object_id])
+                else:
+                    requirements[content_type_id].add((object_id, num_required))
+
+        requirement_results = {}
+        for content_type_id, model_requirements in requirements.items():
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+            if not IsAPrereqMixin.model_is_registered(model_class):
+                continue  # treated the same as a missing prereq_object
+            for (object_id, num_required), met in model_class.condition_met_as_prerequisite_batch(user, model_requirements).items():
+                requirement_results[(content_type_id, object_id, num_required)] = met
+
+        prereq_results = {}
+
+        def requirement_met(content_type_id, object_id, num_required):
+            if content_type_id == prereq_ct.id:
+                prereq = all_prereqs.get(object_id)
+                if prereq is None:
+                    return None
+                if prereq.id not in prereq_results:
+                    prereq_results[prereq.id] = False  # guard against circular chains of named Prereqs
+                    prereq_results[prereq.id] = prereq.condition_met_from_results(requirement_met)
+                return prereq_results[prereq.id]
+            return requirement_results.get((content_type_id, object_id, num_required))
+
+        pk_met_list = []
+        for parent_id in parent_ids:
+            prereqs = prereqs_by_parent.get(parent_id)
+            if not prereqs:
+                if no_prereq_means:
+                    pk_met_list.append(parent_id)
+            elif all(prereq.condition_met_from_results(requirement_met) for prereq in prereqs):
+                pk_met_list.append(parent_id)
+        return pk_met_list
+
+    def all_reliant_parents(self, prereq_keys):
+        """
+        Finds every parent object whose prerequisites might change when the conditions of the objects in
+        `prereq_keys` change for a user, e.g. when a user completes a quest only the objects that use that quest as a
+        prereq (or alternate prereq) need to be re-evaluated, not every object in the deck.
+
+        Named Prereqs can themselves be used as a prereq_object, so those chains are followed transitively, one query
+        per level of the chain.
+
+        :param prereq_keys: an iterable of (content_type_id, object_id) tuples.  An object_id of None matches every
+            object of that content type, e.g. all Ranks when a user's XP changes.
+        :return: a set of (parent_content_type_id, parent_object_id) tuples
+        """
+        prereq_ct = ContentType.objects.get_for_model(self.model)
+        parent_keys = set()
+        seen = set()
+        keys_to_check = set(prereq_keys)
+
+        while keys_to_check:
+            seen |= keys_to_check
+
+            q = Q()
+            for content_type_id, object_id in keys_to_check:
+                if object_id is None:
+                    q |= Q(prereq_content_type_id=content_type_id) | Q(or_prereq_content_type_id=content_type_id)
+                else:
+                    q |= (
+                        Q(prereq_content_type_id=content_type_id, prereq_object_id=object_id) |
+                        Q(or_prereq_content_type_id=content_type_id, or_prereq_object_id=object_id)
+                    )
+
+            reliant_prereqs = self.get_queryset().filter(q).values_list('id', 'parent_content_type_id', 'parent_object_id')
+
+            keys_to_check = set()
+            for prereq_id, parent_content_type_id, parent_object_id in reliant_prereqs:
+                parent_keys.add((parent_content_type_id, parent_object_id))
+                # this Prereq's own condition may have changed too, so check anything that uses it as a prereq
+                prereq_key = (prereq_ct.id, prereq_id)
+                if prereq_key not in seen:
+                    keys_to_check.add(prereq_key)
+
+        return parent_keys
+
     def is_prerequisite(self, prereq_obj):
         """
         :return: True if obj is a prerequisite to any other object
@@ -512,6 +652,43 @@ class Prereq(IsAPrereqMixin, models.Model):
 
         return main_condition_met or or_condition_met
 
+    def get_requirements(self):
+        """
+        :return: a list of (content_type_id, object_id, num_required) tuples for the prereq and alternate (OR) prereq
+        """
+        requirements = [(self.prereq_content_type_id, self.prereq_object_id, self.prereq_count)]
+        if self.or_prereq_object_id and self.or_prereq_content_type_id:
+            requirements.append((self.or_prereq_content_type_id, self.or_prereq_object_id, self.or_prereq_count))
+        return requirements
+
+    def condition_met_from_results(self, requirement_met):
+        """
+        The same logic as condition_met(), but with the conditions of the prereq objects already evaluated.
+        Used by PrereqManager.all_conditions_met_ids()
+
+        :param requirement_met: a function (content_type_id, object_id, num_required) -> True/False, or None if the
+            object doesn't exist
+        :return: True if the conditions for this complex Prereq have been met
+        """
+        main_condition_met = requirement_met(self.prereq_content_type_id, self.prereq_object_id, self.prereq_count)
+        if main_condition_met is None:
+            return False
+
+        if self.prereq_invert:
+            main_condition_met = not main_condition_met
+
+        if not self.or_prereq_object_id or not self.or_prereq_content_type_id:
+            return main_condition_met
+
+        or_condition_met = requirement_met(self.or_prereq_content_type_id, self.or_prereq_object_id, self.or_prereq_count)
+        if or_condition_met is None:
+            return False
+
+        if self.or_prereq_invert:
+            or_condition_met = not or_condition_met
+
+        return main_condition_met or or_condition_met
+
     @classmethod
     def add_simple_prereq(cls, parent_object, prereq_object):
         """
@@ -545,6 +722,46 @@ class Prereq(IsAPrereqMixin, models.Model):
         return new_prereq
 
 
+class PrereqAllConditionsMetQuerySet(models.query.QuerySet):
+    """Changes to the cached ids are made with a single UPDATE statement in the database, so concurrent tasks
+    updating the same cache don't overwrite each other's changes (no read-modify-write in python)."""
+
+    def add_id(self, new_id):
+        """Appends new_id to the ids of every cache in the queryset that doesn't already have it"""
+        return self.exclude(ids__contains=[new_id]).update(
+            ids=Func(F('ids'), Value(new_id), function='array_append', output_field=ArrayField(models.IntegerField()))
+        )
+
+    def remove_id(self, id_to_remove):
+        """Removes id_to_remove from the ids of every cache in the queryset"""
+        return self.filter(ids__contains=[id_to_remove]).update(
+            ids=Func(F('ids'), Value(id_to_remove), function='array_remove', output_field=ArrayField(models.IntegerField()))
+        )
+
+    def update_ids(self, ids_to_add=(), ids_to_remove=()):
+        """Adds and removes ids in one statement, keeping the existing order and without creating duplicates"""
+        return self.update(ids=RawSQL(
+            "ARRAY("
+            "SELECT object_id FROM unnest(ids || %s::integer[]) WITH ORDINALITY AS t(object_id, position) "
+            "WHERE object_id <> ALL(%s::integer[]) "
+            "GROUP BY object_id ORDER BY MIN(position)"
+            ")",
+            (list(ids_to_add), list(ids_to_remove)),
+        ))
+
+    def all_ids(self):
+        """A single column queryset of the ids in the caches, to be used as a subquery
+        e.g. Quest.objects.filter(pk__in=PrereqAllConditionsMet.objects.filter(user=user).all_ids())"""
+        return self.annotate(
+            object_id=Func(F('ids'), function='unnest', output_field=models.IntegerField())
+        ).values('object_id')
+
+
+class PrereqAllConditionsMetManager(models.Manager):
+    def get_queryset(self):
+        return PrereqAllConditionsMetQuerySet(self.model, using=self._db)
+
+
 class PrereqAllConditionsMet(models.Model):
     """This is a cache of the Prereq.objects.all_conditions_met(obj, user) method which is super innefficient and clunky
     but also critical to how this site works.
@@ -554,28 +771,29 @@ class PrereqAllConditionsMet(models.Model):
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     # these next two fields look like a custom Generic Foreign Key implementation?
-    ids = models.TextField(default='[]')  # str representation of a list of ids for the model, e.g '[25, 34, 55, 56, 77]'
+    ids = ArrayField(models.IntegerField(), default=list, blank=True)  # ids of the model's objects, e.g [25, 34, 55, 56, 77]
     model_name = models.CharField(max_length=256)  # model name as a string with .get_model_name()
 
+    objects = PrereqAllConditionsMetManager()
+
     def add_id(self, new_id):
-        ids = self.get_ids()
-        if new_id not in ids:
-            ids.append(new_id)
-            self.set_ids(ids)
+        PrereqAllConditionsMet.objects.filter(pk=self.pk).add_id(new_id)
+        self.refresh_from_db(fields=['ids'])
 
     def remove_id(self, id_to_remove):
-        ids = self.get_ids()
-        if id_to_remove in ids:
-            ids.remove(id_to_remove)
-            self.set_ids(ids)
+        PrereqAllConditionsMet.objects.filter(pk=self.pk).remove_id(id_to_remove)
+        self.refresh_from_db(fields=['ids'])
+
+    def update_ids(self, ids_to_add=(), ids_to_remove=()):
+        """Adds and removes ids in a single UPDATE, see PrereqAllConditionsMetQuerySet.update_ids()"""
+        PrereqAllConditionsMet.objects.filter(pk=self.pk).update_ids(ids_to_add, ids_to_remove)
+        self.refresh_from_db(fields=['ids'])
 
     def get_ids(self):
-        if self.ids:
-            return json.loads(self.ids)
-        return PrereqAllConditionsMet.ids.default
+        return list(self.ids or [])
 
     def set_ids(self, id_list=None):
         if id_list is None:
             id_list = []
-        self.ids = str(id_list)
+        self.ids = list(id_list)
         self.save()
@@ -1,12 +1,14 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from badges.models import Badge
+from badges.models import Badge, BadgeAssertion
+from courses.models import Block, Course, CourseStudent, Grade, Rank
 from prerequisites.models import Prereq, HasPrereqsMixin
 from prerequisites.tasks import update_conditions_for_quest, update_quest_conditions_all_users, update_quest_conditions_for_user
-from quest_manager.models import Quest, QuestSubmission
+from quest_manager.models import Category, Quest, QuestSubmission
 from djcytoscape.models import CytoScape
 
 User = get_user_model()
@@ -20,6 +22,32 @@ User = get_user_model()
 #     update_quest_conditions_for_user.apply_async(args=[instance.user_id], queue='default')
 
 
+def get_changed_prereq_keys(instance):
+    """ The prerequisite objects whose conditions might have changed for the instance's user when `instance`
+    (a BadgeAssertion, QuestSubmission or CourseStudent) is saved or deleted.
+
+    Returns a list of [content_type_id, object_id] pairs (json serializable, for celery).  An object_id of None means
+    every object of that content type could be affected, e.g. any Rank when the user's XP changes, or any Course,
+    Block or Grade when a CourseStudent is edited (the previous values aren't available in a post_save signal).
+    """
+    # all of these can change the user's XP
+    changed_keys = [[ContentType.objects.get_for_model(Rank).id, None]]
+
+    if isinstance(instance, QuestSubmission):
+        changed_keys.append([ContentType.objects.get_for_model(Quest).id, instance.quest_id])
+        # the quest might have been deleted (cascading to this submission), so don't use instance.quest
+        campaign_id = Quest.objects.all_including_archived().filter(id=instance.quest_id).values_list('campaign_id', flat=True).first()
+        if campaign_id:
+            changed_keys.append([ContentType.objects.get_for_model(Category).id, campaign_id])
+    elif isinstance(instance, BadgeAssertion):
+        changed_keys.append([ContentType.objects.get_for_model(Badge).id, instance.badge_id])
+    elif isinstance(instance, CourseStudent):
+        for model in (Course, Block, Grade):
+            changed_keys.append([ContentType.objects.get_for_model(model).id, None])
+
+    return changed_keys
+
+
 @receiver([post_save, post_delete], dispatch_uid="prerequisites.signals.update_cache_triggered_by_task_completion")
 def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs):
     """ When a user completes a task (e.g. earns a badge, has a quest submission approved or rejected, or joins a course)
@@ -36,8 +64,6 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
     list_of_models = ('BadgeAssertion', 'QuestSubmission', 'CourseStudent')
 
     if sender.__name__ in list_of_models:
-        # TODO Since the cache is only for quests (as prereq parent object), only need to send for affected quests, not ALL quests?
-
         # To prevent triggering update_quest_conditions_for_user more than once,
         # we check if the QuestSubmission is complete and approved.
         # When both conditions are met, that would be the only time we want to update available quests
@@ -45,7 +71,8 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
         if isinstance(instance, QuestSubmission) and (instance.is_completed is False or instance.is_approved is False):
             return
 
-        update_quest_conditions_for_user.apply_async(args=[instance.user_id], queue='default')
+        # The cache is only for quests (as prereq parent object), so only update the quests that rely on what changed
+        update_quest_conditions_for_user.apply_async(args=[instance.user_id, get_changed_prereq_keys(instance)], queue='default')
 
 
 # Don't need post_delete, it doesn't affect on result and will be updated on next all conditions update
@@ -3,6 +3,7 @@ import traceback
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.db import transaction
 from django.db.utils import OperationalError
@@ -68,6 +69,7 @@ def update_conditions_for_quest(self, quest_id, start_from_user_id):
 
     users = users.order_by('id').filter(id__gte=start_from_user_id)[:settings.CELERY_TASKS_BUNCH_SIZE]
     user = None
+    met_cache_ids, not_met_cache_ids = [], []
 
     for user in users:
         try:
@@ -85,11 +87,15 @@ def update_conditions_for_quest(self, quest_id, start_from_user_id):
             continue
 
         if Prereq.objects.all_conditions_met(quest, user):
-            quest_prereq_cache.add_id(quest.id)
+            met_cache_ids.append(quest_prereq_cache.id)
         else:
-            quest_prereq_cache.remove_id(quest.id)
+            not_met_cache_ids.append(quest_prereq_cache.id)
 
     else:
+        # update the whole bunch of caches at once, in the database
+        PrereqAllConditionsMet.objects.filter(id__in=met_cache_ids).add_id(quest.id)
+        PrereqAllConditionsMet.objects.filter(id__in=not_met_cache_ids).remove_id(quest.id)
+
         # finished the previous bunch, call the next bunch recursively
         # or maybe there were no users in the bunch... check that too
         if user:
@@ -108,14 +114,49 @@ def update_conditions_for_quest(self, quest_id, start_from_user_id):
     return quest.name
 
 
+def update_reliant_quest_conditions_for_user(user, quest_prereq_cache, changed_prereq_keys):
+    """Re-evaluates only the quests that rely on the changed prerequisite objects (directly, or through a chain of
+    named Prereqs) and writes the difference into the user's cache of available quests.
+
+    Args:
+        user (User): the user whose cache is being updated
+        quest_prereq_cache (PrereqAllConditionsMet): the user's existing cache of available quests
+        changed_prereq_keys (list): [content_type_id, object_id] pairs of the prerequisite objects whose conditions
+            may have changed for this user.  An object_id of None means every object of that content type.
+    """
+    quest_ct = ContentType.objects.get_for_model(Quest)
+    reliant_parents = Prereq.objects.all_reliant_parents(tuple(key) for key in changed_prereq_keys)
+    reliant_quest_ids = {object_id for content_type_id, object_id in reliant_parents if content_type_id == quest_ct.id}
+
+    met_ids = Prereq.objects.all_conditions_met_ids(Quest.objects.filter(id__in=reliant_quest_ids), user)
+    quest_prereq_cache.update_ids(ids_to_add=met_ids, ids_to_remove=reliant_quest_ids.difference(met_ids))
+    return quest_prereq_cache
+
+
 @app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_for_user', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
-def update_quest_conditions_for_user(self, user_id):
+def update_quest_conditions_for_user(self, user_id, changed_prereq_keys=None):
+    """Updates the user's cache of available quests (PrereqAllConditionsMet).
+
+    Args:
+        user_id (int): the user to update
+        changed_prereq_keys (list, optional): [content_type_id, object_id] pairs of the prerequisite objects that
+            changed for this user (see `prerequisites.signals.get_changed_prereq_keys`).  If provided, and the user
+            already has a cache, only the quests relying on those objects are re-evaluated.  Otherwise, every quest is.
+    """
     user = User.objects.filter(id=user_id).first()
     if not user:
         return None
-    pk_met_list = [obj.pk for obj in Quest.objects.all() if Prereq.objects.all_conditions_met(obj, user)]
+
+    if changed_prereq_keys is not None:
+        quest_prereq_caches = list(PrereqAllConditionsMet.objects.filter(user=user, model_name=Quest.get_model_name())[:2])
+        # if there's no cache yet (or multiple, somehow) then there's nothing to update, so fall through to a full recalc
+        if len(quest_prereq_caches) == 1:
+            met_list = update_reliant_quest_conditions_for_user(user, quest_prereq_caches[0], changed_prereq_keys)
+            return met_list.id
+
+    pk_met_list = Prereq.objects.all_conditions_met_ids(Quest.objects.all(), user)
     met_list, created = PrereqAllConditionsMet.objects.update_or_create(
-        user=user, model_name=Quest.get_model_name(), defaults={'ids': str(pk_met_list)})
+        user=user, model_name=Quest.get_model_name(), defaults={'ids': pk_met_list})
 
     logger.info(f"Task prerequisites.tasks.update_quest_conditions_for_user: Cache of available quests udpated for {user.username}")
     # Return value is displayed at the end of the celery log
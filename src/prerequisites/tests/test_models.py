@@ -3,11 +3,13 @@
 from django.utils.six import text_type
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import connection, models
+from django.test.utils import CaptureQueriesContext
 
 from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, tenant_queries
 from prerequisites.models import IsAPrereqMixin, Prereq, PrereqAllConditionsMet
 
 from psycopg2.errors import UndefinedTable
@@ -198,6 +200,21 @@ class IsAPrereqMixinTest(TenantTestCase):
                 # https://github.com/bytedeck/bytedeck/issues/1868
                 pass
 
+    def test_condition_met_as_prerequisite_batch__matches_condition_met_as_prerequisite(self):
+        """ For all registered models, the batch version gives the same result as the single object version,
+        and leaves out objects that don't exist """
+        user = baker.make(User)
+        for ct in IsAPrereqMixin.all_registered_content_types():
+            model_class = ct.model_class()
+            instance = baker.make(model_class)
+            try:
+                expected = instance.condition_met_as_prerequisite(user, 1)
+            except UndefinedTable:
+                # see test_condition_met_as_prerequisite__is_implemented
+                continue
+            results = model_class.condition_met_as_prerequisite_batch(user, [(instance.id, 1), (instance.id + 1000, 1)])
+            self.assertDictEqual(results, {(instance.id, 1): expected}, msg=model_class)
+
     def test_gfk_search_fields__is_implemented(self):
         """ All models implementing this Mixin, also implement this method if the default doesn't suffice """
         prereq_models = IsAPrereqMixin.all_registered_model_classes()
@@ -285,7 +302,114 @@ class PrereqModelTest(TenantTestCase):
             Prereq.add_simple_prereq(quest3, some_object)
 
 
-class PrereqAllConditionsMetModelTest(TenantTestCase):
+class PrereqManagerTest(TenantTestCase):
+
+    def setUp(self):
+        self.quest_prereq = baker.make('quest_manager.Quest', name="prereq")
+        self.quest_parent = baker.make('quest_manager.Quest', name="parent")
+        self.quest_or_parent = baker.make('quest_manager.Quest', name="or_parent")
+        self.quest_unrelated = baker.make('quest_manager.Quest', name="unrelated")
+        self.quest_ct = ContentType.objects.get_for_model(self.quest_prereq)
+
+        Prereq.add_simple_prereq(self.quest_parent, self.quest_prereq)
+        Prereq.objects.create(
+            parent_object=self.quest_or_parent,
+            prereq_object=baker.make('quest_manager.Quest'),
+            or_prereq_object=self.quest_prereq,
+        )
+        Prereq.add_simple_prereq(self.quest_unrelated, baker.make('quest_manager.Quest'))
+
+    def assert_all_conditions_met_ids_matches_all_conditions_met(self, user, parent_qs, no_prereq_means=True):
+        expected = [obj.pk for obj in parent_qs if Prereq.objects.all_conditions_met(obj, user, no_prereq_means)]
+        self.assertListEqual(Prereq.objects.all_conditions_met_ids(parent_qs, user, no_prereq_means), expected)
+
+    def test_all_conditions_met_ids(self):
+        """ The batch evaluation gives the same results as evaluating each parent one at a time, including
+        OR, NOT, counts, named Prereq chains, and different kinds of prerequisite objects """
+        from quest_manager.models import Quest
+
+        student = baker.make(User)
+        badge = baker.make('badges.Badge', name="badge")
+        rank = baker.make('courses.Rank', name="rank", xp=0)
+        baker.make('quest_manager.QuestSubmission', user=student, quest=self.quest_prereq, is_completed=True, is_approved=True)
+        baker.make('badges.BadgeAssertion', user=student, badge=badge)
+
+        quest_not = baker.make('quest_manager.Quest', name="not")
+        Prereq.objects.create(parent_object=quest_not, prereq_object=self.quest_prereq, prereq_invert=True)
+        quest_x2 = baker.make('quest_manager.Quest', name="x2")
+        Prereq.objects.create(parent_object=quest_x2, prereq_object=self.quest_prereq, prereq_count=2)
+        quest_or_not = baker.make('quest_manager.Quest', name="or not")
+        Prereq.objects.create(
+            parent_object=quest_or_not, prereq_object=self.quest_unrelated, or_prereq_object=badge, or_prereq_invert=True,
+        )
+        quest_and = baker.make('quest_manager.Quest', name="and")
+        Prereq.add_simple_prereq(quest_and, badge)
+        Prereq.add_simple_prereq(quest_and, rank)
+        named_prereq = Prereq.objects.create(
+            name="named", parent_object=badge, prereq_object=self.quest_unrelated, or_prereq_object=self.quest_prereq,
+        )
+        quest_chained = baker.make('quest_manager.Quest', name="chained")
+        Prereq.objects.create(parent_object=quest_chained, prereq_object=named_prereq)
+        quest_deleted_prereq = baker.make('quest_manager.Quest', name="deleted prereq")
+        Prereq.objects.create(parent_object=quest_deleted_prereq, prereq_object=baker.make('quest_manager.Quest'), prereq_invert=True)
+        Quest.objects.get(name="deleted prereq").prereqs().first().prereq_object.delete()
+
+        self.assert_all_conditions_met_ids_matches_all_conditions_met(student, Quest.objects.all())
+        self.assert_all_conditions_met_ids_matches_all_conditions_met(student, Quest.objects.all(), no_prereq_means=False)
+        self.assertIn(quest_chained.id, Prereq.objects.all_conditions_met_ids(Quest.objects.all(), student))
+
+    def test_all_conditions_met_ids__num_queries(self):
+        """ The number of queries doesn't grow with the number of parents and prereqs """
+        from quest_manager.models import Quest
+
+        student = baker.make(User)
+        with CaptureQueriesContext(connection) as queries:
+            Prereq.objects.all_conditions_met_ids(Quest.objects.all(), student)
+        num_queries = len(queries)
+
+        for _ in range(5):
+            Prereq.add_simple_prereq(baker.make('quest_manager.Quest'), baker.make('quest_manager.Quest'))
+            Prereq.add_simple_prereq(baker.make('quest_manager.Quest'), baker.make('badges.Badge'))
+
+        with self.assertNumQueries(num_queries):
+            Prereq.objects.all_conditions_met_ids(Quest.objects.all(), student)
+
+    def test_all_reliant_parents(self):
+        """Returns the parents of Prereqs that use the object as either the prereq or the alternate (OR) prereq,
+        and nothing else"""
+        parents = Prereq.objects.all_reliant_parents([(self.quest_ct.id, self.quest_prereq.id)])
+        self.assertSetEqual(parents, {
+            (self.quest_ct.id, self.quest_parent.id),
+            (self.quest_ct.id, self.quest_or_parent.id),
+        })
+
+    def test_all_reliant_parents__named_prereq_chain(self):
+        """Parents that rely on a (named) Prereq, which in turn relies on the object, are included"""
+        badge = baker.make('badges.Badge')
+        named_prereq = Prereq.objects.create(name="named", parent_object=badge, prereq_object=self.quest_prereq)
+        quest_chained = baker.make('quest_manager.Quest', name="chained")
+        Prereq.objects.create(parent_object=quest_chained, prereq_object=named_prereq)
+
+        parents = Prereq.objects.all_reliant_parents([(self.quest_ct.id, self.quest_prereq.id)])
+        self.assertIn((ContentType.objects.get_for_model(badge).id, badge.id), parents)
+        self.assertIn((self.quest_ct.id, quest_chained.id), parents)
+        self.assertNotIn((self.quest_ct.id, self.quest_unrelated.id), parents)
+
+    def test_all_reliant_parents__any_object_of_content_type(self):
+        """An object_id of None matches all objects of that content type"""
+        rank = baker.make('courses.Rank', name='rank')
+        Prereq.add_simple_prereq(self.quest_unrelated, rank)
+
+        parents = Prereq.objects.all_reliant_parents([(ContentType.objects.get_for_model(rank).id, None)])
+        self.assertSetEqual(parents, {(self.quest_ct.id, self.quest_unrelated.id)})
+
+    def test_all_reliant_parents__none_found(self):
+        """Objects that aren't used as a prereq have no reliant parents"""
+        parents = Prereq.objects.all_reliant_parents([(self.quest_ct.id, self.quest_parent.id)])
+        self.assertSetEqual(parents, set())
+
+
+class PrereqAllConditionsMetModelTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.student = baker.make(User, username='student', is_staff=False)
@@ -298,16 +422,22 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
     def test_object_creation(self):
         self.assertIsInstance(self.prereq_cache, PrereqAllConditionsMet)
         self.assertEqual(self.prereq_cache.user, self.student)
-        self.assertEqual(self.prereq_cache.ids, '[]')
+        self.assertEqual(self.prereq_cache.ids, [])
 
     def test_get_ids_when_empty(self):
         self.assertEqual([], self.prereq_cache.get_ids())
 
     def test_get_ids(self):
         ids = [1, 2, 3, 4, 5]
-        self.prereq_cache.ids = str(ids)
+        self.prereq_cache.ids = ids
         self.assertEqual(ids, self.prereq_cache.get_ids())
 
+    def test_set_ids(self):
+        """The ids are saved as an integer array"""
+        self.prereq_cache.set_ids([3, 1, 2])
+        self.prereq_cache.refresh_from_db()
+        self.assertEqual(self.prereq_cache.ids, [3, 1, 2])
+
     def test_add_id(self):
         self.assertEqual(len(self.prereq_cache.get_ids()), 0)
 
@@ -319,8 +449,13 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
         self.assertEqual(len(self.prereq_cache.get_ids()), 2)
         self.assertEqual(self.prereq_cache.get_ids(), [100, 101])
 
+    def test_add_id_that_already_exists(self):
+        self.prereq_cache.set_ids([1, 2])
+        self.prereq_cache.add_id(2)
+        self.assertEqual(self.prereq_cache.get_ids(), [1, 2])
+
     def test_remove_id(self):
-        self.prereq_cache.ids = str([1, 2, 3, 4, 5])
+        self.prereq_cache.set_ids([1, 2, 3, 4, 5])
         self.assertIn(1, self.prereq_cache.get_ids())
 
         self.prereq_cache.remove_id(1)
@@ -328,9 +463,44 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
 
     def test_remove_id_that_doesnt_exist(self):
         ids = [1, 2, 3, 4, 5]
-        self.prereq_cache.ids = str(ids)
+        self.prereq_cache.set_ids(ids)
         self.assertNotIn(6, self.prereq_cache.get_ids())
 
         self.prereq_cache.remove_id(6)
         self.assertNotIn(6, self.prereq_cache.get_ids())
         self.assertEqual(len(self.prereq_cache.get_ids()), len(ids))
+
+    def test_update_ids(self):
+        """Ids are added and removed in one go, without duplicating existing ids"""
+        self.prereq_cache.set_ids([1, 2, 3])
+
+        self.prereq_cache.update_ids(ids_to_add=[3, 4, 4], ids_to_remove=[1, 5])
+        self.prereq_cache.refresh_from_db()
+        self.assertEqual(self.prereq_cache.get_ids(), [2, 3, 4])
+
+    def test_queryset_add_id_and_remove_id(self):
+        """Ids can be added to and removed from many caches at once, with a single UPDATE"""
+        other_cache = baker.make(PrereqAllConditionsMet, user=baker.make(User), model_name='fake_model_name', ids=[7])
+        caches = PrereqAllConditionsMet.objects.filter(id__in=[self.prereq_cache.id, other_cache.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            caches.add_id(7)
+        # django-tenants may also set the search_path
+        self.assertEqual([q['sql'].split()[0] for q in tenant_queries(queries)], ['UPDATE'])
+        self.prereq_cache.refresh_from_db()
+        other_cache.refresh_from_db()
+        self.assertEqual(self.prereq_cache.ids, [7])
+        self.assertEqual(other_cache.ids, [7])
+
+        caches.remove_id(7)
+        self.assertFalse(PrereqAllConditionsMet.objects.filter(ids__contains=[7]).exists())
+
+    def test_queryset_all_ids(self):
+        """all_ids() can be used as a subquery to filter the cached model's objects"""
+        quests = baker.make('quest_manager.Quest', _quantity=3)
+        self.prereq_cache.set_ids([quests[0].id, quests[2].id])
+
+        cached_quests = quests[0].__class__.objects.filter(
+            pk__in=PrereqAllConditionsMet.objects.filter(user=self.student).all_ids()
+        )
+        self.assertCountEqual(cached_quests, [quests[0], quests[2]])
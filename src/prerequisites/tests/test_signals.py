@@ -73,6 +73,28 @@ class PrerequisitesSignalsTest(TenantTestCase):
         self.quest_submission.save()
         self.assertEqual(task.call_count, 1)
 
+    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    def test_update_conditions_met_for_user_triggered_by_quest_submission__changed_prereq_keys(self, task):
+        """
+        Approving a submission sends the quest, its campaign, and all ranks as the changed prereq objects,
+        so that only quests relying on them are re-evaluated
+        """
+        campaign = baker.make('quest_manager.Category')
+        quest = baker.make(Quest, campaign=campaign)
+        submission = baker.make(QuestSubmission, user=self.student, quest=quest)
+        submission.is_completed = True
+        submission.is_approved = True
+        submission.save()
+
+        self.assertEqual(task.call_count, 1)
+        user_id, changed_prereq_keys = task.call_args.kwargs['args']
+        self.assertEqual(user_id, self.student.id)
+        self.assertCountEqual(changed_prereq_keys, [
+            [ContentType.objects.get(app_label='courses', model='rank').id, None],
+            [ContentType.objects.get_for_model(quest).id, quest.id],
+            [ContentType.objects.get_for_model(campaign).id, campaign.id],
+        ])
+
     @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_course_student_on_create(self, task):
         with patch('profile_manager.models.Profile.xp_invalidate_cache') as callback:
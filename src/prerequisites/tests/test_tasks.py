@@ -1 +1,82 @@
 # When prereq is changed, id is added/removed from cache
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from prerequisites.models import Prereq, PrereqAllConditionsMet
+from prerequisites.tasks import update_quest_conditions_for_user
+from quest_manager.models import Quest, QuestSubmission
+
+User = get_user_model()
+
+
+class UpdateQuestConditionsForUserTest(TenantTestCase):
+
+    def setUp(self):
+        self.student = baker.make(User, username='student', is_staff=False)
+
+        self.quest_prereq = baker.make(Quest, name='prereq')
+        self.quest_reliant = baker.make(Quest, name='reliant')
+        Prereq.add_simple_prereq(self.quest_reliant, self.quest_prereq)
+
+        self.quest_locked = baker.make(Quest, name='locked')
+        Prereq.add_simple_prereq(self.quest_locked, baker.make(Quest, name='never completed'))
+
+        self.changed_prereq_keys = [[ContentType.objects.get_for_model(Quest).id, self.quest_prereq.id]]
+
+    def get_cached_ids(self):
+        return PrereqAllConditionsMet.objects.get(user=self.student, model_name=Quest.get_model_name()).get_ids()
+
+    def approve_prereq_quest(self):
+        baker.make(QuestSubmission, user=self.student, quest=self.quest_prereq, is_completed=True, is_approved=True)
+
+    def test_update_quest_conditions_for_user__full_recalculation(self):
+        """Without changed prereq keys, every quest is evaluated and the cache is created"""
+        update_quest_conditions_for_user(self.student.id)
+
+        cached_ids = self.get_cached_ids()
+        self.assertIn(self.quest_prereq.id, cached_ids)
+        self.assertNotIn(self.quest_reliant.id, cached_ids)
+        self.assertNotIn(self.quest_locked.id, cached_ids)
+
+    def test_update_quest_conditions_for_user__no_cache_falls_back_to_full_recalculation(self):
+        """If the user doesn't have a cache yet, then changed prereq keys are ignored and everything is calculated"""
+        self.approve_prereq_quest()
+        update_quest_conditions_for_user(self.student.id, self.changed_prereq_keys)
+
+        cached_ids = self.get_cached_ids()
+        self.assertIn(self.quest_prereq.id, cached_ids)
+        self.assertIn(self.quest_reliant.id, cached_ids)
+
+    def test_update_quest_conditions_for_user__only_reliant_quests_updated(self):
+        """With changed prereq keys, only quests relying on the changed objects are re-evaluated, other cached ids
+        are left alone (the unrelated id below would be removed by a full recalculation)"""
+        unrelated_id = self.quest_locked.id
+        baker.make(PrereqAllConditionsMet, user=self.student, model_name=Quest.get_model_name(), ids=[unrelated_id])
+        self.approve_prereq_quest()
+
+        update_quest_conditions_for_user(self.student.id, self.changed_prereq_keys)
+
+        self.assertEqual(self.get_cached_ids(), [unrelated_id, self.quest_reliant.id])
+
+    def test_update_quest_conditions_for_user__reliant_quest_removed(self):
+        """A reliant quest whose prereqs are no longer met is removed from the cache"""
+        baker.make(PrereqAllConditionsMet, user=self.student, model_name=Quest.get_model_name(), ids=[self.quest_reliant.id])
+
+        update_quest_conditions_for_user(self.student.id, self.changed_prereq_keys)
+
+        self.assertEqual(self.get_cached_ids(), [])
+
+    def test_update_quest_conditions_for_user__named_prereq_chain(self):
+        """Quests that rely on a named Prereq, which relies on the changed object, are also re-evaluated"""
+        named_prereq = Prereq.objects.create(name='named', parent_object=baker.make('badges.Badge'), prereq_object=self.quest_prereq)
+        quest_chained = baker.make(Quest, name='chained')
+        Prereq.objects.create(parent_object=quest_chained, prereq_object=named_prereq)
+        baker.make(PrereqAllConditionsMet, user=self.student, model_name=Quest.get_model_name())
+        self.approve_prereq_quest()
+
+        update_quest_conditions_for_user(self.student.id, self.changed_prereq_keys)
+
+        self.assertCountEqual(self.get_cached_ids(), [self.quest_reliant.id, quest_chained.id])
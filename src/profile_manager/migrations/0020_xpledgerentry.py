@@ -0,0 +1,74 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def seed_xp_ledger(apps, schema_editor):
+    """ Record the XP already granted by approved submissions and badge assertions, in the order it was earned,
+    with each quest's max_xp cap applied cumulatively. """
+    QuestSubmission = apps.get_model('quest_manager', 'QuestSubmission')
+    BadgeAssertion = apps.get_model('badges', 'BadgeAssertion')
+    XPLedgerEntry = apps.get_model('profile_manager', 'XPLedgerEntry')
+
+    entries = []
+    earned = {}
+    submissions = QuestSubmission.objects.filter(
+        is_approved=True, do_not_grant_xp=False, quest__archived=False,
+    ).order_by('time_approved', 'id').values(
+        'user_id', 'quest_id', 'semester_id', 'time_approved', 'timestamp', 'xp_requested', 'quest__xp', 'quest__max_xp',
+    )
+    for sub in submissions.iterator():
+        key = (sub['user_id'], sub['quest_id'], sub['semester_id'])
+        xp = max(sub['quest__xp'], sub['xp_requested'])
+        if sub['quest__max_xp'] != -1:
+            xp = max(min(xp, sub['quest__max_xp'] - earned.get(key, 0)), 0)
+        earned[key] = earned.get(key, 0) + xp
+        if xp:
+            entries.append(XPLedgerEntry(
+                user_id=sub['user_id'], quest_id=sub['quest_id'], semester_id=sub['semester_id'], xp=xp,
+                timestamp=sub['time_approved'] or sub['timestamp'],
+            ))
+
+    assertions = BadgeAssertion.objects.filter(do_not_grant_xp=False).exclude(badge__xp=0).values(
+        'user_id', 'badge_id', 'semester_id', 'timestamp', 'badge__xp',
+    )
+    for assertion in assertions.iterator():
+        entries.append(XPLedgerEntry(
+            user_id=assertion['user_id'], badge_id=assertion['badge_id'], semester_id=assertion['semester_id'],
+            xp=assertion['badge__xp'], timestamp=assertion['timestamp'],
+        ))
+
+    XPLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0028_semester_name'),
+        ('quest_manager', '0048_alter_category_published'),
+        ('badges', '0015_rename_active_badge_published'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('profile_manager', '0019_auto_20240807_1432'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='XPLedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('xp', models.IntegerField(help_text='Positive when XP is granted, negative when it is revoked.')),
+                ('badge', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='badges.badge')),
+                ('quest', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='quest_manager.quest')),
+                ('semester', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='courses.semester')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='xp_ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'semester', 'timestamp'], name='profile_man_user_id_dbe1d7_idx')],
+            },
+        ),
+        migrations.RunPython(seed_xp_ledger, migrations.RunPython.noop),
+    ]
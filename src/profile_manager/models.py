@@ -1,13 +1,17 @@
 # import re
+from collections import defaultdict
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import validate_comma_separated_integer_list
-from django.db import models
+from django.db import connection, models
 from django.db import transaction
 from django.db.transaction import TransactionManagementError
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Greatest, TruncDate
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.templatetags.static import static
@@ -15,11 +19,12 @@ from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 
+import numpy
 from django_resized import ResizedImageField
 from django_tenants.utils import get_public_schema_name
 
 from badges.models import BadgeAssertion
-from courses.models import CourseStudent, Rank
+from courses.models import CourseStudent, Rank, Semester
 from notifications.signals import notify
 from quest_manager.models import Quest, QuestSubmission
 from siteconfig.models import SiteConfig
@@ -342,14 +347,29 @@ class Profile(models.Model):
     #################################
 
     def xp_invalidate_cache(self):
-        xp = QuestSubmission.objects.calculate_xp(self.user)
-        xp += BadgeAssertion.objects.calculate_xp(self.user)
+        """Recalculate the cached XP and mark from this semester's entries in the student's XP ledger"""
+        xp = XPLedgerEntry.objects.get_user(self.user).get_semester(SiteConfig.get().active_semester).total()
         xp += CourseStudent.objects.calculate_xp(self.user)
         self.xp_cached = xp
         self.mark_cached = self.mark()
         self.save()
         return xp
 
+    def xp_recalculate(self):
+        """Bring the student's XP ledger back in line with their submissions and badge assertions,
+        then recalculate the cached XP and mark from it."""
+        XPLedgerEntry.objects.reconcile_quest_xp(user=self.user)
+        XPLedgerEntry.objects.reconcile_badge_xp(user=self.user)
+        return self.xp_invalidate_cache()
+
+    def xp_add(self, xp):
+        """Apply a change in XP that was just recorded in the XP ledger to the cached XP and mark"""
+        Profile.objects.filter(pk=self.pk).update(xp_cached=F('xp_cached') + xp)
+        self.refresh_from_db(fields=['xp_cached'])
+        self.mark_cached = self.mark()
+        Profile.objects.filter(pk=self.pk).update(mark_cached=self.mark_cached)
+        Semester.objects.invalidate_mark_histogram()
+
     def xp_per_course(self):
         course_count = self.num_courses()
         if not course_count or course_count == 0:
@@ -357,12 +377,31 @@ class Profile(models.Model):
         return self.xp_cached / course_count
 
     def xp_to_date(self, date):
-        # TODO: Combine this with other methods?
-        xp = QuestSubmission.objects.calculate_xp_to_date(self.user, date)
-        xp += BadgeAssertion.objects.calculate_xp_to_date(self.user, date)
-        # TODO: Add manual adjustments to calculation
-        xp += CourseStudent.objects.calculate_xp(self.user)
-        return xp
+        """The student's XP this semester as of the end of the (local) day of `date`, see xp_by_class_day()"""
+        day = numpy.datetime64(timezone.localdate(date), 'D')
+        xp_by_day, _ = self.xp_by_class_day(numpy.array([day]))
+        return xp_by_day[0]
+
+    def xp_by_class_day(self, class_days):
+        """
+        The student's XP this semester as of the end of each class day, in a single pass over the XP ledger (which
+        already has the max_xp caps applied).  XP earned on a weekend or excluded day counts towards the next class day.
+
+        :param class_days: an ascending numpy array of datetime64[D] class days, see Semester.class_days()
+        :return: a tuple of a list of the XP as of each class day, and the XP as of now
+        """
+        entries = list(XPLedgerEntry.objects.get_user(self.user).get_semester(SiteConfig.get().active_semester).annotate(
+            day=TruncDate('timestamp', tzinfo=timezone.get_current_timezone())
+        ).values_list('day', 'xp'))
+        days, xp = zip(*entries) if entries else ((), ())
+        adjustments = CourseStudent.objects.calculate_xp(self.user)
+
+        # the index of the class day on or after each entry's date, len(class_days) for entries after the last one
+        buckets = numpy.searchsorted(class_days, numpy.array(days, dtype='datetime64[D]'), side='left')
+        xp_per_day = numpy.bincount(buckets, weights=numpy.array(xp, dtype=float), minlength=len(class_days) + 1)
+        cumulative = numpy.cumsum(xp_per_day) + adjustments
+
+        return [int(total) for total in cumulative[:len(class_days)]], int(cumulative[-1])
 
     def mark(self):
         courses = self.current_courses()
@@ -428,6 +467,199 @@ class Profile(models.Model):
         return User.objects.filter(id__in=user_id_list)
 
 
+class XPLedgerEntryQuerySet(models.query.QuerySet):
+
+    def get_user(self, user):
+        return self.filter(user=user)
+
+    def get_semester(self, semester):
+        return self.filter(semester=semester)
+
+    def total(self):
+        return self.aggregate(total=Sum('xp'))['total'] or 0
+
+
+class XPLedgerEntryManager(models.Manager):
+    def get_queryset(self):
+        return XPLedgerEntryQuerySet(self.model, using=self._db)
+
+    def get_user(self, user):
+        return self.get_queryset().get_user(user)
+
+    @contextmanager
+    def _reconciling(self, user=None):
+        """
+        A transaction that holds this tenant's lock for reconciling the XP of `user`, or of every user if None, so
+        concurrent reconciles don't both read the same ledger sums and append the same difference twice.
+        Reconciles for different users can run at the same time.
+        """
+        key = f"{connection.schema_name}-xp-ledger"
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if user is None:
+                    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [key])
+                else:
+                    cursor.execute("SELECT pg_advisory_xact_lock_shared(hashtext(%s))", [key])
+                    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s), %s)", [key, user.id])
+            yield
+
+    def reconcile_quest_xp(self, user=None, quest=None, semester=None):
+        """
+        Append entries so the ledger's XP for each (user, quest, semester) matches the XP earned from the
+        approved submissions, with the quest's max_xp cap applied.  Leaving out an argument reconciles all of them.
+        """
+        with self._reconciling(user):
+            lookups = {key: value for key, value in [('user', user), ('quest', quest), ('semester', semester)] if value is not None}
+            submissions = QuestSubmission.objects.get_queryset(
+                exclude_quests_not_published=False, include_related=False
+            ).filter(**lookups).approved().grant_xp()
+
+            targets = {}
+            earned = submissions.order_by().values('user_id', 'quest_id', 'semester_id', 'quest__max_xp').annotate(
+                # xp could come from xp_requested on the submission, or from the quest's xp value, take the greater
+                xp=Sum(Greatest('quest__xp', 'xp_requested')),
+                latest=Max('time_approved'),
+            )
+            for row in earned:
+                xp = row['xp'] if row['quest__max_xp'] == -1 else min(row['xp'], row['quest__max_xp'])
+                targets[(row['user_id'], row['quest_id'], row['semester_id'])] = (xp, row['latest'])
+
+            recorded = self.get_queryset().filter(quest__isnull=False, **lookups)
+            return self._append_differences('quest_id', targets, recorded, user=user)
+
+    def reconcile_badge_xp(self, user=None, badge=None, semester=None):
+        """
+        Append entries so the ledger's XP for each (user, badge, semester) matches the XP granted by the
+        badge assertions.  Leaving out an argument reconciles all of them.
+        """
+        with self._reconciling(user):
+            lookups = {key: value for key, value in [('user', user), ('badge', badge), ('semester', semester)] if value is not None}
+            assertions = BadgeAssertion.objects.get_queryset().filter(**lookups).grant_xp()
+
+            targets = {}
+            granted = assertions.order_by().values('user_id', 'badge_id', 'semester_id').annotate(
+                xp=Sum('badge__xp'),
+                latest=Max('timestamp'),
+            )
+            for row in granted:
+                targets[(row['user_id'], row['badge_id'], row['semester_id'])] = (row['xp'], row['latest'])
+
+            recorded = self.get_queryset().filter(badge__isnull=False, **lookups)
+            return self._append_differences('badge_id', targets, recorded, user=user)
+
+    def _append_differences(self, source_field, targets, recorded, user=None):
+        """
+        Record an entry for each (user, source, semester) whose XP in the ledger differs from its target, and add
+        the changes in this semester to the cached XP of each student.  Grants are timestamped with the time they were
+        earned, revocations with the current time.
+
+        :param targets: {(user_id, source_id, semester_id): (xp, time earned)}
+        :param recorded: the ledger entries that correspond to the targets
+        :param user: if the entries are for a single User instance, its profile is updated in place
+        """
+        current = {
+            (row['user_id'], row[source_field], row['semester_id']): row['xp']
+            for row in recorded.order_by().values('user_id', source_field, 'semester_id').annotate(xp=Sum('xp'))
+        }
+
+        now = timezone.now()
+        entries = []
+        for key in targets.keys() | current.keys():
+            xp, earned_at = targets.get(key, (0, None))
+            difference = xp - current.get(key, 0)
+            if difference:
+                user_id, source_id, semester_id = key
+                entries.append(self.model(
+                    user_id=user_id,
+                    semester_id=semester_id,
+                    xp=difference,
+                    timestamp=earned_at if difference > 0 and earned_at else now,
+                    **{source_field: source_id},
+                ))
+        if not entries:
+            return []
+
+        entries = self.bulk_create(entries)
+
+        active_semester_id = SiteConfig.get().active_semester.pk
+        changes = defaultdict(int)
+        for entry in entries:
+            if entry.semester_id == active_semester_id:
+                changes[entry.user_id] += entry.xp
+
+        if user is not None and user.id in changes:
+            user.profile.xp_add(changes.pop(user.id))
+        for profile in Profile.objects.filter(user_id__in=[user_id for user_id, xp in changes.items() if xp]):
+            profile.xp_add(changes[profile.user_id])
+
+        return entries
+
+
+class XPLedgerEntry(models.Model):
+    """
+    An append-only record of the XP a student has been granted or had revoked for a quest or a badge.  A student's
+    XP for a semester is the sum of their entries, and their XP on any date is the sum of the entries up to it.
+    The entries are recorded by the signals below whenever submissions, assertions, quests or badges change.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='xp_ledger_entries')
+    semester = models.ForeignKey('courses.Semester', null=True, on_delete=models.SET_NULL)
+    timestamp = models.DateTimeField(default=timezone.now)
+    xp = models.IntegerField(help_text='Positive when XP is granted, negative when it is revoked.')
+    # The ledger keeps the ids of deleted quests and badges, so the XP they granted can still be revoked
+    quest = models.ForeignKey(Quest, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False)
+    badge = models.ForeignKey('badges.Badge', null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False)
+
+    objects = XPLedgerEntryManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'semester', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.xp:+d} XP'
+
+
+def deleted_with_user(origin):
+    """ True if a post_delete signal's origin is the deletion of a user (or their profile), in which case their XP
+    ledger is being deleted too and there is nothing to record """
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return model in (User, Profile)
+
+
+@receiver(post_save, sender=QuestSubmission)
+@receiver(post_delete, sender=QuestSubmission)
+def record_submission_xp(sender, instance, **kwargs):
+    if deleted_with_user(kwargs.get('origin')):
+        return
+    # drafts, starting a quest and other saves of a submission that isn't approved can't change the XP
+    if not instance.is_approved and not instance.saved_is_approved:
+        return
+    XPLedgerEntry.objects.reconcile_quest_xp(user=instance.user, quest=instance.quest_id, semester=instance.semester_id)
+    instance.saved_is_approved = instance.is_approved
+
+
+@receiver(post_save, sender=BadgeAssertion)
+@receiver(post_delete, sender=BadgeAssertion)
+def record_badge_assertion_xp(sender, instance, **kwargs):
+    if deleted_with_user(kwargs.get('origin')):
+        return
+    XPLedgerEntry.objects.reconcile_badge_xp(user=instance.user, badge=instance.badge_id, semester=instance.semester_id)
+
+
+@receiver(post_save, sender=Quest)
+def record_quest_xp(sender, instance, created, **kwargs):
+    """ A quest's xp, max_xp or archived status affects the XP of everyone who has submitted it """
+    if not created:
+        XPLedgerEntry.objects.reconcile_quest_xp(quest=instance)
+
+
+@receiver(post_save, sender='badges.Badge')
+def record_badge_xp(sender, instance, created, **kwargs):
+    if not created:
+        XPLedgerEntry.objects.reconcile_badge_xp(badge=instance)
+
+
 @receiver(post_save, sender=User)
 def create_profile(sender, **kwargs):
     from django.db import connection
@@ -25,6 +25,6 @@ def invalidate_profile_xp_cache_on_schema():
     profiles_qs = Profile.objects.all_for_active_semester()
 
     for profile in profiles_qs:
-        profile.xp_invalidate_cache()
+        profile.xp_recalculate()
 
     return f"Successfully invalidated {profiles_qs.count()} profiles."
@@ -1,7 +1,13 @@
+from datetime import datetime, timedelta
 from unittest.mock import Mock, patch
+
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+import numpy
 from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 from model_bakery.recipe import Recipe
@@ -11,8 +17,8 @@ from comments.models import Comment
 from courses.models import CourseStudent, Semester
 from notifications.models import Notification
 from portfolios.models import Portfolio
-from profile_manager.models import Profile, smart_list
-from quest_manager.models import QuestSubmission
+from profile_manager.models import Profile, XPLedgerEntry, smart_list
+from quest_manager.models import Quest, QuestSubmission
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -208,6 +214,146 @@ class ProfileTestModel(TenantTestCase):
         config.save()
 
 
+class XPLedgerTest(TenantTestCase):
+
+    def setUp(self):
+        self.student = baker.make(User)
+        self.active_sem = SiteConfig.get().active_semester
+        self.quest = baker.make(Quest, xp=10, max_xp=15, max_repeats=-1)
+
+    def approve(self, quest=None, semester=None, time_approved=None, **kwargs):
+        return baker.make(
+            QuestSubmission, user=self.student, quest=quest or self.quest, semester=semester or self.active_sem,
+            is_completed=True, is_approved=True, time_approved=time_approved or timezone.now(), **kwargs
+        )
+
+    def ledger(self):
+        return XPLedgerEntry.objects.get_user(self.student)
+
+    def assertXP(self, xp):
+        self.student.profile.refresh_from_db()
+        self.assertEqual(self.student.profile.xp_cached, xp)
+        self.assertEqual(self.ledger().get_semester(self.active_sem).total(), xp)
+
+    def test_approved_submission__recorded_when_earned(self):
+        """ Approving a submission records its XP at the time it was approved, and updates the cached XP """
+        time_approved = timezone.now() - timedelta(days=3)
+        self.approve(time_approved=time_approved)
+
+        entry = self.ledger().get()
+        self.assertEqual(entry.xp, 10)
+        self.assertEqual(entry.quest, self.quest)
+        self.assertEqual(entry.semester, self.active_sem)
+        self.assertEqual(entry.timestamp, time_approved)
+        self.assertXP(10)
+
+    def test_approved_submission__max_xp_capped(self):
+        """ Repeats of a quest only record XP up to the quest's max_xp """
+        self.approve()
+        self.approve()
+        self.approve()
+        self.assertListEqual(list(self.ledger().order_by('id').values_list('xp', flat=True)), [10, 5])
+        self.assertXP(15)
+
+    def test_returned_submission__revoked(self):
+        """ Returning an approved submission records a revocation, the original grant is kept """
+        sub = self.approve()
+        sub.mark_returned()
+        self.assertListEqual(list(self.ledger().order_by('id').values_list('xp', flat=True)), [10, -10])
+        self.assertXP(0)
+
+    def test_returned_submission__revoked_after_reload(self):
+        """ A submission loaded from the database remembers that it was approved, so returning it revokes the XP """
+        sub = QuestSubmission.objects.get(pk=self.approve().pk)
+        sub.mark_returned()
+        self.assertXP(0)
+
+    def test_submission_not_approved__not_reconciled(self):
+        """ Saving or deleting a submission that isn't approved, before or after, doesn't reconcile the ledger """
+        with patch.object(XPLedgerEntry.objects, 'reconcile_quest_xp') as reconcile:
+            sub = baker.make(QuestSubmission, user=self.student, quest=self.quest, semester=self.active_sem)
+            sub.mark_completed()
+            QuestSubmission.objects.get(pk=sub.pk).delete()
+        reconcile.assert_not_called()
+
+    def test_reconcile__locked_per_user(self):
+        """ Reconciling takes the user's lock, so concurrent reconciles don't append the same difference twice """
+        with CaptureQueriesContext(connection) as context:
+            XPLedgerEntry.objects.reconcile_quest_xp(user=self.student)
+        locks = [q['sql'] for q in context.captured_queries if 'pg_advisory_xact_lock' in q['sql']]
+        self.assertEqual(len(locks), 2)
+        self.assertIn(f', {self.student.id})', locks[1])
+
+    def test_quest_changes__recorded(self):
+        """ Changing a quest's XP, archiving or deleting it records the difference for students who completed it """
+        self.approve()
+        self.quest.xp = 12
+        self.quest.save()
+        self.assertXP(12)
+
+        self.quest.archived = True
+        self.quest.save()
+        self.assertXP(0)
+
+        self.quest.archived = False
+        self.quest.save()
+        self.assertXP(12)
+
+        self.quest.delete()
+        self.assertXP(0)
+
+    def test_badge_assertion__granted_and_revoked(self):
+        badge = baker.make('badges.Badge', xp=7)
+        assertion = BadgeAssertion.objects.create_assertion(self.student, badge)
+        self.assertXP(7)
+
+        assertion.delete()
+        self.assertXP(0)
+
+    def test_other_semester__not_in_cached_xp(self):
+        """ XP is recorded against the submission's semester, and only the active semester counts """
+        self.approve(semester=baker.make(Semester))
+        self.assertEqual(self.ledger().total(), 10)
+        self.assertXP(0)
+
+    def test_xp_invalidate_cache__from_ledger(self):
+        """ Recalculating the cached XP sums the ledger instead of re-aggregating submissions and assertions """
+        self.approve()
+        Profile.objects.filter(user=self.student).update(xp_cached=0)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.student.profile.xp_invalidate_cache(), 10)
+        self.assertFalse([q for q in context.captured_queries if 'quest_manager_questsubmission' in q['sql']])
+
+    def test_xp_recalculate__repairs_ledger(self):
+        """ xp_recalculate brings the ledger back in line with the student's submissions """
+        self.approve()
+        self.ledger().delete()
+
+        self.assertEqual(self.student.profile.xp_recalculate(), 10)
+        self.assertXP(10)
+
+    def test_xp_to_date(self):
+        """ The XP as of the end of each date's day """
+        now = timezone.now()
+        self.approve(time_approved=now - timedelta(days=2))
+        self.approve(quest=baker.make(Quest, xp=3), time_approved=now - timedelta(days=1))
+
+        self.assertEqual(self.student.profile.xp_to_date(now - timedelta(days=3)), 0)
+        self.assertEqual(self.student.profile.xp_to_date(now - timedelta(days=2)), 10)
+        self.assertEqual(self.student.profile.xp_to_date(now), 13)
+
+    def test_xp_by_class_day(self):
+        """ XP is bucketed by class day, with weekend XP counting towards the next class day """
+        tz = timezone.get_current_timezone()
+        self.approve(time_approved=timezone.make_aware(datetime(2024, 1, 1, 10), tz))  # Mon
+        self.approve(quest=baker.make(Quest, xp=3), time_approved=timezone.make_aware(datetime(2024, 1, 6, 10), tz))  # Sat
+        self.approve(quest=baker.make(Quest, xp=4), time_approved=timezone.make_aware(datetime(2024, 1, 9, 10), tz))  # Tue
+
+        class_days = numpy.array(['2024-01-01', '2024-01-05', '2024-01-08'], dtype='datetime64[D]')
+        self.assertEqual(self.student.profile.xp_by_class_day(class_days), ([10, 10, 13], 17))
+
+
 class SmartListTests(SimpleTestCase):
 
     def test_smart_list_empty(self):
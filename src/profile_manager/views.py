@@ -473,7 +473,7 @@ def oauth_merge_account(request):
 def recalculate_current_xp(request):
     profiles_qs = Profile.objects.all_for_active_semester()
     for profile in profiles_qs:
-        profile.xp_invalidate_cache()
+        profile.xp_recalculate()
     return redirect_to_previous_page(request)
 
 
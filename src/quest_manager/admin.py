@@ -21,6 +21,8 @@ from .models import Quest, Category, QuestSubmission, CommonData
 
 def publish_selected_quests(modeladmin, request, queryset):
     num_updates = queryset.update(published=True, editor=None)
+    # update() doesn't send post_save, so the signals can't invalidate the cached counts
+    QuestSubmission.objects.invalidate_pending_approval_counts()
 
     msg_str = "{} quest(s) updated. Editors have been removed and the quest is now published.".format(
         str(num_updates))  # noqa
@@ -29,6 +31,7 @@ def publish_selected_quests(modeladmin, request, queryset):
 
 def archive_selected_quests(modeladmin, request, queryset):
     num_updates = queryset.update(archived=True, published=False, editor=None)
+    QuestSubmission.objects.invalidate_pending_approval_counts()
 
     msg_str = str(num_updates) + " quest(s) archived. These quests will now only be visible through this admin menu."
     messages.success(request, msg_str)
@@ -1,10 +1,12 @@
 import uuid
-import json
 import datetime
+from collections import defaultdict
 
-from django.db import transaction
+from django.apps import apps
+from django.db import connection, transaction
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.db import models
 from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Max, Q, Sum
@@ -128,6 +130,27 @@ class Category(IsAPrereqMixin, models.Model):
 
         return quests.count() == submissions.count()
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        campaign_ids = set(cls.objects.filter(id__in={object_id for object_id, _ in requirements}).values_list('id', flat=True))
+
+        quest_ids_by_campaign = defaultdict(set)
+        for quest_id, campaign_id in Quest.objects.get_active().filter(campaign_id__in=campaign_ids).values_list('id', 'campaign_id'):
+            quest_ids_by_campaign[campaign_id].add(quest_id)
+
+        all_quest_ids = set().union(*quest_ids_by_campaign.values())
+        approved_quest_ids = set(
+            QuestSubmission.objects.all_approved(user=user, active_semester_only=False)
+            .filter(quest_id__in=all_quest_ids).values_list('quest_id', flat=True)
+        )
+
+        return {
+            (object_id, num_required): quest_ids_by_campaign[object_id] <= approved_quest_ids
+            for object_id, num_required in requirements if object_id in campaign_ids
+        }
+
     def publish_with_quests(self):
         """
         Publish this campaign and all its associated non-archived quests atomically.
@@ -365,8 +388,7 @@ class QuestQuerySet(models.QuerySet):
         :param user:
         :return: A queryset of the prerequisite's that have been met so far
         """
-        pk_met_list = self.get_pk_met_list(user) or [0]
-        return self.filter(pk__in=pk_met_list)
+        return self.filter(pk__in=self.get_prereq_cache(user).all_ids())
 
     def not_in_progress_completed_or_cooldown(self, user):
         """filter the queryset to remove quests that are:
@@ -376,77 +398,54 @@ class QuestQuerySet(models.QuerySet):
           4. completed and repeatable and max repeats reached this semester
           5. completed and repeatable and max all time repeats reached (for repeatable_per_semester=False)
 
-          These need to be grouped together, so that we can start with a queryset that removes all inprogress submissions first
-          and don't have to worry about them when considering repeats, which are more complicated.
+          These are evaluated together in a single pass over the user's submissions, grouped by quest, so that
+          inprogress quests are removed alongside the repeat conditions, which are more complicated.
         """
 
-        # Condition 1: remove inprogress submissions
-        # remember qs is a queryset of Quest objects, not QuestSubmission objects.
-        qs = self.not_in_progress(user)
-
-        # This is completed submissions and quests ALL TIME, not just current semester
-        completed_subs_all_time = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
-        completed_quests_all_time = qs.filter(pk__in=completed_subs_all_time.values_list('quest__id', flat=True))
-
-        # This is completed submissions THIS SEMESTER ONLY
-        completed_subs_current = QuestSubmission.objects.all_completed(user=user)
-        completed_quests_current = qs.filter(pk__in=completed_subs_current.values_list('quest__id', flat=True))
-
-        # Condition 2: remove completed submissions that are not repeatable
-        subs_to_exclude_2 = completed_subs_all_time.filter(Q(quest__max_repeats=0) & Q(quest__repeat_per_semester=False))
-        quests_to_exclude = subs_to_exclude_2.values_list('quest__id', flat=True)
-
-        qs = qs.exclude(pk__in=quests_to_exclude)
-
-        # Condition 3: remove completed submissions that are repeatable, but still in cooldown
+        # Aggregate the user's submissions once per quest, so each condition below is a simple comparison on the
+        # grouped row rather than its own subquery. Submissions of archived quests are ignored for all conditions.
+        user_subs = QuestSubmission.objects.get_queryset(
+            exclude_archived_quests=False,
+            exclude_quests_not_published=False,
+            include_related=False,
+        ).get_user(user).filter(quest__archived=False)
+
+        completed = Q(is_completed=True)
+        quest_stats = user_subs.order_by().values(
+            'quest_id', 'quest__published', 'quest__max_repeats', 'quest__repeat_per_semester', 'quest__hours_between_repeats',
+        ).annotate(
+            num_in_progress=Count('id', filter=Q(is_completed=False)),
+            num_completed_all_time=Count('id', filter=completed),
+            num_completed_current=Count('id', filter=completed & Q(semester_id=SiteConfig.get().active_semester.pk)),
+            # all of the user's submissions of the quest, any semester, to match how repeats are numbered
+            num_submissions=Count('id'),
+            latest_submission_time=Max('first_time_completed'),
+        )
 
         # Calculate the cooldown expression based on hours_between_repeats
-        current_time = timezone.now()
         cooldown_time = ExpressionWrapper(
-            current_time - F('hours_between_repeats') * timezone.timedelta(hours=1),
+            timezone.now() - F('quest__hours_between_repeats') * timezone.timedelta(hours=1),
             output_field=DateTimeField()
         )
-
-        # start with completed subs this semester (already filtered our non-repeatable)
-        # annotate the latest `first_time_completed` for submissions of this quest
-        # so we can use that time to determine if cooldown is complete
-        cooldown_quests = completed_quests_current.annotate(
-            latest_submission_time=Max(
-                'questsubmission__first_time_completed',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
-        # Quests in cooldown will have latest_submission_time > now - hours_between_repeats
-        # (cooldown_time = now - hours_between_repeats)
-        cooldown_quests = cooldown_quests.filter(latest_submission_time__gt=cooldown_time)
-
-        qs = qs.exclude(pk__in=cooldown_quests)
-
-        # CONDITION 4: remove completed and repeatable and max repeats reached this semester
-        max_repeats_this_sem = completed_quests_current.annotate(
-            submission_count=Count(
-                'questsubmission',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
-        # need to account for max_repeats=-1 (unlimited repeats), don't remove those
-        max_repeats_this_sem = max_repeats_this_sem.filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
-
-        qs = qs.exclude(pk__in=max_repeats_this_sem)
-
-        # CONDITION 5: remove completed and repeatable and max all-time repeats reached (for repeatable_per_semester=False)
-        max_repeats_all_time = completed_quests_all_time.filter(repeat_per_semester=False).annotate(
-            submission_count=Count(
-                'questsubmission',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
-        # need to account for max_repeats=-1 (unlimited repeats), don't remove those
-        max_repeats_all_time = max_repeats_all_time.filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
-
-        qs = qs.exclude(pk__in=max_repeats_all_time)
-
-        return qs
+        max_repeats_reached = ~Q(quest__max_repeats=-1) & Q(num_submissions__gt=F('quest__max_repeats'))
+
+        # Condition 1: inprogress submissions (ignored for unpublished quests)
+        in_progress = Q(num_in_progress__gt=0, quest__published=True)
+        # Condition 2: completed and not repeatable
+        not_repeatable = Q(num_completed_all_time__gt=0, quest__max_repeats=0, quest__repeat_per_semester=False)
+        # Condition 3: completed this semester, but still in cooldown
+        # (latest_submission_time > now - hours_between_repeats)
+        in_cooldown = Q(num_completed_current__gt=0, latest_submission_time__gt=cooldown_time)
+        # Condition 4: completed this semester and max repeats reached, -1 is unlimited repeats
+        max_repeats_this_sem = Q(num_completed_current__gt=0) & max_repeats_reached
+        # Condition 5: completed and max all-time repeats reached (for repeatable_per_semester=False)
+        max_repeats_all_time = Q(num_completed_all_time__gt=0, quest__repeat_per_semester=False) & max_repeats_reached
+
+        quests_to_exclude = quest_stats.filter(
+            in_progress | not_repeatable | in_cooldown | max_repeats_this_sem | max_repeats_all_time
+        ).values('quest_id')
+
+        return self.exclude(pk__in=quests_to_exclude)
 
     def not_in_progress(self, user):
         """
@@ -461,14 +460,16 @@ class QuestQuerySet(models.QuerySet):
         else:
             return self.filter(editor=user.id)
 
-    def get_pk_met_list(self, user):
-        model_name = f'{Quest._meta.app_label}.{Quest._meta.model_name}'
-        pk_met_list = PrereqAllConditionsMet.objects.filter(user=user, model_name=model_name).first()
-        if not pk_met_list:
+    def get_prereq_cache(self, user):
+        """ A queryset of the user's cache of available quests (PrereqAllConditionsMet), calculating it first if it doesn't exist yet """
+        prereq_cache = PrereqAllConditionsMet.objects.filter(user=user, model_name=Quest.get_model_name())
+        if not prereq_cache.exists():
             from prerequisites.tasks import update_quest_conditions_for_user
-            pk_met_list = update_quest_conditions_for_user(user.id)
-            pk_met_list = PrereqAllConditionsMet.objects.get(id=pk_met_list)
-        return json.loads(pk_met_list.ids)
+            update_quest_conditions_for_user(user.id)
+        return prereq_cache
+
+    def get_pk_met_list(self, user):
+        return self.get_prereq_cache(user).first().get_ids()
 
 
 class QuestManager(models.Manager):
@@ -694,6 +695,20 @@ class Quest(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, XPItem):
         # print("num_approved: " + str(num_approved) + "/" + str(num_required))
         return num_approved >= num_required
 
+    @classmethod
+    def condition_met_as_prerequisite_batch(cls, user, requirements):
+        """ See IsAPrereqMixin.condition_met_as_prerequisite_batch() """
+        requirements = set(requirements)
+        quest_ids = set(cls.objects.all_including_archived().filter(id__in={object_id for object_id, _ in requirements}).values_list('id', flat=True))
+        num_approved = dict(
+            QuestSubmission.objects.get_queryset(include_related=False).get_user(user).filter(quest_id__in=quest_ids).approved()
+            .order_by().values_list('quest_id').annotate(Count('id'))
+        )
+        return {
+            (object_id, num_required): num_approved.get(object_id, 0) >= num_required
+            for object_id, num_required in requirements if object_id in quest_ids
+        }
+
     def is_editable(self, user):
         if user.is_staff:
             return True
@@ -759,27 +774,19 @@ class QuestSubmissionQuerySet(models.query.QuerySet):
     def for_teacher_only(self, teacher):
         """
         :param teacher: a User model
-        :return: qs filtered for submissions of students in the current teacher's blocks
+        :return: qs filtered for submissions of students in the current teacher's blocks this semester,
+                 or of quests that specifically notify the teacher
         """
         if teacher is None:
             return self
-        else:
-            # Why doesn't this work?!? it only works for some teachers? with or without pk
-            # return self.filter(user__coursestudent__block__current_teacher=teacher).distinct()
-            # pk_sub_list = [
-            #     sub.pk for sub in self
-            #     if teacher.pk in sub.user.profile.teachers() or sub.quest.specific_teacher_to_notify == teacher
-            # ]
-
-            pk_sub_list = [
-                sub.pk for sub in self
-                if (
-                    teacher.pk in sub.user.profile.teachers() or
-                    (sub.quest.specific_teacher_to_notify == teacher if sub.quest else False)  # will error if quest has been deleted
-                )
-            ]
-
-            return self.filter(pk__in=pk_sub_list)
+
+        CourseStudent = apps.get_model('courses', 'CourseStudent')
+        students = CourseStudent.objects.filter(
+            semester=SiteConfig.get().active_semester,
+            block__current_teacher=teacher,
+        ).values('user_id')
+
+        return self.filter(Q(user_id__in=students) | Q(quest__specific_teacher_to_notify=teacher))
 
     def exclude_archived_quests(self):
         return self.exclude(quest__archived=True)
@@ -877,6 +884,65 @@ class QuestSubmissionManager(models.Manager):
             return qs
         return self.get_queryset(True).get_user(user).not_approved().completed()
 
+    def all_awaiting_approval_by_teacher(self, teachers):
+        """A batch version of all_awaiting_approval(teacher=teacher) for many teachers at once, in two queries.
+
+        :param teachers: an iterable of Users
+        :return: a dict of {teacher_id: [submissions awaiting the teacher's approval]}, with the same ordering as
+                 all_awaiting_approval()
+        """
+        teacher_ids = {teacher.id for teacher in teachers}
+        CourseStudent = apps.get_model('courses', 'CourseStudent')
+        student_teachers = defaultdict(set)
+        for teacher_id, user_id in CourseStudent.objects.filter(
+            semester=SiteConfig.get().active_semester,
+            block__current_teacher_id__in=teacher_ids,
+        ).values_list('block__current_teacher_id', 'user_id'):
+            student_teachers[user_id].add(teacher_id)
+
+        submissions = self.get_queryset(True).not_approved().completed(SiteConfig.get().approve_oldest_first).filter(
+            Q(user_id__in=list(student_teachers)) | Q(quest__specific_teacher_to_notify_id__in=teacher_ids)
+        ).select_related('user', 'quest')
+
+        submissions_by_teacher = {teacher_id: [] for teacher_id in teacher_ids}
+        for submission in submissions:
+            notify_ids = student_teachers[submission.user_id] | {submission.quest.specific_teacher_to_notify_id}
+            for teacher_id in notify_ids & teacher_ids:
+                submissions_by_teacher[teacher_id].append(submission)
+        return submissions_by_teacher
+
+    PENDING_APPROVAL_COUNT_TIMEOUT = 60 * 60
+
+    @staticmethod
+    def pending_approval_count_version_key():
+        return f'{connection.schema_name}-pending-approval-count-version'
+
+    def pending_approval_count_cache_key(self, teacher_id):
+        # The version is part of the key so all teachers' counts can be invalidated at once
+        version = cache.get_or_set(self.pending_approval_count_version_key(), lambda: uuid.uuid4().hex, None)
+        return f'{connection.schema_name}-pending-approval-count-{version}-{teacher_id}'
+
+    def pending_approval_count(self, teacher):
+        """The number of submissions awaiting approval for the teacher, used by the navbar's Approvals button.
+        The count is cached per teacher, and invalidated by the signals in quest_manager.signals
+        """
+        cache_key = self.pending_approval_count_cache_key(teacher.id)
+        count = cache.get(cache_key)
+        if count is None:
+            count = self.all_awaiting_approval(teacher=teacher).count()
+            cache.set(cache_key, count, self.PENDING_APPROVAL_COUNT_TIMEOUT)
+        return count
+
+    def invalidate_pending_approval_counts(self, teacher_ids=None):
+        """
+        :param teacher_ids: the ids of the teachers whose cached counts are out of date,
+                            or None to invalidate the counts of every teacher
+        """
+        if teacher_ids is None:
+            cache.set(self.pending_approval_count_version_key(), uuid.uuid4().hex, None)
+        else:
+            cache.delete_many([self.pending_approval_count_cache_key(teacher_id) for teacher_id in teacher_ids])
+
     def all_returned(self, user=None):
         # completion date indicates the quest was submitted, but since completed
         # is false, it must have been returned.
@@ -1018,6 +1084,17 @@ class QuestSubmission(models.Model):
 
     objects = QuestSubmissionManager()
 
+    # Whether the submission was approved when it was last loaded or saved.  A submission that isn't approved before
+    # or after a save can't change the student's XP, see profile_manager.models.record_submission_xp
+    saved_is_approved = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # if is_approved was deferred, assume it was approved so the XP is reconciled
+        instance.saved_is_approved = dict(zip(field_names, values)).get('is_approved', True)
+        return instance
+
     def __str__(self):
         if self.ordinal > 1:
             ordinal_str = " (" + str(self.ordinal) + ")"
@@ -1061,7 +1138,6 @@ class QuestSubmission(models.Model):
         self.save()
         # update badges
         BadgeAssertion.objects.check_for_new_assertions(self.user, transfer=transfer)
-        self.user.profile.xp_invalidate_cache()  # recalculate XP
 
     def mark_returned(self):
         self.is_completed = False
@@ -1069,7 +1145,6 @@ class QuestSubmission(models.Model):
         self.do_not_grant_xp = False
         self.time_returned = timezone.now()
         self.save()
-        self.user.profile.xp_invalidate_cache()  # recalculate XP
 
     def is_awaiting_approval(self):
         return self.is_completed and not self.is_approved
@@ -1078,6 +1153,9 @@ class QuestSubmission(models.Model):
         return self.time_completed is not None and not self.is_completed
 
     def get_comments(self):
+        # lists set the comments of a whole page at once, see CommentManager.prefetch_threads()
+        if hasattr(self, 'prefetched_comments'):
+            return self.prefetched_comments
         return Comment.objects.all_with_target_object(self)
 
     def _fix_ordinal(self):
@@ -1,11 +1,13 @@
 from bs4 import BeautifulSoup
 from bs4.formatter import HTMLFormatter
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import pre_save, pre_delete
+from django.db.models.signals import post_delete, post_save, pre_save, pre_delete
 from django.dispatch import receiver
 
 from quest_manager.models import Quest, QuestSubmission
 from comments.models import Comment
+from courses.models import Block, CourseStudent
+from siteconfig.models import SiteConfig
 
 
 @receiver(pre_save, sender=Quest)
@@ -25,6 +27,31 @@ def submission_pre_delete_callback(sender, instance, **kwargs):
     ).delete()
 
 
+@receiver(post_save, sender=QuestSubmission)
+@receiver(post_delete, sender=QuestSubmission)
+def submission_invalidate_pending_approval_counts(sender, instance, **kwargs):
+    """ A submission only affects the pending approval counts of the student's current teachers,
+    and of the quest's specific teacher to notify"""
+    teacher_ids = set(CourseStudent.objects.current_courses(instance.user_id).values_list('block__current_teacher', flat=True))
+    if instance.quest_id:
+        teacher_ids.add(Quest.objects.all_including_archived().filter(id=instance.quest_id)
+                        .values_list('specific_teacher_to_notify', flat=True).first())
+    teacher_ids.discard(None)
+    QuestSubmission.objects.invalidate_pending_approval_counts(teacher_ids)
+
+
+@receiver(post_save, sender=Quest)
+@receiver(post_delete, sender=Quest)
+@receiver(post_save, sender=CourseStudent)
+@receiver(post_delete, sender=CourseStudent)
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+@receiver(post_save, sender=SiteConfig)
+def invalidate_all_pending_approval_counts(sender, instance, **kwargs):
+    """ Changes to quests, courses, blocks or the active semester can move submissions between teachers"""
+    QuestSubmission.objects.invalidate_pending_approval_counts()
+
+
 def tidy_html(markup, fix_runaway_newlines=False):
     """Prettify's HTML by adding an indentation of 4, except for specified inline tags.
     """
@@ -1,12 +1,22 @@
+import random
+import time
 from datetime import datetime, timedelta, timezone
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Max, Q
+from django.test import tag
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
 from django.utils.timezone import localtime
 # from django.test import tag
 from freezegun import freeze_time
 from model_bakery import baker
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, tenant_queries
 from courses.models import Semester
+from quest_manager.admin import archive_selected_quests, publish_selected_quests
 from quest_manager.models import Quest, QuestSubmission, Category
 from siteconfig.models import SiteConfig
 from django_tenants.test.cases import TenantTestCase
@@ -18,6 +28,43 @@ from library.tests.test_views import LibraryTenantTestCaseMixin
 User = get_user_model()
 
 
+def legacy_not_in_progress_completed_or_cooldown(qs, user):
+    """ The previous implementation of QuestQuerySet.not_in_progress_completed_or_cooldown, with a separate nested
+    subquery for each condition.  Kept here as a reference for the results and performance of the current one.
+    """
+    qs = qs.not_in_progress(user)
+
+    completed_subs_all_time = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
+    completed_quests_all_time = qs.filter(pk__in=completed_subs_all_time.values_list('quest__id', flat=True))
+
+    completed_subs_current = QuestSubmission.objects.all_completed(user=user)
+    completed_quests_current = qs.filter(pk__in=completed_subs_current.values_list('quest__id', flat=True))
+
+    subs_to_exclude_2 = completed_subs_all_time.filter(Q(quest__max_repeats=0) & Q(quest__repeat_per_semester=False))
+    qs = qs.exclude(pk__in=subs_to_exclude_2.values_list('quest__id', flat=True))
+
+    cooldown_time = ExpressionWrapper(
+        django_timezone.now() - F('hours_between_repeats') * django_timezone.timedelta(hours=1),
+        output_field=DateTimeField()
+    )
+    cooldown_quests = completed_quests_current.annotate(
+        latest_submission_time=Max('questsubmission__first_time_completed', filter=Q(questsubmission__user_id=user.id))
+    ).filter(latest_submission_time__gt=cooldown_time)
+    qs = qs.exclude(pk__in=cooldown_quests)
+
+    max_repeats_this_sem = completed_quests_current.annotate(
+        submission_count=Count('questsubmission', filter=Q(questsubmission__user_id=user.id))
+    ).filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
+    qs = qs.exclude(pk__in=max_repeats_this_sem)
+
+    max_repeats_all_time = completed_quests_all_time.filter(repeat_per_semester=False).annotate(
+        submission_count=Count('questsubmission', filter=Q(questsubmission__user_id=user.id))
+    ).filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
+    qs = qs.exclude(pk__in=max_repeats_all_time)
+
+    return qs
+
+
 class CategoryManagerTests(LibraryTenantTestCaseMixin):
 
     def setUp(self):
@@ -117,7 +164,7 @@ class CategoryManagerTests(LibraryTenantTestCaseMixin):
             self.assertEqual(qs.first().xp_sum, 80)
 
 
-class QuestQuerysetTest(TenantTestCase):
+class QuestQuerysetTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.student = baker.make(User, username='student', is_staff=False)
@@ -271,6 +318,92 @@ class QuestQuerysetTest(TenantTestCase):
                     self.assertNotIn(quest_repeatable_twice_all_time, qs)
                     self.assertIn(quest_infinite_repeatables, qs)
 
+    def seed_submissions(self, users, num_quests=60, subs_per_user=120):
+        """ Create quests with a mix of repeat settings, and submissions for each user spread across them, two
+        semesters, completion states and completion times."""
+        rng = random.Random(0)
+        active_sem = SiteConfig.get().active_semester
+        past_sem = baker.make(Semester)
+        quests = [
+            baker.make(
+                Quest,
+                max_repeats=rng.choice([0, 0, 1, 2, 5, -1]),
+                hours_between_repeats=rng.choice([0, 1, 24, 48]),
+                repeat_per_semester=rng.random() < 0.3,
+                published=rng.random() < 0.9,
+                archived=rng.random() < 0.1,
+            )
+            for _ in range(num_quests)
+        ]
+        now = django_timezone.now()
+        submissions = []
+        for user in users:
+            for _ in range(subs_per_user):
+                is_completed = rng.random() < 0.8
+                completed_at = now - timedelta(hours=rng.randint(0, 96)) if is_completed else None
+                submissions.append(QuestSubmission(
+                    user=user,
+                    quest=rng.choice(quests),
+                    semester=active_sem if rng.random() < 0.6 else past_sem,
+                    is_completed=is_completed,
+                    time_completed=completed_at,
+                    first_time_completed=completed_at,
+                ))
+        QuestSubmission.objects.bulk_create(submissions)
+
+    def evaluate_queryset(self, get_qs):
+        """ Evaluate the queryset, returning its pks and the number of queries run (ignoring the tenant's
+        search_path queries)."""
+        with CaptureQueriesContext(connection) as context:
+            pks = set(get_qs().values_list('pk', flat=True))
+        return pks, len(tenant_queries(context))
+
+    def test_not_in_progress_completed_or_cooldown__same_as_nested_subqueries(self):
+        """ Compare the single pass implementation against the previous one (a nested subquery per condition)
+        on a seeded dataset: results must be identical, with no more queries."""
+        students = [self.student] + baker.make(User, _quantity=9)
+        self.seed_submissions(students)
+
+        for student in students:
+            legacy_pks, legacy_queries = self.evaluate_queryset(
+                lambda: legacy_not_in_progress_completed_or_cooldown(Quest.objects.all(), student))
+            pks, num_queries = self.evaluate_queryset(
+                lambda: Quest.objects.all().not_in_progress_completed_or_cooldown(student))
+
+            self.assertSetEqual(pks, legacy_pks)
+            self.assertLessEqual(num_queries, legacy_queries)
+
+    def time_queryset(self, get_qs, runs=5):
+        """ The best wall time in seconds to evaluate the queryset, out of several runs """
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            list(get_qs().values_list('pk', flat=True))
+            durations.append(time.perf_counter() - start)
+        return min(durations)
+
+    @tag('benchmark')
+    def test_not_in_progress_completed_or_cooldown__benchmark(self):
+        """ Report the wall time of the single pass implementation against the previous one on the seeded dataset.
+        Timing depends on the machine, so nothing is asserted, and the CI test run excludes the benchmark tag:
+
+        python src/manage.py test quest_manager --tag benchmark
+        """
+        students = [self.student] + baker.make(User, _quantity=9)
+        self.seed_submissions(students)
+
+        legacy_time = current_time = 0
+        for student in students:
+            legacy_time += self.time_queryset(
+                lambda: legacy_not_in_progress_completed_or_cooldown(Quest.objects.all(), student))
+            current_time += self.time_queryset(
+                lambda: Quest.objects.all().not_in_progress_completed_or_cooldown(student))
+
+        print(
+            f"\nnot_in_progress_completed_or_cooldown for {len(students)} students: "
+            f"single pass {current_time * 1000:.1f}ms, nested subqueries {legacy_time * 1000:.1f}ms"
+        )
+
 
 @freeze_time('2018-10-12 00:54:00', tz_offset=0)
 class QuestManagerTest(TenantTestCase):
@@ -639,7 +772,7 @@ class QuestManagerTest(TenantTestCase):
 
 
 @freeze_time('2018-10-12 00:54:00', tz_offset=0)
-class QuestSubmissionQuerysetTest(TenantTestCase):
+class QuestSubmissionQuerysetTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         self.teacher = baker.make(User, username='teacher', is_staff=True)
@@ -751,6 +884,23 @@ class QuestSubmissionQuerysetTest(TenantTestCase):
 
         self.assertTrue(qs.count() == 0)
 
+    def test_for_teacher_only__single_query(self):
+        """for_teacher_only should filter in SQL, so the number of queries doesn't grow with the submissions"""
+        active_semester = SiteConfig.get().active_semester
+        block = baker.make('courses.Block', current_teacher=self.teacher)
+        students = baker.make(User, _quantity=5)
+        for student in students:
+            baker.make('courses.CourseStudent', user=student, block=block, semester=active_semester)
+        subs = [baker.make(QuestSubmission, user=student, semester=active_semester) for student in students]
+        # students in another teacher's block
+        baker.make(QuestSubmission, semester=active_semester, _quantity=5)
+
+        qs = QuestSubmission.objects.all()
+        with CaptureQueriesContext(connection) as context:
+            sub_ids = list(qs.for_teacher_only(self.teacher).values_list('id', flat=True))
+        self.assertCountEqual(sub_ids, [sub.id for sub in subs])
+        self.assertEqual(len(tenant_queries(context)), 1)
+
 
 @freeze_time('2018-10-12 00:54:00', tz_offset=0)
 class QuestSubmissionManagerTest(TenantTestCase):
@@ -920,3 +1070,69 @@ class QuestSubmissionManagerTest(TenantTestCase):
         # now delete the custom_xp quest (submission is still there though!) Shouldn't break!
         quest_5xp_custom.delete()
         self.assertEqual(QuestSubmission.objects.calculate_xp(self.student), 10)
+
+    def test_all_awaiting_approval_by_teacher(self):
+        """Each teacher gets the same submissions as all_awaiting_approval(teacher=teacher)"""
+        active_semester = SiteConfig.get().active_semester
+        other_teacher = baker.make(User, is_staff=True)
+        other_student = baker.make(User)
+        block = baker.make('courses.Block', current_teacher=self.teacher)
+        baker.make('courses.CourseStudent', user=self.student, block=block, semester=active_semester)
+        baker.make('courses.CourseStudent', user=other_student, block=baker.make('courses.Block'), semester=active_semester)
+        quest = baker.make(Quest, specific_teacher_to_notify=other_teacher)
+        for sub in [
+            baker.make(QuestSubmission, user=self.student, semester=active_semester),
+            baker.make(QuestSubmission, user=self.student, quest=quest, semester=active_semester),
+            baker.make(QuestSubmission, user=other_student, quest=quest, semester=active_semester),
+            baker.make(QuestSubmission, user=other_student, semester=active_semester),
+        ]:
+            sub.mark_completed()
+
+        submissions_by_teacher = QuestSubmission.objects.all_awaiting_approval_by_teacher([self.teacher, other_teacher])
+
+        for teacher in [self.teacher, other_teacher]:
+            self.assertEqual(submissions_by_teacher[teacher.id], list(QuestSubmission.objects.all_awaiting_approval(teacher=teacher)))
+        self.assertEqual(len(submissions_by_teacher[self.teacher.id]), 2)
+        self.assertEqual(len(submissions_by_teacher[other_teacher.id]), 2)
+
+    def test_pending_approval_count(self):
+        """The count matches all_awaiting_approval, and is served from the cache until invalidated"""
+        active_semester = SiteConfig.get().active_semester
+        block = baker.make('courses.Block', current_teacher=self.teacher)
+        baker.make('courses.CourseStudent', user=self.student, block=block, semester=active_semester)
+        sub1, sub2 = baker.make(QuestSubmission, user=self.student, semester=active_semester, _quantity=2)
+        sub1.mark_completed()
+
+        self.assertEqual(QuestSubmission.objects.pending_approval_count(self.teacher), 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(QuestSubmission.objects.pending_approval_count(self.teacher), 1)
+        self.assertFalse([q for q in context.captured_queries if 'quest_manager_questsubmission' in q['sql']])
+
+        # completing another of the student's submissions invalidates the teacher's count
+        sub2.mark_completed()
+        self.assertEqual(QuestSubmission.objects.pending_approval_count(self.teacher), 2)
+
+    def test_invalidate_pending_approval_counts(self):
+        """Only the given teachers' counts are invalidated, or all of them if no teachers are given"""
+        other_teacher = baker.make(User, is_staff=True)
+        for teacher in [self.teacher, other_teacher]:
+            QuestSubmission.objects.pending_approval_count(teacher)
+
+        def is_cached(teacher):
+            return cache.get(QuestSubmission.objects.pending_approval_count_cache_key(teacher.id)) is not None
+
+        QuestSubmission.objects.invalidate_pending_approval_counts([self.teacher.id])
+        self.assertFalse(is_cached(self.teacher))
+        self.assertTrue(is_cached(other_teacher))
+
+        QuestSubmission.objects.invalidate_pending_approval_counts()
+        self.assertFalse(is_cached(other_teacher))
+
+    def test_admin_quest_actions__invalidate_pending_approval_counts(self):
+        """Publishing or archiving quests from the admin invalidates every teacher's count, since update() sends no signals"""
+        for action in [publish_selected_quests, archive_selected_quests]:
+            with self.subTest(action=action.__name__), \
+                    patch('quest_manager.admin.messages'), \
+                    patch.object(QuestSubmission.objects, 'invalidate_pending_approval_counts') as invalidate:
+                action(None, None, Quest.objects.all())
+            invalidate.assert_called_once_with()
@@ -1,3 +1,5 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django_tenants.test.cases import TenantTestCase
 
 from model_bakery import baker
@@ -5,8 +7,11 @@ import re
 import unittest
 
 from quest_manager.signals import tidy_html
-from quest_manager.models import QuestSubmission
+from quest_manager.models import Quest, QuestSubmission
 from comments.models import Comment
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
 
 
 class TestSubmissionSignals(TenantTestCase):
@@ -26,6 +31,50 @@ class TestSubmissionSignals(TenantTestCase):
         self.assertEqual(Comment.objects.all().count(), 2)
 
 
+class TestPendingApprovalCountSignals(TenantTestCase):
+
+    def setUp(self):
+        self.teacher = baker.make(User, is_staff=True)
+        self.other_teacher = baker.make(User, is_staff=True)
+        self.student = baker.make(User)
+        block = baker.make('courses.Block', current_teacher=self.teacher)
+        baker.make('courses.CourseStudent', user=self.student, block=block, semester=SiteConfig.get().active_semester)
+        self.quest = baker.make(Quest)
+
+    def cache_counts(self):
+        for teacher in [self.teacher, self.other_teacher]:
+            QuestSubmission.objects.pending_approval_count(teacher)
+
+    def is_cached(self, teacher):
+        return cache.get(QuestSubmission.objects.pending_approval_count_cache_key(teacher.id)) is not None
+
+    def test_submission_saved__invalidates_students_teachers(self):
+        """ Saving a submission only invalidates the counts of the student's teachers """
+        self.cache_counts()
+        baker.make(QuestSubmission, user=self.student, quest=self.quest)
+        self.assertFalse(self.is_cached(self.teacher))
+        self.assertTrue(self.is_cached(self.other_teacher))
+
+    def test_submission_saved__invalidates_specific_teacher_to_notify(self):
+        """ The quest's specific teacher to notify also has their count invalidated """
+        quest = baker.make(Quest, specific_teacher_to_notify=self.other_teacher)
+        self.cache_counts()
+        sub = baker.make(QuestSubmission, user=self.student, quest=quest)
+        self.assertFalse(self.is_cached(self.other_teacher))
+
+        self.cache_counts()
+        sub.delete()
+        self.assertFalse(self.is_cached(self.teacher))
+        self.assertFalse(self.is_cached(self.other_teacher))
+
+    def test_course_change__invalidates_all(self):
+        """ Changing a student's courses can move submissions between teachers, so all counts are invalidated """
+        self.cache_counts()
+        baker.make('courses.CourseStudent', user=self.student, semester=SiteConfig.get().active_semester)
+        self.assertFalse(self.is_cached(self.teacher))
+        self.assertFalse(self.is_cached(self.other_teacher))
+
+
 class TestTidyHtml(unittest.TestCase):
     def test_tidy_html__with_no_inline_tags(self):
         """ Html is indented 4 spaces"""
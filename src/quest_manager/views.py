@@ -1975,9 +1975,7 @@ def ajax_submission_count(request):
     """Returns the number of submissions awaiting approval for the current user
     This is used to update the number beside the "Approvals" button in the navbar"""
     if request.method == "POST":
-        submission_count = QuestSubmission.objects.all_awaiting_approval(
-            teacher=request.user
-        ).count()
+        submission_count = QuestSubmission.objects.pending_approval_count(teacher=request.user)
 
         return JsonResponse(data={"count": submission_count})
     else:
@@ -1,10 +1,16 @@
+import pickle
+import threading
+from collections import OrderedDict
 from copy import copy
+from uuid import uuid4
+
 from allauth.socialaccount.models import SocialApp
 from allauth.socialaccount.providers.google.provider import GoogleProvider
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
+from django.core.signals import request_finished, request_started
 from django.db import connection, models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -20,6 +26,14 @@ from utilities.models import RestrictedFileField
 
 User = get_user_model()
 
+# SiteConfig.get() is called dozens of times per request, so on top of the shared cache, each process keeps the pickled
+# SiteConfig of its most recently used tenants, and each request keeps the SiteConfig it unpickled.
+# {schema_name: (version, pickled SiteConfig)}, least recently used first
+_process_cache = OrderedDict()
+_process_cache_lock = threading.Lock()
+# `configs` is {schema_name: SiteConfig} during a request, None outside of requests (e.g. celery tasks)
+_request_cache = threading.local()
+
 
 def get_default_deck_owner():
     """
@@ -385,27 +399,92 @@ class SiteConfig(models.Model):
 
         return self.allow_staff_export and user.is_staff
 
+    CACHE_TIMEOUT = 3600
+    PROCESS_CACHE_SIZE = 256
+
     @classmethod
     def cache_key(cls):
         return f'{connection.schema_name}-siteconfig'
 
+    @classmethod
+    def version_cache_key(cls):
+        """ The version stamp of the cached SiteConfig, it changes whenever the cache is invalidated """
+        return f'{connection.schema_name}-siteconfig-version'
+
     @classmethod
     def get(cls):
         """
         Used to access the single model instance for the current tenant/schema
         The SiteConfig object is create automatically via signal after new tenants are created.
+
+        The first call in a request checks the version stamp in the shared cache, and unpickles this process' copy if it
+        is still current. Later calls in the same request return the same object without going to the shared cache.
         """
 
-        if connection.schema_name != get_public_schema_name():
-            siteconfig = cache.get(cls.cache_key())
+        if connection.schema_name == get_public_schema_name():
+            return None
 
-            if not siteconfig:
-                siteconfig = cls.objects.select_related('deck_ai', 'active_semester').get()
-                cache.set(cls.cache_key(), siteconfig, 3600)
+        configs = getattr(_request_cache, 'configs', None)
+        if configs is not None and connection.schema_name in configs:
+            return configs[connection.schema_name]
 
-            return siteconfig
+        siteconfig = cls._get_from_process_cache()
+        if configs is not None:
+            configs[connection.schema_name] = siteconfig
+        return siteconfig
 
-        return None
+    @classmethod
+    def _get_from_process_cache(cls):
+        schema_name = connection.schema_name
+        version = cache.get(cls.version_cache_key())
+
+        with _process_cache_lock:
+            cached = _process_cache.get(schema_name)
+            if cached:
+                _process_cache.move_to_end(schema_name)
+        if version is not None and cached and cached[0] == version:
+            return pickle.loads(cached[1])
+
+        siteconfig = cache.get(cls.cache_key())
+        if not siteconfig:
+            siteconfig = cls.objects.select_related('deck_ai', 'active_semester').get()
+            cache.set(cls.cache_key(), siteconfig, cls.CACHE_TIMEOUT)
+
+        if version is None:
+            version = uuid4().hex
+            if not cache.add(cls.version_cache_key(), version, cls.CACHE_TIMEOUT):
+                # another process stamped it first, we don't know which version this is, check again next time
+                return siteconfig
+
+        with _process_cache_lock:
+            _process_cache[schema_name] = (version, pickle.dumps(siteconfig, pickle.HIGHEST_PROTOCOL))
+            _process_cache.move_to_end(schema_name)
+            while len(_process_cache) > cls.PROCESS_CACHE_SIZE:
+                _process_cache.popitem(last=False)
+
+        return siteconfig
+
+    @classmethod
+    def invalidate_cache(cls):
+        """ Invalidates the cached SiteConfig of the current tenant, in the shared cache and in every process """
+        cache.delete_many([cls.cache_key(), cls.version_cache_key()])
+
+        # other processes will see that the version stamp is gone, this one can forget its copies right away
+        with _process_cache_lock:
+            _process_cache.pop(connection.schema_name, None)
+        configs = getattr(_request_cache, 'configs', None)
+        if configs is not None:
+            configs.pop(connection.schema_name, None)
+
+
+@receiver(request_started, dispatch_uid='siteconfig.models.start_request_cache')
+def start_request_cache(sender, **kwargs):
+    _request_cache.configs = {}
+
+
+@receiver(request_finished, dispatch_uid='siteconfig.models.end_request_cache')
+def end_request_cache(sender, **kwargs):
+    _request_cache.configs = None
 
 
 @receiver(post_save, sender=User)
@@ -418,18 +497,18 @@ def invalidate_siteconfig_cache_signal(sender, instance, **kwargs):
 
     try:
         config = cache.get(SiteConfig.cache_key())
+        if not config:
+            # there is nothing to compare with, but the copies kept by the processes could still be current
+            SiteConfig.invalidate_cache()
+            return
     except redis_exceptions.ConnectionError:
         # create_superuser is being called via manage.py initdb
         # This just prevents it from throwing an error when redis is not running
         # Because we are receiving a post_save from User, we don't want errors to happen
-        config = None
-
-    if not config:
         return
 
     for obj in (config, config.active_semester, config.deck_ai):
         # Only invalidate the cache when the instance we updated is the current one set in SiteConfig
         if instance == obj:
-            cache.delete(SiteConfig.cache_key())
+            SiteConfig.invalidate_cache()
             break
-    # cache.delete(SiteConfig.cache_key())
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from unittest.mock import patch
 
 from django.core.cache import cache
 from django.templatetags.static import static
@@ -12,7 +13,7 @@ from django_tenants.test.cases import TenantTestCase
 from freezegun import freeze_time
 from model_bakery import baker
 
-from siteconfig.models import SiteConfig, get_default_deck_owner
+from siteconfig.models import SiteConfig, end_request_cache, get_default_deck_owner, start_request_cache
 
 from library.utils import get_library_schema_name
 
@@ -111,6 +112,44 @@ class SiteConfigModelTest(TenantTestCase):
         with freeze_time(cache_time_expiration, tz_offset=0):
             self.assertIsNone(cache.get(SiteConfig.cache_key()))
 
+    def test_SiteConfig_get__request_cache(self):
+        """ During a request, SiteConfig.get() goes to the shared cache once, then returns the same object """
+        start_request_cache(sender=self.__class__)
+        try:
+            with patch('siteconfig.models.cache.get', wraps=cache.get) as cache_get:
+                config = SiteConfig.get()
+                for _ in range(10):
+                    self.assertIs(SiteConfig.get(), config)
+            self.assertEqual(cache_get.call_count, 1)
+        finally:
+            end_request_cache(sender=self.__class__)
+
+        # outside of a request, each call unpickles its own copy
+        self.assertIsNot(SiteConfig.get(), SiteConfig.get())
+
+    def test_SiteConfig_get__process_cache_invalidated(self):
+        """ The copy kept by the process isn't used once another process invalidated the cache """
+        self.assertEqual(SiteConfig.get().site_name, self.config.site_name)
+
+        # another process changed the SiteConfig, without the post_save signal reaching this process
+        SiteConfig.objects.update(site_name="Changed Elsewhere")
+        self.assertNotEqual(SiteConfig.get().site_name, "Changed Elsewhere")
+        cache.delete_many([SiteConfig.cache_key(), SiteConfig.version_cache_key()])
+
+        self.assertEqual(SiteConfig.get().site_name, "Changed Elsewhere")
+
+    def test_SiteConfig_save__invalidates_request_cache(self):
+        """ Saving the SiteConfig during a request, the rest of the request gets the new SiteConfig """
+        start_request_cache(sender=self.__class__)
+        try:
+            config = SiteConfig.get()
+            config.site_name = "New Name"
+            config.save()
+            self.assertIsNot(SiteConfig.get(), config)
+            self.assertEqual(SiteConfig.get().site_name, "New Name")
+        finally:
+            end_request_cache(sender=self.__class__)
+
     def test_deck_owner__correct_default_value(self):
         """
             Test to make sure new decks have the expected deck_owner after initialization, as set in settings.py via .env
@@ -188,6 +188,21 @@ class SiteConfigViewTest(ViewTestUtilsMixin, TenantTestCase):
         self.client.post(URL, data=form_data)
         self.assertEqual(SiteConfig.get().site_name, "site_name")  # should be equal and prove the case
 
+    def test_invalid_post_does_not_change_config(self):
+        """
+        The values of a rejected form aren't applied to the SiteConfig that the rest of the request sees
+        """
+        self.client.force_login(self.config.deck_owner)
+        site_name = SiteConfig.get().site_name
+
+        # incomplete payload, so the form is invalid
+        response = self.client.post(reverse("config:site_config_update_own"), data={"site_name": "Rejected Name"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual(response.context['config'].site_name, site_name)
+        self.assertEqual(SiteConfig.get().site_name, site_name)
+
     def test_custom_javascript_mimetypes(self):
         """
         Tests all permitted mimetypes for `custom_javascript` file uploads.
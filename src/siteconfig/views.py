@@ -1,3 +1,5 @@
+from copy import copy
+
 from django.contrib.messages.views import SuccessMessageMixin
 from django.utils.decorators import method_decorator
 from django.views.generic.edit import UpdateView
@@ -28,4 +30,6 @@ class SiteConfigUpdate(SuccessMessageMixin, UpdateView):
 class SiteConfigUpdateOwn(SiteConfigUpdate):
 
     def get_object(self):
-        return SiteConfig.get()
+        # the form writes the posted values onto its instance even when they're rejected, so don't hand it the
+        # SiteConfig that the rest of the request shares
+        return copy(SiteConfig.get())
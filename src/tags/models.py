@@ -1,9 +1,15 @@
+import uuid
+from collections import defaultdict
+
 from django.apps import apps
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, models
 from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save
 from django.db.models.functions import Greatest
+from django.dispatch import receiver
 
-from taggit.models import Tag
+from taggit.models import Tag, TaggedItem
 from taggit.managers import TaggableManager
 
 from siteconfig.models import SiteConfig
@@ -153,6 +159,75 @@ def total_xp_by_tags(user, tags):
     return get_quest_submission_total_xp(user, tags) + get_badge_assertion_total_xp(user, tags)
 
 
+def get_tag_xp_by_user(users=None):
+    """
+    Returns how much xp each user earned in each tag over active_semester, with one grouped query for quest submissions
+    and one for badge assertions, instead of the queries per tag of total_xp_by_tags().
+    Like get_quest_submission_total_xp(), a quest's xp is capped at its max_xp before it is added to each of its tags.
+
+    Args:
+        users (QS[User], list[User], optional): the users to include.  Defaults to all users
+
+    Returns:
+        dict[int, dict[int, int]]: {user_id: {tag_id: xp}}, only for the tags each user has xp in
+    """
+    # get models through here to prevent circular imports
+    QuestSubmission = apps.get_model("quest_manager", "QuestSubmission")
+    BadgeAssertion = apps.get_model("badges", "BadgeAssertion")
+
+    submissions = QuestSubmission.objects.all_approved(active_semester_only=True).filter(is_completed=True, do_not_grant_xp=False)
+    assertions = BadgeAssertion.objects.get_queryset(active_semester_only=True).grant_xp()
+    if users is not None:
+        submissions = submissions.filter(user__in=users)
+        assertions = assertions.filter(user__in=users)
+
+    tag_xp = defaultdict(lambda: defaultdict(int))
+
+    # one row per user, quest and tag of the quest, with the xp of all the user's submissions of the quest
+    quest_xp = submissions.order_by().values('user_id', 'quest_id', 'quest__max_xp', 'quest__tags__id').annotate(
+        xp=Sum(Greatest('quest__xp', 'xp_requested')),
+    )
+    for row in quest_xp:
+        if row['quest__tags__id'] is None:
+            continue
+        xp = row['xp']
+        if row['quest__max_xp'] != -1:  # -1 is no limit
+            # quest__max_xp is None if quest is deleted, so `or 0`
+            xp = min(xp, row['quest__max_xp'] or 0)
+        tag_xp[row['user_id']][row['quest__tags__id']] += xp
+
+    badge_xp = assertions.order_by().values('user_id', 'badge__tags__id').annotate(xp=Sum('badge__xp'))
+    for row in badge_xp:
+        if row['badge__tags__id'] is not None:
+            tag_xp[row['user_id']][row['badge__tags__id']] += row['xp']
+
+    return {user_id: dict(xp_by_tag) for user_id, xp_by_tag in tag_xp.items()}
+
+
+TAG_XP_TIMEOUT = 60 * 60
+
+
+def tag_xp_version_key():
+    return f'{connection.schema_name}-tag-xp-version'
+
+
+def tag_xp_cache_key(user_id):
+    # The version is part of the key so every user's tags can be invalidated at once
+    version = cache.get_or_set(tag_xp_version_key(), lambda: uuid.uuid4().hex, None)
+    return f'{connection.schema_name}-tag-xp-{version}-{user_id}'
+
+
+def invalidate_tag_xp(user_ids=None):
+    """
+    Args:
+        user_ids (list[int], optional): the users whose cached tags and xp are out of date, or None for every user
+    """
+    if user_ids is None:
+        cache.set(tag_xp_version_key(), uuid.uuid4().hex, None)
+    else:
+        cache.delete_many([tag_xp_cache_key(user_id) for user_id in user_ids])
+
+
 def get_user_tags_and_xp(user):
     """
     returns a list of tuples containing a tag object and how much xp it has.
@@ -161,22 +236,42 @@ def get_user_tags_and_xp(user):
     tag has to be related to user.
     xp is dependant on how many Quest user has submitted that is related to tag.
 
+    The list is cached per user, and invalidated by the receivers below when the user's approvals change.
+
     Args:
         user (UserModel): user object
 
     Returns:
         list[tuple[Tag, int]]: sorted list of tuples containing tag and int objects
     """
-    tag_info_tuple = []
+    cache_key = tag_xp_cache_key(user.id)
+    tag_info_tuple = cache.get(cache_key)
+    if tag_info_tuple is not None:
+        return tag_info_tuple
 
     # append tag object and tag xp to tag_info_tuple
-    user_related_tags = get_tags_from_user(user)
-    for tag in user_related_tags:
-        total_xp = total_xp_by_tags(user, [tag])
-        tag_info_tuple.append((tag, total_xp))
+    xp_by_tag = get_tag_xp_by_user([user]).get(user.id, {})
+    tag_info_tuple = [(tag, xp_by_tag.get(tag.id, 0)) for tag in get_tags_from_user(user)]
 
     # sort by total xp (descending order) then return
-    return sorted(tag_info_tuple, key=lambda tag_tuple: tag_tuple[1])[::-1]
+    tag_info_tuple = sorted(tag_info_tuple, key=lambda tag_tuple: tag_tuple[1])[::-1]
+    cache.set(cache_key, tag_info_tuple, TAG_XP_TIMEOUT)
+    return tag_info_tuple
+
+
+@receiver([post_save, post_delete], sender='quest_manager.QuestSubmission', dispatch_uid='tags.models.invalidate_submission_tag_xp')
+@receiver([post_save, post_delete], sender='badges.BadgeAssertion', dispatch_uid='tags.models.invalidate_assertion_tag_xp')
+def invalidate_user_tag_xp(sender, instance, **kwargs):
+    invalidate_tag_xp([instance.user_id])
+
+
+# changes to tags, quests, badges or the active semester can affect every user's tags
+@receiver([post_save, post_delete], sender=TaggedItem, dispatch_uid='tags.models.invalidate_tagged_item_tag_xp')
+@receiver(post_save, sender='quest_manager.Quest', dispatch_uid='tags.models.invalidate_quest_tag_xp')
+@receiver(post_save, sender='badges.Badge', dispatch_uid='tags.models.invalidate_badge_tag_xp')
+@receiver(post_save, sender='siteconfig.SiteConfig', dispatch_uid='tags.models.invalidate_siteconfig_tag_xp')
+def invalidate_all_tag_xp(sender, **kwargs):
+    invalidate_tag_xp()
 
 
 class TagsModelMixin(models.Model):
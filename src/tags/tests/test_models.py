@@ -4,10 +4,11 @@ from django.db.utils import ProgrammingError
 
 from model_bakery import baker
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin
 from taggit.models import Tag
 from tags.models import (
     total_xp_by_tags, get_tags_from_user, get_user_tags_and_xp, get_quest_submission_by_tag, get_badge_assertion_by_tags,
-    get_quest_submission_total_xp, get_badge_assertion_total_xp,
+    get_quest_submission_total_xp, get_badge_assertion_total_xp, get_tag_xp_by_user,
 )
 from siteconfig.models import SiteConfig
 from quest_manager.models import Quest, QuestSubmission
@@ -162,7 +163,7 @@ class Tag_get_quest_submission_badge_assertion_by_tag_Tests(TagHelper, TenantTes
         self.assertTrue(assertion_2 in badge_assertion_qs)
 
 
-class Tag_get_user_tags_and_xp_Tests(TagHelper, TenantTestCase):
+class Tag_get_user_tags_and_xp_Tests(TenantTestUtilsMixin, TagHelper, TenantTestCase):
     """
         Specialized TestClass for testing get_user_tags_and_xp function
     """
@@ -281,6 +282,87 @@ class Tag_get_user_tags_and_xp_Tests(TagHelper, TenantTestCase):
         self.assertEqual(total_xp, total_xp_by_tags(self.user, ['tag-1', 'tag-2', 'tag-3']))
         self.assertEqual(total_xp, 17)  # sanity check
 
+    def test_cached_until_approval(self):
+        """ get_user_tags_and_xp is cached, and a new approved submission for the user invalidates it """
+        quest, _ = self.create_quest_and_submissions(2)
+        quest.tags.add('tag-1')
+
+        self.assertEqual([(t.name, xp) for t, xp in get_user_tags_and_xp(self.user)], [('tag-1', 2)])
+        with self.assertNumTenantQueries(0):
+            get_user_tags_and_xp(self.user)
+
+        baker.make(
+            QuestSubmission,
+            quest=quest,
+            user=self.user,
+            is_completed=True,
+            is_approved=True,
+            semester=SiteConfig().get().active_semester,
+        )
+        self.assertEqual([(t.name, xp) for t, xp in get_user_tags_and_xp(self.user)], [('tag-1', 4)])
+
+    def test_cache_invalidated_by_new_tag(self):
+        """ Tagging a quest changes the tags of every user who completed it """
+        quest, _ = self.create_quest_and_submissions(2)
+        self.assertEqual(get_user_tags_and_xp(self.user), [])
+
+        quest.tags.add('tag-1')
+        self.assertEqual([(t.name, xp) for t, xp in get_user_tags_and_xp(self.user)], [('tag-1', 2)])
+
+
+class Tag_get_tag_xp_by_user_Tests(TenantTestUtilsMixin, TagHelper, TenantTestCase):
+    """
+        Specialized TestClass for testing get_tag_xp_by_user function
+    """
+
+    def setUp(self):
+        self.user = baker.make(User)
+
+    def test_matches_total_xp_by_tags(self):
+        """
+            xp per tag should match total_xp_by_tags for quests, badges, crossing tags and max_xp
+        """
+        quest1, _ = self.create_quest_and_submissions(2)
+        quest1.tags.add('tag-1', 'tag-2')
+
+        quest2, _ = self.create_quest_and_submissions(50, quest_submission_quantity=3)
+        quest2.max_xp = 100
+        quest2.save()
+        quest2.tags.add('tag-2')
+
+        badge1, _ = self.create_badge_and_assertions(3, badge_assertion_quantity=2)
+        badge1.tags.add('tag-1', 'tag-3')
+
+        xp_by_tag = get_tag_xp_by_user([self.user])[self.user.id]
+        for tag in Tag.objects.filter(name__in=['tag-1', 'tag-2', 'tag-3']):
+            self.assertEqual(xp_by_tag[tag.id], total_xp_by_tags(self.user, [tag.name]))
+        self.assertEqual(xp_by_tag[Tag.objects.get(name='tag-2').id], 102)  # sanity check
+
+    def test_multiple_users(self):
+        """
+            xp is grouped per user, and users without xp in any tag are left out
+        """
+        quest, _ = self.create_quest_and_submissions(5)
+        quest.tags.add('tag-1')
+        tag = Tag.objects.get(name='tag-1')
+
+        other_user = baker.make(User)
+        baker.make(
+            QuestSubmission,
+            quest=quest,
+            user=other_user,
+            is_completed=True,
+            is_approved=True,
+            semester=SiteConfig().get().active_semester,
+            _quantity=2,
+        )
+        no_xp_user = baker.make(User)
+
+        with self.assertNumTenantQueries(2):
+            tag_xp = get_tag_xp_by_user([self.user, other_user, no_xp_user])
+
+        self.assertEqual(tag_xp, {self.user.id: {tag.id: 5}, other_user.id: {tag.id: 10}})
+
 
 class Tag_get_tags_from_user_Tests(TagHelper, TenantTestCase):
     """
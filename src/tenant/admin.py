@@ -139,7 +139,9 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
     delete_selected_confirmation_template = 'admin/tenant/tenant/delete_selected_confirmation.html'
     delete_confirmation_template = 'admin/tenant/tenant/delete_confirmation.html'
 
-    actions = ['message_unverified', 'message_verified', 'enable_google_signin', 'disable_google_signin']
+    actions = [
+        'message_unverified', 'message_verified', 'enable_google_signin', 'disable_google_signin', 'refresh_cached_fields',
+    ]
 
     @admin.display(description="owner full name")
     def owner_full_name_text(self, obj):
@@ -164,15 +166,8 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
         """
         if obj.schema_name == get_public_schema_name():
             return  # skip public schema
-
-        with tenant_context(obj):
-            owner = SiteConfig.get().deck_owner
-            # get the email address, but only primary and verified
-            for primary_email_address in EmailAddress.objects.filter(user=owner, primary=True, verified=True):
-                # make sure it's primary email for real
-                if primary_email_address.email == user_email(owner):
-                    return True
-        return False
+        return obj.owner_email_verified_cached
+    owner_email_verified_boolean.admin_order_field = "owner_email_verified_cached"
 
     @admin.display(description="owner email (DEPRECATED)")
     def owner_email_deprecated(self, obj):
@@ -214,17 +209,6 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
             del actions["delete_selected"]
         return actions
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        # Update cached fields
-        #
-        # FIX: reduce number of SQL queries by triggering this only when Tenant (and/or related) objects are changed
-        for tenant in qs:
-            if tenant.name != get_public_schema_name():
-                with tenant_context(tenant):
-                    tenant.update_cached_fields()
-        return qs
-
     def delete_model(self, request, obj):
         # for reference: https://django-tenants.readthedocs.io/en/stable/use.html#deleting-a-tenant
         obj.delete(force_drop=False)  # delete model, but *DO NOT* drop schema
@@ -427,6 +411,23 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
             },
         )
 
+    @admin.action(description="Refresh the owner, user and quest columns for the selected tenant(s) now")
+    def refresh_cached_fields(self, request, queryset):
+        """
+        The cached columns are updated hourly by the `update_cached_fields_for_all_tenants` task,
+        this updates them right away for the selected tenant(s).
+        """
+        updated_count = Tenant.objects.update_cached_fields(queryset)
+        self.message_user(
+            request,
+            ngettext(
+                "%d tenant was refreshed.",
+                "%d tenants were refreshed.",
+                updated_count,
+            ) % updated_count,
+            messages.SUCCESS,
+        )
+
     @admin.action(description="Enable google signin for tenant(s)")
     def enable_google_signin(self, request, queryset):
         from siteconfig.models import SiteConfig
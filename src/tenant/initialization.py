@@ -5,6 +5,7 @@ among other issues
 """
 
 import os
+from datetime import date
 
 from django.conf import settings
 
@@ -13,9 +14,10 @@ from django.contrib.staticfiles import finders
 from django.core.files import File
 from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 from django_tenants.utils import get_public_schema_name
 
-from courses.models import Grade, Rank, Course, Block, MarkRange
+from courses.models import Grade, Rank, Course, Block, MarkRange, default_end_date
 from quest_manager.models import Quest, Category
 from badges.models import Badge, BadgeType, BadgeRarity
 from prerequisites.models import Prereq
@@ -49,6 +51,19 @@ def load_initial_tenant_data():
     create_orientation_campaign()
 
 
+def load_cloned_tenant_data():
+    """ Tenants cloned from the template schema (see `tenant.utils.update_tenant_template`) already have all the
+    initial data, only the data that depends on the tenant, or on the day it was created, needs to be updated.
+    """
+
+    if connection.schema_name == get_public_schema_name():
+        return
+
+    User.objects.update(date_joined=timezone.now())
+    set_site_config_name(SiteConfig.get())
+    update_initial_semester()
+
+
 def set_initial_icons(object_list):
     """
     Sets the icons for a list of objects.  Each object's model must have `name` and `icon` fields.
@@ -115,13 +130,28 @@ def create_users():
 def create_site_config_object():
     """ Create the single SiteConfig object for this tenant and provide sensible defaults"""
     config = SiteConfig.objects.create()
-    name = Tenant.get().name.replace("_", " ").replace("-", " ").title()
+    set_site_config_name(config)
+
+
+def set_site_config_name(config):
+    """ Name the deck after the tenant.  The template schema that tenants are cloned from isn't a tenant,
+    so its deck keeps the default name."""
+    tenant = Tenant.objects.filter(schema_name=connection.schema_name).first()
+    name = tenant.name.replace("_", " ").replace("-", " ").title() if tenant else ""
     if name:
         config.site_name = f"{name} Deck"
         config.site_name_short = name
         config.save()
 
 
+def update_initial_semester():
+    """ The initial semester starts on the day the deck is created """
+    semester = SiteConfig.get().active_semester
+    semester.first_day = date.today()
+    semester.last_day = default_end_date()
+    semester.save()
+
+
 def create_initial_course():
     Course.objects.create(title="Default")
 
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0014_auto_20231116_0308'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='owner_email_verified_cached',
+            field=models.BooleanField(default=False, editable=False, help_text="This is a cached field: whether the Deck Owner's primary email address has been verified."),
+        ),
+    ]
@@ -3,13 +3,14 @@ from datetime import date
 
 from django.apps import apps
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models
 from django.utils.timezone import timedelta
 from django.contrib.auth import get_user_model
 
 from allauth.account.utils import user_email
 from allauth.account.models import EmailAddress
 from django_tenants.models import DomainMixin, TenantMixin
+from django_tenants.utils import get_creation_fakes_migrations, get_public_schema_name, schema_exists
 
 from hackerspace_online import settings
 
@@ -40,6 +41,110 @@ def default_trial_end_date():
     return date.today() + timedelta(days=60)
 
 
+class TenantManager(models.Manager):
+
+    # number of schemas whose stats are gathered in a single UNION ALL statement
+    CACHED_FIELDS_BATCH_SIZE = 50
+
+    CACHED_FIELDS = [
+        'owner_full_name_cached', 'owner_email_cached', 'owner_email_verified_cached',
+        'active_user_count', 'total_user_count', 'quest_count', 'last_staff_login', 'google_signon_enabled',
+    ]
+
+    def _cached_fields_sql(self, schema_name):
+        """
+        Returns the SQL that gathers, in one row, the same stats as the `Tenant.get_*` methods for the schema,
+        so several schemas can be read with one statement instead of switching to each of them.
+        """
+        SiteConfig = apps.get_model('siteconfig', 'SiteConfig')
+        CourseStudent = apps.get_model('courses', 'CourseStudent')
+        Quest = apps.get_model('quest_manager', 'Quest')
+
+        def table(model):
+            return f'{connection.ops.quote_name(schema_name)}.{connection.ops.quote_name(model._meta.db_table)}'
+
+        return f"""
+            (SELECT %s AS schema_name,
+                owner.first_name, owner.last_name, owner.username, owner.email,
+                EXISTS(
+                    SELECT 1 FROM {table(EmailAddress)} address
+                    WHERE address.user_id = owner.id AND address.email = owner.email
+                ) AS owner_email_exists,
+                EXISTS(
+                    SELECT 1 FROM {table(EmailAddress)} address
+                    WHERE address.user_id = owner.id AND address.email = owner.email
+                    AND address."primary" AND address.verified
+                ) AS owner_email_verified,
+                (SELECT COUNT(*) FROM {table(User)} WHERE is_staff) AS staff_count,
+                (SELECT COUNT(*) FROM {table(User)} WHERE is_active AND id IN (
+                    SELECT user_id FROM {table(CourseStudent)} WHERE semester_id = config.active_semester_id
+                )) AS active_student_count,
+                (SELECT COUNT(*) FROM {table(User)}) AS total_user_count,
+                (SELECT COUNT(*) FROM {table(Quest)} WHERE NOT archived) AS quest_count,
+                (SELECT MAX(last_login) FROM {table(User)} WHERE is_staff AND username <> %s) AS last_staff_login,
+                config.enable_google_signin
+            FROM {table(SiteConfig)} config
+            INNER JOIN {table(User)} owner ON owner.id = config.deck_owner_id
+            ORDER BY config.id
+            LIMIT 1)
+        """
+
+    def update_cached_fields(self, tenants=None):
+        """
+        Updates the cached fields of the tenants (all of them by default) so Django Admin displays the latest values.
+
+        Gives the same results as `Tenant.update_cached_fields`, but instead of switching to every schema and running
+        ~8 queries in each, the stats of `CACHED_FIELDS_BATCH_SIZE` schemas are gathered with a single statement
+        and the tenants are saved with `bulk_update`.
+
+        Returns:
+            int: the number of tenants updated
+        """
+        if tenants is None:
+            tenants = self.get_queryset()
+        tenants = {
+            tenant.schema_name: tenant
+            for tenant in tenants if tenant.schema_name != get_public_schema_name()
+        }
+
+        # skip tenants whose schema hasn't been created (yet)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT schema_name FROM information_schema.schemata WHERE schema_name = ANY(%s) ORDER BY schema_name",
+                [list(tenants)],
+            )
+            schema_names = [row[0] for row in cursor.fetchall()]
+
+        updated = []
+        for start in range(0, len(schema_names), self.CACHED_FIELDS_BATCH_SIZE):
+            batch = schema_names[start:start + self.CACHED_FIELDS_BATCH_SIZE]
+            sql = " UNION ALL ".join(self._cached_fields_sql(schema_name) for schema_name in batch)
+            params = []
+            for schema_name in batch:
+                params += [schema_name, settings.TENANT_DEFAULT_ADMIN_USERNAME]
+
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+            for row in rows:
+                tenant = tenants[row['schema_name']]
+                # same as User.get_full_name(), falling back to the username
+                tenant.owner_full_name_cached = f"{row['first_name']} {row['last_name']}".strip() or row['username']
+                tenant.owner_email_cached = row['email'] if row['owner_email_exists'] else None
+                tenant.owner_email_verified_cached = row['owner_email_verified']
+                tenant.active_user_count = row['staff_count'] + row['active_student_count']
+                tenant.total_user_count = row['total_user_count']
+                tenant.quest_count = row['quest_count']
+                tenant.last_staff_login = row['last_staff_login']
+                tenant.google_signon_enabled = row['enable_google_signin']
+                updated.append(tenant)
+
+        self.bulk_update(updated, self.CACHED_FIELDS, batch_size=self.CACHED_FIELDS_BATCH_SIZE)
+        return len(updated)
+
+
 class Tenant(TenantMixin):
     # for reference: https://django-tenants.readthedocs.io/en/stable/use.html#deleting-a-tenant
     #
@@ -101,6 +206,10 @@ class Tenant(TenantMixin):
         null=True, blank=True, editable=False,
         help_text="This is a cached field: the verified email address of the Deck Owner (set in each deck's Site Config) will be used."
     )
+    owner_email_verified_cached = models.BooleanField(
+        default=False, editable=False,
+        help_text="This is a cached field: whether the Deck Owner's primary email address has been verified."
+    )
 
     active_user_count = models.PositiveSmallIntegerField(
         default=0,
@@ -129,6 +238,8 @@ class Tenant(TenantMixin):
     )
     # END CALCULATED / CACHED FIELDS ##################################
 
+    objects = TenantManager()
+
     def __str__(self):
         return f'{self.schema_name} - {self.primary_domain_url}'
 
@@ -139,12 +250,24 @@ class Tenant(TenantMixin):
 
         super().save(*args, **kwargs)
 
+    def create_schema(self, check_if_exists=False, sync_schema=True, verbosity=1):
+        """
+        When `TENANT_CREATION_FAKES_MIGRATIONS` is set, django-tenants creates the schema by cloning `TENANT_BASE_SCHEMA`
+        and faking all the migrations, so make sure the template schema exists and is fully migrated first.
+        """
+        if sync_schema and get_creation_fakes_migrations() and not (check_if_exists and schema_exists(self.schema_name)):
+            from tenant.utils import update_tenant_template
+            update_tenant_template(verbosity=verbosity)
+
+        return super().create_schema(check_if_exists=check_if_exists, sync_schema=sync_schema, verbosity=verbosity)
+
     def update_cached_fields(self):
         """
         Updates the cached fields for the tenant so Django Admin displays the latest values.
         """
         self.owner_full_name_cached = self.get_owner_full_name_cached()
         self.owner_email_cached = self.get_owner_email_cached()
+        self.owner_email_verified_cached = self.get_owner_email_verified_cached()
         self.active_user_count = self.get_active_user_count()
         self.total_user_count = self.get_total_user_count()
         self.quest_count = self.get_quest_count()
@@ -177,6 +300,20 @@ class Tenant(TenantMixin):
                 email = owner.email
         return email
 
+    def get_owner_email_verified_cached(self):
+        """
+        Returns whether the primary email address of the SiteConfig().deck_owner object has been verified.
+        """
+        SiteConfig = apps.get_model('siteconfig', 'SiteConfig')
+        owner = SiteConfig.get().deck_owner
+
+        # get the email address, but only primary and verified
+        for primary_email_address in EmailAddress.objects.filter(user=owner, primary=True, verified=True):
+            # make sure it's primary email for real
+            if primary_email_address.email == user_email(owner):
+                return True
+        return False
+
     def get_google_signon_enabled(self):
         """
         Returns whether Google signon has been enabled for this tenant by accessing the tenant's SiteConfig option
@@ -1,14 +1,18 @@
 from django.conf import settings
 from django.db import connection
 
-from django_tenants.utils import get_public_schema_name
+from django_tenants.utils import get_creation_fakes_migrations, get_public_schema_name
 
-from .initialization import load_initial_tenant_data
+from .initialization import load_cloned_tenant_data, load_initial_tenant_data
 
 
 def initialize_tenant_with_data(sender, tenant, **kwargs):
     connection.set_tenant(tenant)
-    load_initial_tenant_data()
+    if get_creation_fakes_migrations():
+        # the schema was cloned from the template schema, which already has the initial data
+        load_cloned_tenant_data()
+    else:
+        load_initial_tenant_data()
 
 
 def tenant_save_callback(sender, instance, **kwargs):
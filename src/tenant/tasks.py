@@ -5,6 +5,8 @@ from django.template.loader import get_template
 from hackerspace_online.celery import app
 from utilities.html import textify
 
+from .models import Tenant
+
 
 @app.task(name="tenant.tasks.send_email_message")
 def send_email_message(subject, message, recipient_list, **kwargs):
@@ -24,3 +26,11 @@ def send_email_message(subject, message, recipient_list, **kwargs):
     )
     email.attach_alternative(msg, "text/html")
     email.send()
+
+
+@app.task(name="tenant.tasks.update_cached_fields_for_all_tenants")
+def update_cached_fields_for_all_tenants():
+    """
+    Gathers the stats of every tenant, so Django Admin can list and filter tenants without visiting each schema.
+    """
+    return Tenant.objects.update_cached_fields()
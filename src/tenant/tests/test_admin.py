@@ -148,6 +148,9 @@ class PublicTenantTestAdminPublic(TenantTestCase):
                 email_address.verified = True
                 email_address.save()
 
+        # the admin only reads the cached columns, normally they are updated by a periodic task
+        Tenant.objects.update_cached_fields()
+
         self.client = TenantClient(self.public_tenant)
 
     def test_owner_full_name_text_column(self):
@@ -277,6 +280,57 @@ class PublicTenantTestAdminPublic(TenantTestCase):
         # confirm the search returned zero objects (by full name)
         self.assertContains(response, "0 result")
 
+    def test_owner_email_verified_boolean_column(self):
+        """
+        The "email verified" column reads the cached value, it is False for the tenant with an unverified email.
+        """
+        self.assertTrue(self.tenant_model_admin.owner_email_verified_boolean(Tenant.objects.get(pk=self.extra_tenant.pk)))
+        self.assertFalse(self.tenant_model_admin.owner_email_verified_boolean(Tenant.objects.get(pk=self.tenant.pk)))
+        self.assertIsNone(self.tenant_model_admin.owner_email_verified_boolean(self.public_tenant))
+
+    def test_changelist_does_not_update_cached_fields(self):
+        """
+        Loading the changelist doesn't visit every schema to update the cached columns, those are updated by
+        the `update_cached_fields_for_all_tenants` task or the `refresh_cached_fields` action.
+        """
+        with tenant_context(self.extra_tenant):
+            User.objects.create(username="new_student")
+
+        with tenant_context(self.public_tenant):
+            self.client.force_login(self.superuser)
+        response = self.client.get(reverse("admin:{}_{}_changelist".format("tenant", "tenant")))
+        self.assertEqual(response.status_code, 200)
+
+        self.extra_tenant.refresh_from_db()
+        total_user_count = self.extra_tenant.total_user_count
+        with tenant_context(self.extra_tenant):
+            self.assertEqual(User.objects.count(), total_user_count + 1)
+
+    @patch("tenant.admin.messages.add_message")
+    def test_refresh_cached_fields_action(self, mock_add_message):
+        """
+        The refresh_cached_fields action updates the cached columns of the selected tenants right away.
+        """
+        with tenant_context(self.extra_tenant):
+            User.objects.create(username="new_student")
+        with tenant_context(self.tenant):
+            User.objects.create(username="new_student")
+        self.tenant.refresh_from_db()
+        tenant_total_user_count = self.tenant.total_user_count
+
+        request = RequestFactory().get('/')
+        queryset = Tenant.objects.filter(pk=self.extra_tenant.pk)
+        with tenant_context(self.public_tenant):
+            self.tenant_model_admin.refresh_cached_fields(request=request, queryset=queryset)
+        mock_add_message.assert_called()
+
+        # only the selected tenant was updated
+        self.extra_tenant.refresh_from_db()
+        with tenant_context(self.extra_tenant):
+            self.assertEqual(self.extra_tenant.total_user_count, User.objects.count())
+        self.tenant.refresh_from_db()
+        self.assertEqual(self.tenant.total_user_count, tenant_total_user_count)
+
     @patch("tenant.admin.messages.add_message")
     def test_enable_google_signin_admin_without_config(self, mock_add_message):
         """
@@ -1,10 +1,19 @@
+from datetime import date
+
 from django_tenants.test.cases import TenantTestCase
+from django_tenants.utils import get_public_schema_name, schema_context, schema_exists, tenant_context
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.test import override_settings
+from model_bakery import baker
 
 from badges.models import Badge, BadgeRarity, BadgeType
 from courses.models import Block, Course, Grade, MarkRange, Rank
 from quest_manager.models import Category, Quest
+from siteconfig.models import SiteConfig
+from tenant.models import Tenant
+from tenant.utils import update_tenant_template
 from utilities.models import MenuItem
 
 
@@ -170,3 +179,38 @@ class TenantInitializationTest(TenantTestCase):
         self.assertTrue(site_config is not None)
         self.assertEqual(site_config.site_name, "My Byte Deck")
         self.assertEqual(site_config.site_name_short, "Deck")
+
+
+class TenantCloneInitializationTest(TenantTestCase):
+    """ With TENANT_CREATION_FAKES_MIGRATIONS set, new tenants are cloned from a template schema """
+
+    # TenantTestCase doesn't apply settings overridden on the class, only on the tests
+    @override_settings(TENANT_CREATION_FAKES_MIGRATIONS=True, TENANT_BASE_SCHEMA='_test_tenant_template')
+    def test_tenant_cloned_from_template(self):
+        """ Creating a tenant creates the template schema, then clones it and only updates the tenant's data """
+        with schema_context(get_public_schema_name()):
+            self.assertFalse(schema_exists('_test_tenant_template'))
+            tenant = Tenant(name='clone')
+            tenant.save()
+            self.assertTrue(schema_exists('_test_tenant_template'))
+            self.assertTrue(schema_exists(tenant.schema_name))
+
+        # the template isn't a tenant, so its deck keeps the default name
+        with schema_context('_test_tenant_template'):
+            self.assertEqual(SiteConfig.objects.get().site_name, "My Byte Deck")
+
+        with tenant_context(tenant):
+            config = SiteConfig.objects.get()
+            self.assertEqual(config.site_name, "Clone Deck")
+            self.assertEqual(config.active_semester.first_day, date.today())
+            self.assertEqual(Tenant.get(), tenant)
+            self.assertTrue(User.objects.filter(username=settings.TENANT_DEFAULT_OWNER_USERNAME).exists())
+            self.assertTrue(Quest.objects.filter(name="Welcome to ByteDeck!").exists())
+            self.assertEqual(Site.objects.get().domain, tenant.get_primary_domain().domain)
+
+            # the sequences were cloned too
+            last_pk = Quest.objects.latest('pk').pk
+            self.assertGreater(baker.make(Quest).pk, last_pk)
+
+        # already up to date
+        self.assertFalse(update_tenant_template())
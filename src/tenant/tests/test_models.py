@@ -1,18 +1,24 @@
+from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 
+from allauth.account.models import EmailAddress
 from django_tenants.test.cases import TenantTestCase
-from django_tenants.utils import get_public_schema_name, schema_context
+from django_tenants.utils import get_public_schema_name, schema_context, schema_exists
 from model_bakery import baker
 from hackerspace_online import settings
 
+from hackerspace_online.tests.utils import TenantTestUtilsMixin, tenant_queries
+from quest_manager.models import Quest
 from tenant.models import Tenant, check_tenant_name
 
 User = get_user_model()
 
 
-class TenantModelTest(TenantTestCase):
+class TenantModelTest(TenantTestUtilsMixin, TenantTestCase):
 
     def setUp(self):
         # TenantTestCase comes with a `self.tenant` already, but let make another so we can test development
@@ -66,6 +72,51 @@ class TenantModelTest(TenantTestCase):
         # should still return the staff user's last log in, ignoring the admin user
         self.assertEqual(self.tenant.last_staff_login, staff.last_login)
 
+    def test_manager_update_cached_fields(self):
+        """ The cached fields gathered for all tenants with batched statements are the same as the ones
+        gathered by visiting the tenant's schema with `update_cached_fields`
+        """
+        SiteConfig = apps.get_model('siteconfig', 'SiteConfig')
+        config = SiteConfig.get()
+        config.deck_owner.first_name = "Jane"
+        config.deck_owner.save()
+        EmailAddress.objects.add_email(request=None, user=config.deck_owner, email="jane@doe.com").set_as_primary()
+
+        staff = baker.make(User, is_staff=True)
+        self.client.force_login(staff)
+        students = baker.make(User, _quantity=3)
+        baker.make('courses.CourseStudent', user=students[0], semester=config.active_semester)
+        baker.make('courses.CourseStudent', user=students[1], semester=config.active_semester)
+        baker.make('courses.CourseStudent', user=students[2], semester=baker.make('courses.Semester'))
+        baker.make('quest_manager.Quest', archived=True)
+        baker.make('quest_manager.Quest', _quantity=2)
+
+        with schema_context(get_public_schema_name()):
+            # the schema of tenants created with bulk_create doesn't exist, they are skipped
+            # other test cases can leave tenants behind, so don't assume this one and the localhost one are the only ones
+            num_tenants = len([
+                tenant for tenant in Tenant.objects.exclude(schema_name=get_public_schema_name())
+                if schema_exists(tenant.schema_name)
+            ])
+            Tenant.objects.bulk_create([Tenant(schema_name='no_schema', name='no-schema')])
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(Tenant.objects.update_cached_fields(), num_tenants)
+        # the tenants, their schemas, the stats of all tenants in one statement, and the bulk update
+        self.assertEqual(len(tenant_queries(context)), 4)
+        batched = Tenant.objects.get(pk=self.tenant.pk)
+
+        # a fresh instance, so the class level `self.tenant` isn't changed for the other tests
+        tenant = Tenant.objects.get(pk=self.tenant.pk)
+        tenant.update_cached_fields()
+        for field in Tenant.objects.CACHED_FIELDS:
+            self.assertEqual(getattr(batched, field), getattr(tenant, field), field)
+
+        self.assertEqual(batched.owner_full_name_cached, f"Jane {config.deck_owner.last_name}".strip())
+        self.assertEqual(batched.owner_email_cached, "jane@doe.com")
+        self.assertFalse(batched.owner_email_verified_cached)
+        self.assertEqual(batched.active_user_count, User.objects.filter(is_staff=True).count() + 2)
+        self.assertEqual(batched.quest_count, Quest.objects.filter(archived=False).count())
+
 
 class CheckTenantNameTest(SimpleTestCase):
     """ A tenant's name is used for both the schema_name and as the subdomain in the
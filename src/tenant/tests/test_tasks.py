@@ -1,8 +1,13 @@
+from django.contrib.auth import get_user_model
 from django.core import mail
 
 from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
 
 from tenant import tasks
+from tenant.models import Tenant
+
+User = get_user_model()
 
 
 class TenantTasksTests(TenantTestCase):
@@ -29,3 +34,21 @@ class TenantTasksTests(TenantTestCase):
         self.assertEqual(mail.outbox[0].subject, "O hi, World!")
         # john doe was first in a list of recipients (BCC)
         self.assertIn("john@doe.com", mail.outbox[0].bcc)
+
+    def test_update_cached_fields_for_all_tenants(self):
+        """Async. task "update_cached_fields_for_all_tenants" updates the cached fields of the tenants."""
+        baker.make(User, is_staff=True, _quantity=2)
+        baker.make(User, _quantity=3)
+
+        task_result = tasks.update_cached_fields_for_all_tenants.apply()
+        self.assertTrue(task_result.successful())
+        self.assertGreaterEqual(task_result.result, 1)
+
+        self.tenant.refresh_from_db()
+        self.assertEqual(self.tenant.total_user_count, User.objects.count())
+        self.assertEqual(self.tenant.active_user_count, User.objects.filter(is_staff=True).count())
+
+        # the public tenant is skipped
+        public_tenant = Tenant.objects.filter(schema_name="public").first()
+        if public_tenant:
+            self.assertEqual(public_tenant.total_user_count, 0)
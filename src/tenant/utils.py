@@ -1,3 +1,10 @@
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+from django_tenants.clone import CloneSchema
+from django_tenants.utils import get_tenant_base_schema, schema_exists
+
 from .models import Tenant
 
 
@@ -17,3 +24,63 @@ def get_root_url():
 
 def generate_schema_name(tenant_name):
     return tenant_name.replace('-', '_').lower()
+
+
+def get_tenant_template_migration_plan(schema_name):
+    """
+    Returns the migrations that haven't been applied to the template schema yet.
+    """
+    connection.set_schema(schema_name, include_public=False)
+    try:
+        executor = MigrationExecutor(connection)
+        return executor.migration_plan(executor.loader.graph.leaf_nodes())
+    finally:
+        connection.set_schema_to_public()
+
+
+def update_tenant_template(verbosity=0):
+    """
+    When `TENANT_CREATION_FAKES_MIGRATIONS` is set, new tenants are created by cloning the `TENANT_BASE_SCHEMA` schema
+    and faking all their migrations.  This creates that template schema, migrated and initialized with
+    `load_initial_tenant_data` like a new tenant would be, or migrates it if there are new migrations.
+
+    The template isn't a Tenant, so it isn't listed in the admin nor visited by the tasks that run in every schema.
+    The data that depends on the tenant is updated after cloning, by `load_cloned_tenant_data`.
+
+    Returns:
+        bool: True if the template was created or migrated
+    """
+    from .initialization import load_initial_tenant_data  # prevent circular imports
+
+    schema_name = get_tenant_base_schema()
+    created = not schema_exists(schema_name)
+    updated = created or bool(get_tenant_template_migration_plan(schema_name))
+
+    if created:
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {connection.ops.quote_name(schema_name)}")
+
+    if updated:
+        try:
+            call_command('migrate_schemas', tenant=True, schema_name=schema_name, interactive=False, verbosity=verbosity)
+            if created:
+                connection.set_schema(schema_name)
+                load_initial_tenant_data()
+        except Exception:
+            # don't leave a half created template behind, it would be cloned as is
+            if created:
+                connection.set_schema_to_public()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DROP SCHEMA {connection.ops.quote_name(schema_name)} CASCADE")
+            raise
+        finally:
+            connection.set_schema_to_public()
+
+    # django-tenants creates the clone_schema() function the first time a schema is cloned, and commits right after,
+    # which isn't allowed inside an atomic block (e.g. a TenantCreate request), so create it ahead of time
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regprocedure('public.clone_schema(text, text, boolean, boolean)')")
+        if cursor.fetchone()[0] is None:
+            CloneSchema()._create_clone_schema_function()
+
+    return updated